@@ -12,10 +12,17 @@ import sys
 import os
 from oisc3_parser import Parser
 from oisc3_vm import Oisc3VM
-try:
-    from getch import getch, getche         # Linux
-except ImportError:
-    from msvcrt import getch, getche        # Windows
+from oisc3_profile import Profiler
+from oisc3_blocks import BlockEngine
+from oisc3_verify import verify
+from oisc3_trace import Tracer, format_trace
+from oisc3_optimize import optimize
+from oisc3_heatmap import Heatmap
+from oisc3_aot import compile_program
+from oisc3_memory import CompactMemory
+from oisc3_image import write_image, load_image, is_image
+from oisc3_cache import AssemblyCache, assemble
+from oisc3_io import getche, BufferedOutput, StreamInput
 
 
 def Write_o3c(o3c_file, mem, neg0):
@@ -44,53 +51,167 @@ def Write_o3c(o3c_file, mem, neg0):
 
 
 
-def Oisc3(args):
+def Switch(switches, name, default=None):       # "--name=value" -> value
+    for switch in switches:
+        if switch.startswith(name + "="):
+            return switch[len(name) + 1:]
+    return default
+
+
+def Input(switches):
+    name = Switch(switches, "--input")
+    if name is None:
+        return None                     # the keyboard
+    if name == "-":
+        return StreamInput(sys.stdin)
+    with open(name, "rb") as input_file:
+        return StreamInput(input_file.read())
+
+
+def Output(switches):
+    policy = Switch(switches, "--flush")
+    if policy is not None and policy.isdigit():
+        policy = int(policy)
+    return BufferedOutput(flush=policy)
+
+
+
+def Oisc3(args, switches=()):
     try:
         o3a_name = args[0]
         o3c_name = None
         if len(args) == 2:
             o3c_name = args[1]
-        parser = Parser()
-        vm = Oisc3VM()
+        depth = Switch(switches, "--max-depth")
+        vm = Oisc3VM(input=Input(switches), output=Output(switches), max_depth=int(depth) if depth else None)
+        vm.idioms = "--no-idioms" not in switches
         mem = []
-        with open(o3a_name, "r") as o3a_file:
-            raw = o3a_file.read()
-            mem, neg0 = parser.parse(raw)
-            o3a_file.close()
-        if  o3c_name != None:
+        raw = None
+        source_map = None
+        if is_image(o3a_name):
+            mem, neg0, labels = load_image(o3a_name)
+        else:
+            with open(o3a_name, "r") as o3a_file:
+                raw = o3a_file.read()
+                o3a_file.close()
+            if "--optimize" in switches:
+                # needs every word holding an address, which isn't cached
+                parser = Parser()
+                mem, neg0 = parser.parse(raw, relocatable=True)
+                mem, neg0, labels, source_map, counts = optimize(mem, neg0, parser.relocations,
+                                                                  parser.label_table, parser.source_map)
+                if counts is None:
+                    print("Not optimized:  the program doesn't verify, or its code is written while it runs\n", flush=True)
+                else:
+                    print("Optimized:  {threaded} threaded, {jumps} jumps dropped, {folded} lit- folded, "
+                          "{zeroing} zeroing dropped, {words} words saved\n".format(**counts), flush=True)
+                if "--compact" in switches:
+                    mem = CompactMemory(mem, neg0)
+            elif "--profile" in switches or "--verify" in switches or Switch(switches, "--trace") is not None:
+                # these need the source map, which isn't cached
+                parser = Parser()
+                mem, neg0 = parser.parse(raw, compact="--compact" in switches)
+                labels = parser.label_table
+                source_map = parser.source_map
+            else:
+                cache = None
+                if "--no-cache" not in switches:
+                    cache = AssemblyCache()
+                mem, neg0, labels = assemble(raw, cache, compact="--compact" in switches)
+        if  o3c_name != None and o3c_name.endswith(".o3i"):
+            with open(o3c_name, "wb") as o3i_file:
+                write_image(o3i_file, mem, neg0, labels)
+        elif o3c_name != None:
             with open(o3c_name, "w") as o3c_file:
-                Write_o3c(o3c_file, mem, neg0)
+                if isinstance(mem, list):
+                    Write_o3c(o3c_file, mem, neg0)
+                else:
+                    Write_o3c(o3c_file, mem.tolist(), neg0)
                 o3c_file.close()
-        vm.do_vm(mem, neg0)
+        aot = Switch(switches, "--aot")
+        if aot is not None:
+            module, why = compile_program(mem if isinstance(mem, list) else mem.tolist(), neg0, labels,
+                                          os.path.basename(o3a_name))
+            if module is None:
+                print(why, "\n")
+                print("Not compiled:  only a program that verifies, so its code never changes, and that uses only the built in coprocessor ops can be compiled", flush=True)
+                return
+            with open(aot, "w") as py_file:
+                py_file.write(module)
+            print("compiled into", aot, flush=True)
+            return
+        engine = None
+        trace = Switch(switches, "--trace")
+        heatmap = "--heatmap" in switches or Switch(switches, "--heatmap") is not None
+        if "--profile" in switches:
+            engine = Profiler()
+        elif trace is not None:
+            engine = Tracer(int(trace), Switch(switches, "--trace-file"), ("fault", "halt"))
+        elif heatmap:
+            engine = Heatmap(int(Switch(switches, "--window", 10000)))
+        elif "--blocks" in switches:
+            engine = BlockEngine()
+        vm.load(mem, neg0)
+        if "--verify" in switches:
+            check = verify(vm)
+            print(check.report(labels, source_map, raw), "\n", flush=True)
+            if check.failures:
+                return
+            check.apply(vm)
+        try:
+            vm.finish(engine)
+        except (ValueError, IndexError):
+            if trace is not None:
+                print("\n")
+                print(format_trace(engine.records()[-20:], engine.recorded, labels, source_map, raw))
+            raise
+        finally:
+            if "--profile" in switches:
+                print("\n")
+                print(engine.report(labels, source_map, raw))
+            elif heatmap:
+                print("\n")
+                print(engine.report(labels))
+                if Switch(switches, "--heatmap") is not None:
+                    engine.save(Switch(switches, "--heatmap"), labels)
     except(ValueError, IndexError):
         print("I just don't know what went wrong!\n")
-        o3a_file.close()
 
 def main(args):
+    switches = [arg for arg in args if arg.startswith("--")]
+    args = [arg for arg in args if not arg.startswith("--")]
     try:
         print()
+        if "--clear-cache" in switches:
+            AssemblyCache().clear()
+            print("assembly cache cleared\n", flush=True)
+            if len(args) == 0:
+                return
         if len(args) == 1:
-            Oisc3(args)
+            Oisc3(args, switches)
         elif len(args) == 2:
             if os.path.isfile(args[1]):
                 print(args[1], "exists.  Overwrite? ", end="", flush=True)
-                answer = getche()
+                if getche is not None:
+                    answer = getche()
+                else:
+                    answer = input()[:1]
                 if answer in ["y", "Y"]:
                     print()
                     print(args[1], "replaced \n\n", flush=True)
-                    Oisc3(args)
+                    Oisc3(args, switches)
                 else:
                     print()
                     print(args[1], "retained \n\n", flush=True)
-                    Oisc3([args[0]])
+                    Oisc3([args[0]], switches)
             else:
                 print("creating", args[1], "\n\n", flush=True)
-                Oisc3(args)
+                Oisc3(args, switches)
         else:
-            print("\nusage: python oisc3.py infile.sla [outfile.slc]\n")
+            print("\nusage: python oisc3.py [--compact] [--optimize] [--aot=out.py] [--no-cache] [--clear-cache] [--profile] [--verify] [--trace=N [--trace-file=out.o3t]] [--heatmap[=out.json] [--window=N]] [--blocks] [--no-idioms] [--max-depth=N] [--input=file] [--flush=line|halt|N] infile.o3a [outfile.o3c | outfile.o3i]\n")
     except FileNotFoundError:
         print("\n< *Peter_Lorre* >\nYou eediot!  What were you theenking?\nTry it again, but thees time with a valid file name!\n</ *Peter_Lorre* >\n")
-        print("\nusage: python oisc3.py infile.o3a [outfile.o3c]\n")
+        print("\nusage: python oisc3.py [--compact] [--optimize] [--aot=out.py] [--no-cache] [--clear-cache] [--profile] [--verify] [--trace=N [--trace-file=out.o3t]] [--heatmap[=out.json] [--window=N]] [--blocks] [--no-idioms] [--max-depth=N] [--input=file] [--flush=line|halt|N] infile.o3a [outfile.o3c | outfile.o3i]\n")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# OISC:3 ahead-of-time compiler
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   compile_program() turns an assembled image into the source of one Python module that
+#   runs the program on its own, without the parser or the VM:
+#
+#   - memory is two lists, pos for 0, 1, 2 ... and neg for -1, -2, -3 ..., local to run()
+#   - code is cut into basic blocks at every call and jump target and after every call and
+#     jump, and run() is a single loop over the address of the next block, dispatched by a
+#     tree of comparisons, so a block is found in log2(blocks) tests
+#   - direct operands become list indexes fixed at compile time, pointers are followed and
+#     bounds checked when they are used, as the VM does
+#   - each exec has its coprocessor op written out inline:  in a program that verifies,
+#     no op word is ever written, or any word could be
+#
+#   That only works for code that never changes, so the program has to pass oisc3_verify:
+#   every call and jump direct and no instruction word ever written.  The module behaves
+#   as the VM does, except that a fault is reported against the block it happened in.
+#   Ops registered from Python (register_op) have no source to write out, so a program that
+#   runs any op not built into the VM is refused, as is one that doesn't verify.
+#
+#   The module's run(input=None, output=None) reads from a string or a file (stdin by
+#   default), writes to a file (stdout by default), and returns "halted" or "fault".
+#   Run it directly as python prog.py, or profile it with python -m cProfile prog.py.
+
+
+import math
+from oisc3_vm import Oisc3VM
+from oisc3_verify import verify
+
+
+#   op number -> the lines that do it, on stack with push and pop bound to it
+UNARY = {-9: "~{}", 14: "math.exp({})", -14: "math.log({})", -15: "float({})",
+         18: "math.sin({})", -18: "math.asin({})", 19: "math.cos({})", -19: "math.acos({})",
+         20: "math.tan({})", -20: "math.atan({})", 21: "math.sinh({})", -21: "math.asinh({})",
+         22: "math.cosh({})", -22: "math.acosh({})", 23: "math.tanh({})", -23: "math.atanh({})"}
+BINARY = {9: "&", 10: "|", -10: "^", 11: "<<", -11: ">>", 12: "*", -12: "/", 13: "//", -13: "%",
+          17: "+", -17: "-"}
+OPS = {
+    0:   ["pass"],
+    1:   ["a = read_char()", "push(ord(a) if a else -1)"],
+    -1:  ["a = pop()", "if a < 0:", "    fail(\"\\n\\nCan't print a negative character!\\n\")", "write(chr(int(a)))"],
+    2:   ["a = read_char()", "if a.isdigit():", "    push(int(a))", "else:",
+          "    if a:", "        note(\"\\nExpected a digit\\n\")", "    push(-1)"],
+    -2:  ["write(str(pop()))"],
+    3:   ["push(stack[-1])"],
+    -3:  ["pop()"],
+    4:   ["push(stack[-2])"],
+    -4:  ["b = pop()", "a = pop()", "push(b)", "push(a)"],
+    5:   ["stack.insert(0, pop())"],
+    -5:  ["push(stack.pop(0))"],
+    6:   ["stack.reverse()"],
+    -6:  ["stack.clear()"],
+    7:   ["push(len(stack))"],
+    -7:  ["a = pop()", "push(stack[-a])"],
+    8:   ["push(-1)"],
+    -8:  ["push(0)"],
+    15:  ["a = pop()", "push(int(a + 0.0000001) if a > 0 else int(a - 0.0000001))"],
+    16:  ["alloc(pop())"],
+    -16: ["free(pop())"],
+    24:  ["n = pop()", "b = pop()", "a = pop()", "values = [at(i) for i in block(a, n)]",
+          "for i, value in zip(block(b, n), values):", "    put(i, value)"],
+    -24: ["value = pop()", "n = pop()", "for i in block(pop(), n):", "    put(i, value)"],
+    25:  ["n = pop()", "b = pop()", "a = pop()", "c = 0", "for i, j in zip(block(a, n), block(b, n)):",
+          "    if at(i) != at(j):", "        c = -1 if at(i) < at(j) else 1", "        break", "push(c)"],
+    -25: ["n = pop()", "push(sum(at(i) for i in block(pop(), n)))"],
+    26:  ["value = pop()", "n = pop()", "c = -1", "for offset, i in enumerate(block(pop(), n)):",
+          "    if at(i) == value:", "        c = offset", "        break", "push(c)"],
+}
+for op, form in UNARY.items():
+    OPS[op] = ["push({})".format(form.format("pop()"))]
+for op, symbol in BINARY.items():
+    OPS[op] = ["b = pop()", "a = pop()", "push(a {} b)".format(symbol)]
+
+
+RUNTIME = '''
+def run(input=None, output=None):
+    #   input:  a string or a file, stdin if None;  output:  a file, stdout if None
+    #   -> "halted" or "fault"
+    if input is None:
+        input = sys.stdin
+    elif type(input) is str:
+        input = io.StringIO(input)
+    output = sys.stdout if output is None else output
+    read = input.read
+    write = output.write
+    pos = list(POS)
+    neg = list(NEG)
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    rstack = []
+
+    def fail(message, error=ValueError):
+        output.flush()
+        print(message, flush=True)
+        raise error
+
+    def note(message):
+        output.flush()
+        print(message, flush=True)
+
+    def read_char():
+        output.flush()
+        return read(1)
+
+    def at(i):
+        return pos[i] if i >= 0 else neg[~i]
+
+    def put(i, value):
+        if i >= 0:
+            pos[i] = value
+        else:
+            neg[~i] = value
+
+    def ind(i):             #   follow a pointer cell, bounds checked every time
+        a = at(i)
+        if a > len(pos) or a < -len(neg) - 1:
+            fail("Indirect memory location {} out of bounds".format(a), IndexError)
+        return a
+
+    def block(a, n):
+        if type(a) is float:
+            a = int(a + 0.0000001) if a > 0 else int(a - 0.0000001)
+        if type(n) is float:
+            n = int(n + 0.0000001) if n > 0 else int(n - 0.0000001)
+        step = 1 if n >= 0 else -1
+        words = range(a, a + n, step)
+        if words and (min(a, a + n - step) < -len(neg) - 1 or max(a, a + n - step) > len(pos)):
+            fail("Memory block {} to {} out of bounds".format(a, a + n - step), IndexError)
+        return words
+
+    def alloc(a):
+        if a > 0:
+            pos.extend([0] * a)
+        elif a < 0:
+            neg.extend([0] * -a)
+
+    def free(a):
+        words = pos if a > 0 else neg
+        n = abs(a)
+        if n > len(words):
+            fail("Can't free {} words, only {} allocated".format(n, len(words)), IndexError)
+        del words[len(words) - n:]
+'''
+
+
+def word(value):                    #   a memory word as Python source
+    if type(value) is float and not math.isfinite(value):
+        return "float('{}')".format(value)
+    return repr(value)
+
+
+class Compiler:
+
+    def __init__(self, mem, neg0):
+        vm = Oisc3VM()
+        vm.load(list(mem), neg0)
+        self.vm = vm
+        self.mem = list(mem)
+        self.neg0 = neg0
+        self.check = verify(vm)
+
+
+    def direct(self, address):      #   -> the source naming a word
+        if address >= 0:
+            return "pos[{}]".format(address)
+        return "neg[{}]".format(~address)
+
+
+    def operands(self, instr, lines, indent):
+        #   -> source for [A], [B], [C], following pointers first, as the VM does
+        kind, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = instr
+        names = []
+        for n, (ref, ind) in enumerate(((a_ref, a_ind), (b_ref, b_ind), (c_ref, c_ind))):
+            if ind:
+                lines.append(indent + "r{} = ind({})".format(n, ref))
+                names.append("at(r{})".format(n))
+            else:
+                names.append(self.direct(ref))
+        return names
+
+
+    def store(self, name, value):   #   -> a statement writing value to the word name reads
+        if name.startswith("at("):
+            return "put({}, {})".format(name[3:-1], value)
+        return "{} = {}".format(name, value)
+
+
+    def instruction(self, p, lines, indent):
+        #   -> True if it ends the block;  adds its source to lines
+        instr = self.vm.decode(p)
+        kind = instr[0]
+        a, b, c = self.operands(instr, lines, indent)
+        c_ref = instr[6]
+        if kind == 0:
+            lines.append(indent + self.store(c, "{} - {}".format(b, a)))
+        elif kind == 1:
+            lines.append(indent + self.store(b, "{} - {}".format(b, word(instr[1]))))
+        elif kind == 2:
+            lines.append(indent + "if {} <= 0:".format(a))
+            lines.append(indent + "    push_return({})".format(p + 3))
+            lines.extend(indent + "    " + line for line in self.go(c_ref))
+            lines.append(indent + "pc = {}".format(p + 3))
+            lines.append(indent + "continue")
+            return True
+        elif kind == 3:
+            lines.append(indent + "push({})".format(a))
+        elif kind == 4:
+            lines.append(indent + "if {} <= 0:".format(b))
+            lines.extend(indent + "    " + line for line in self.go(c_ref))
+            lines.append(indent + "pc = {}".format(p + 3))
+            lines.append(indent + "continue")
+            return True
+        elif kind == 5:
+            lines.append(indent + self.store(b, "pop()"))
+        elif kind == 6:
+            op = self.mem[c_ref] if c_ref >= 0 else self.mem[len(self.mem) + c_ref]
+            lines.append(indent + "# op {}".format(op))
+            for line in OPS[op]:
+                lines.append(indent + line)
+        elif kind == 7:
+            lines.append(indent + "if rstack:")
+            lines.append(indent + "    pc = rstack.pop()")
+            lines.append(indent + "    continue")
+            lines.append(indent + "break")
+            return True
+        return False
+
+
+    def missing(self):              #   -> the ops run by exec that aren't written out here, such as ones registered from Python
+        out = set()
+        for p in self.check.reachable:
+            instr = self.vm.decode(p)
+            if instr[0] == 6:
+                op = self.mem[instr[6]] if instr[6] >= 0 else self.mem[len(self.mem) + instr[6]]
+                if op not in OPS:
+                    out.add(op)
+        return sorted(out)
+
+
+    def go(self, target):           #   -> the lines for a jump to target;  a negative target halts
+        return ["pc = {}".format(target), "continue"] if target >= 0 else ["break"]
+
+
+    def blocks(self):               #   -> {start: [instruction addresses]}
+        reachable = self.check.reachable
+        leaders = {0}
+        for p in reachable:
+            kind = self.vm.decode(p)[0]
+            if kind == 2 or kind == 4:
+                target = self.vm.decode(p)[6]
+                if target >= 0:
+                    leaders.add(target)
+                leaders.add(p + 3)
+        out = {}
+        for start in sorted(leaders & reachable):
+            p = start
+            run = []
+            while p in reachable:
+                run.append(p)
+                if self.vm.decode(p)[0] in (2, 4, 7) or p + 3 in leaders:
+                    break
+                p += 3
+            out[start] = run
+        return out
+
+
+    def dispatch(self, starts, blocks, lines, indent):
+        #   a tree of comparisons on pc, down to a few == tests
+        if len(starts) <= 4:
+            for i, start in enumerate(starts):
+                lines.append(indent + ("if" if i == 0 else "elif") + " pc == {}:".format(start))
+                self.body(start, blocks[start], lines, indent + "    ")
+            return
+        middle = len(starts) // 2
+        lines.append(indent + "if pc < {}:".format(starts[middle]))
+        self.dispatch(starts[:middle], blocks, lines, indent + "    ")
+        lines.append(indent + "else:")
+        self.dispatch(starts[middle:], blocks, lines, indent + "    ")
+
+
+    def body(self, start, run, lines, indent):
+        ended = False
+        for p in run:
+            ended = self.instruction(p, lines, indent)
+        if not ended:               # runs on into the next block
+            lines.append(indent + "pc = {}".format(run[-1] + 3))
+            lines.append(indent + "continue")
+
+
+    def compile(self, labels=None, name="program"):   #   -> module source
+        blocks = self.blocks()
+        code = []
+        self.dispatch(sorted(blocks), blocks, code, " " * 12)
+        pos = self.mem[:self.neg0]
+        neg = self.mem[self.neg0:]
+        neg.reverse()
+        out = ["#!/usr/bin/env python3",
+               "# OISC:3 program {}, compiled ahead of time by oisc3_aot".format(name),
+               "# Runs on its own:  python this.py, or import it and call run().",
+               "",
+               "import io",
+               "import math",
+               "import sys",
+               "",
+               "",
+               "POS = [{}]".format(", ".join(word(w) for w in pos)),
+               "NEG = [{}]".format(", ".join(word(w) for w in neg)),
+               "LABELS = {}".format(repr({label: address for label, address in (labels or {}).items()})),
+               ""]
+        out.extend(RUNTIME.split("\n"))
+        out.append("    push_return = rstack.append")
+        out.append("    pc = 0")
+        out.append("    try:")
+        out.append("        while True:")
+        out.extend(code)
+        out.append("    except (ValueError, IndexError, TypeError, ArithmeticError) as error:")
+        out.append("        output.flush()")
+        out.append("        print(\"\\n{} in the code at {}\".format(str(error) or type(error).__name__, pc), flush=True)")
+        out.append("        return \"fault\"")
+        out.append("    output.flush()")
+        out.append("    return \"halted\"")
+        out.append("")
+        out.append("")
+        out.append("if __name__ == '__main__':")
+        out.append("    sys.exit(0 if run() == \"halted\" else 1)")
+        out.append("")
+        return "\n".join(out)
+
+
+def compile_program(mem, neg0, labels=None, name="program"):
+    #   -> (module source, None), or (None, why not) when the program's code could change
+    compiler = Compiler(mem, neg0)
+    if not compiler.check.verified():
+        return None, compiler.check.report(labels)
+    missing = compiler.missing()
+    if missing:
+        return None, "Uses coprocessor ops the compiled module doesn't have:  " + " ".join(str(op) for op in missing)
+    return compiler.compile(labels, name), None
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# OISC:3 batch runner
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Runs many programs headless across a pool of processes and writes a JSON summary.
+#
+#   usage:  python oisc3_batch.py [--jobs=N] [--budget=N] [--timeout=seconds] [--no-cache]
+#                                 [--summary=out.json] directory | manifest.json ...
+#
+#   A directory runs every .o3a, .o3c and .o3i file in it;  if prog.in sits next to
+#   prog.o3a it becomes that program's input.  A manifest is a JSON list of
+#       {"program": "path", "input": "text", "input_file": "path", "budget": N, "timeout": S}
+#   with everything but "program" optional and relative paths taken from the manifest's folder.
+#
+#   Each program gets one of these statuses (and exit codes):
+#       halted 0    fault 1    budget 2    timeout 3    error 4  (it wouldn't assemble or load)
+
+
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from oisc3_vm import Oisc3VM, RUNNING, HALTED, FAULT
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_image import load_image, is_image
+from oisc3_cache import AssemblyCache, assemble
+
+
+EXTENSIONS = (".o3a", ".o3c", ".o3i")
+EXIT_CODES = {"halted": 0, "fault": 1, "budget": 2, "timeout": 3, "error": 4}
+SLICE = 10000                   # instructions between looks at the clock
+
+
+def run_job(job, prepare=None):
+    #   job:  {"program", "input", "budget", "timeout", "cache"}  ->  result dict.
+    #   "image": (mem, neg0) runs that instead of loading the program.
+    #   prepare:  called with the loaded VM before it runs, to register ops and the like.
+    #   Runs in a worker process;  the VM's own messages land in the captured output too.
+    captured = io.StringIO()
+    result = {"program": job["program"], "status": "error", "instructions": 0}
+    started = time.monotonic()
+    with redirect_stdout(captured):
+        try:
+            if "image" in job:
+                mem, neg0 = job["image"]
+            elif is_image(job["program"]):
+                mem, neg0, labels = load_image(job["program"])
+            else:
+                with open(job["program"], "r") as o3a_file:
+                    raw = o3a_file.read()
+                cache = AssemblyCache() if job.get("cache", True) else None
+                mem, neg0, labels = assemble(raw, cache)
+        except (OSError, ValueError, IndexError, KeyError) as error:
+            print("\n{}: {}".format(type(error).__name__, error))
+            mem = None
+        if mem is not None:
+            vm = Oisc3VM(input=StreamInput(job.get("input") or ""), output=BufferedOutput(flush="halt"))
+            vm.load(mem, neg0)
+            if prepare is not None:
+                prepare(vm)
+            budget = job.get("budget")
+            timeout = job.get("timeout")
+            deadline = started + timeout if timeout else None
+            status = RUNNING
+            while status == RUNNING:
+                step = SLICE if budget is None else min(SLICE, budget - vm.executed)
+                if step <= 0:
+                    result["status"] = "budget"
+                    break
+                if deadline is not None and time.monotonic() > deadline:
+                    result["status"] = "timeout"
+                    break
+                status = vm.run(step)
+            result["instructions"] = vm.executed      # counted up to the instruction that faulted
+            if status == HALTED:
+                result["status"] = "halted"
+            elif status == FAULT:
+                print("\n{} at instruction {}".format(str(vm.error) or type(vm.error).__name__, vm.pointer))
+                result["status"] = "fault"
+            vm.output.flush()
+    result["exit"] = EXIT_CODES[result["status"]]
+    result["seconds"] = time.monotonic() - started
+    result["output"] = captured.getvalue()
+    return result
+
+
+def input_for(program):
+    stem = os.path.splitext(program)[0]
+    if os.path.isfile(stem + ".in"):
+        with open(stem + ".in", "r") as input_file:
+            return input_file.read()
+    return None
+
+
+def collect(paths, budget=None, timeout=None, cache=True):
+    #   directories and manifests -> list of jobs
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                program = os.path.join(path, name)
+                if name.endswith(EXTENSIONS) and os.path.isfile(program):
+                    jobs.append({"program": program, "input": input_for(program),
+                                 "budget": budget, "timeout": timeout, "cache": cache})
+        else:
+            with open(path, "r") as manifest_file:
+                entries = json.load(manifest_file)
+            folder = os.path.dirname(path)
+            for entry in entries:
+                program = os.path.join(folder, entry["program"])
+                text = entry.get("input")
+                if "input_file" in entry:
+                    with open(os.path.join(folder, entry["input_file"]), "r") as input_file:
+                        text = input_file.read()
+                jobs.append({"program": program, "input": text,
+                             "budget": entry.get("budget", budget), "timeout": entry.get("timeout", timeout),
+                             "cache": cache})
+    return jobs
+
+
+def run_batch(jobs, workers=None):
+    #   -> results in the same order as jobs
+    if workers == 1:
+        return [run_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_job, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))))
+
+
+def main(args):
+    options = dict(arg[2:].split("=", 1) if "=" in arg else (arg[2:], True) for arg in args if arg.startswith("--"))
+    paths = [arg for arg in args if not arg.startswith("--")]
+    if not paths:
+        print("\nusage: python oisc3_batch.py [--jobs=N] [--budget=N] [--timeout=seconds] [--no-cache] [--summary=out.json] directory | manifest.json ...\n")
+        return 2
+    budget = int(options["budget"]) if "budget" in options else None
+    timeout = float(options["timeout"]) if "timeout" in options else None
+    workers = int(options["jobs"]) if "jobs" in options else None
+    jobs = collect(paths, budget, timeout, cache="no-cache" not in options)
+
+    started = time.monotonic()
+    results = run_batch(jobs, workers)
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        print("{:<8}{:>12} instr {:>8.3f} s  {}".format(result["status"], result["instructions"],
+                                                       result["seconds"], result["program"]), flush=True)
+    summary = {"programs": len(results), "seconds": time.monotonic() - started, "statuses": counts, "results": results}
+    if "summary" in options:
+        with open(options["summary"], "w") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+    print(", ".join("{} {}".format(count, status) for status, count in sorted(counts.items())) or "nothing to run")
+    return 0 if counts.get("halted", 0) == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# OISC:3 benchmarks
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Every benchmark is a generated program whose size scales with one number, so the same
+#   suite works as a quick smoke test or as a long soak.  Results are written as JSON and
+#   can be compared against an earlier run to flag regressions.
+#
+#   usage:  python oisc3_bench.py [--scale=N] [--json=out.json] [--compare=old.json]
+#                                 [--threshold=percent] [--repeat=N] [--no-memory] [--blocks] [name ...]
+#
+#   Run benchmarks are compared on instructions per second, the assembler benchmark on
+#   tokens (image words) per second;  a drop of more than threshold percent (default 10)
+#   is reported and the exit status is 1.  Runs are only compared against a baseline made
+#   with the same engine (--blocks or not);  anything else is refused with exit status 2.
+
+
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from oisc3_parser import Parser
+from oisc3_vm import Oisc3VM
+from oisc3_io import BufferedOutput
+from oisc3_blocks import BlockEngine
+
+
+def loop_source(n):             #   tight subleq loop
+    return """
+        /jump   Loop
+Loop:   /lit-   1 Count
+        /sub    Z T
+        /jump   Count Done
+        /jump   Loop
+Done:   /ret
+% --NEGATIVE--: --NEGATIVE--
+Count: {}
+Z: 0
+T: 5
+""".format(n)
+
+
+def print_source(n):            #   string print loop, the same shape as Print in test3.o3a
+    text = "The quick brown fox jumps over the lazy dog. " * (n // 45 + 1)
+    return """
+        /push   Text*
+        /call   Print
+        /ret
+Print:  /pop    print*
+Ploop:  /push   *print*
+        /exec   Writechar
+        /lit-   1 print*
+        /jump   *print* Pend
+        /jump   Ploop
+Pend:   /sub    print*
+        /ret
+% print*: 0
+% --NEGATIVE--: --NEGATIVE--
+Writechar: -1
+Text*: Text
+Text: "{}" 0
+""".format(text[:n])
+
+
+def call_source(n):             #   recursion n calls deep, then n returns
+    return """
+        /call   Rec
+        /ret
+Rec:    /lit-   1 Count
+        /jump   Count Back
+        /call   Rec
+Back:   /ret
+% --NEGATIVE--: --NEGATIVE--
+Count: {}
+""".format(n)
+
+
+def math_source(n):             #   coprocessor arithmetic and trig
+    return """
+        /jump   Loop
+Loop:   /push   pi
+        /push   e
+        /exec   Multiply
+        /exec   Sin
+        /push   e
+        /exec   Plus
+        /pop    temp
+        /lit-   1 Count
+        /jump   Count Done
+        /jump   Loop
+Done:   /ret
+% --NEGATIVE--: --NEGATIVE--
+Count: {}
+pi: 3.14159
+e: 2.718281828
+temp: 0
+Multiply: 12
+Sin: 18
+Plus: 17
+""".format(n)
+
+
+def alloc_source(n):            #   alloc and free churn on both sides of memory
+    return """
+        /jump   Loop
+Loop:   /push   Ten
+        /exec   Malloc
+        /push   Mten
+        /exec   Malloc
+        /push   Mten
+        /exec   Free
+        /push   Ten
+        /exec   Free
+        /lit-   1 Count
+        /jump   Count Done
+        /jump   Loop
+Done:   /ret
+% --NEGATIVE--: --NEGATIVE--
+Count: {}
+Ten: 10
+Mten: -10
+Malloc: 16
+Free: -16
+""".format(n)
+
+
+def large_source(n):            #   n routines and n data words, for the assembler
+    code = ["/jump R0"]
+    data = ["% --NEGATIVE--: --NEGATIVE--"]
+    for i in range(n):
+        code.append("R{0}: /push *D{0}\n/exec Out\n/lit- 1 D{0}\n/jump *D{0} R{1}\n/call R{1}".format(i, (i + 1) % n))
+        data.append('D{}: "word {}" 0  # data {}'.format(i, i, i))
+    data.append("Out: -1")
+    return "\n".join(code + data) + "\n"
+
+
+#   name -> (source generator, size at scale 1, run it or only assemble it)
+BENCHMARKS = {
+    "loop":     (loop_source,   100000, True),
+    "print":    (print_source,  20000,  True),
+    "call":     (call_source,   20000,  True),
+    "math":     (math_source,   20000,  True),
+    "alloc":    (alloc_source,  20000,  True),
+    "assemble": (large_source,  5000,   False),
+}
+
+
+def measure(name, scale=1, memory=True, repeat=3, blocks=False):
+    #   timings are the best of repeat runs, the least disturbed by whatever else the host is doing
+    make, size, run = BENCHMARKS[name]
+    size = int(size * scale)
+    source = make(size)
+    result = {"size": size}
+
+    best = None
+    for i in range(repeat):
+        started = time.perf_counter()
+        mem, neg0 = Parser().parse(source)
+        seconds = time.perf_counter() - started
+        if best is None or seconds < best:
+            best = seconds
+    result["assemble_seconds"] = best
+    result["tokens"] = len(mem)
+    result["tokens_per_second"] = len(mem) / best if best else 0.0
+
+    if run:
+        best = None
+        for i in range(repeat):
+            mem, neg0 = Parser().parse(source)
+            vm = Oisc3VM(output=BufferedOutput(io.StringIO()))
+            vm.load(mem, neg0)
+            started = time.perf_counter()
+            count = BlockEngine().run(vm) if blocks else vm.execute()
+            seconds = time.perf_counter() - started
+            if best is None or seconds < best:
+                best = seconds
+        result["run_seconds"] = best
+        result["instructions"] = count
+        result["instructions_per_second"] = count / best if best else 0.0
+
+    if memory:                  #   a second pass, since tracing allocations skews the timings
+        tracemalloc.start()
+        mem, neg0 = Parser().parse(source)
+        if run:
+            vm = Oisc3VM(output=BufferedOutput(io.StringIO()))
+            vm.load(mem, neg0)
+            if blocks:
+                BlockEngine().run(vm)
+            else:
+                vm.execute()
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, engine="interpreter"):
+    #   -> list of (benchmark, metric, old, new, percent change) that got slower than threshold
+    #   engine:  what results were run with;  a baseline from the other engine is a ValueError
+    old_engine = baseline.get("engine", "interpreter")     # baselines from before --blocks had no engine
+    if old_engine != engine:
+        print("Can't compare a run on the", engine, "engine with a baseline from the", old_engine, "engine", flush=True)
+        raise ValueError
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get("results", {}).get(name)
+        if old is None or old.get("size") != result.get("size"):
+            continue
+        metric = "instructions_per_second" if BENCHMARKS[name][2] else "tokens_per_second"
+        if metric in result and old.get(metric):
+            change = 100.0 * (result[metric] - old[metric]) / old[metric]
+            if change < -threshold:
+                regressions.append((name, metric, old[metric], result[metric], change))
+    return regressions
+
+
+def main(args):
+    options = dict(arg[2:].split("=", 1) if "=" in arg else (arg[2:], True) for arg in args if arg.startswith("--"))
+    names = [arg for arg in args if not arg.startswith("--")] or list(BENCHMARKS)
+    scale = float(options.get("scale", 1))
+    threshold = float(options.get("threshold", 10))
+    for name in names:
+        if name not in BENCHMARKS:
+            print("No benchmark called", name, "- try", ", ".join(BENCHMARKS))
+            return 2
+
+    results = {}
+    for name in names:
+        result = measure(name, scale, memory="no-memory" not in options, repeat=int(options.get("repeat", 3)),
+                         blocks="blocks" in options)
+        results[name] = result
+        line = "{:<10}{:>9} words  {:>12,.0f} tokens/s".format(name, result["tokens"], result["tokens_per_second"])
+        if "instructions_per_second" in result:
+            line += "  {:>12,.0f} instr/s".format(result["instructions_per_second"])
+        if "peak_bytes" in result:
+            line += "  {:>8.1f} MB peak".format(result["peak_bytes"] / 1e6)
+        print(line, flush=True)
+
+    report = {"revision": revision(), "python": platform.python_version(), "scale": scale,
+              "engine": "blocks" if "blocks" in options else "interpreter", "results": results}
+    if "json" in options:
+        with open(options["json"], "w") as json_file:
+            json.dump(report, json_file, indent=2)
+
+    if "compare" in options:
+        with open(options["compare"]) as json_file:
+            baseline = json.load(json_file)
+        try:
+            regressions = compare(results, baseline, threshold, report["engine"])
+        except ValueError:
+            return 2
+        for name, metric, old, new, change in regressions:
+            print("REGRESSION {} {}: {:,.0f} -> {:,.0f} ({:+.1f}%)".format(name, metric, old, new, change))
+        if regressions:
+            return 1
+        print("no regressions against", baseline.get("revision") or options["compare"])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# OISC:3 basic block translator
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   BlockEngine runs a VM a block at a time instead of an instruction at a time.  The first
+#   time the VM reaches an address, the straight run of code starting there is decoded,
+#   written out as Python source and compiled once.  Direct operands become constants, and
+#   every call or jump becomes an exit taken when its test passes, so a block runs on
+#   through untaken branches until a ret, MAX_BLOCK instructions, or code it can't take.
+#   A jump back to the block's own start loops inside the function.  A block returns
+#   (next pointer, instructions run), and never runs past the budget it's given.
+#
+#   Every word of a compiled block is listed in covered.  A write to one of them throws away
+#   every block using that word, marks the word dirty, and leaves the block early.  Code
+#   touching a dirty word is never translated again and goes through the interpreter, so
+#   self-modifying code behaves exactly as it does under Oisc3VM.execute.  Ops that write
+#   memory (marked writes) report each positive word through vm.on_write, and a block ends
+#   straight after one, since it may have just rewritten itself.
+#   Direct operands are bounds checked at translation;  if alloc or free moves the bounds,
+#   each block is checked again the next time it's entered.
+
+
+from oisc3_memory import PagedMemory, PAGE_BITS, PAGE_MASK
+from oisc3_vm import WaitingForInput
+
+
+MAX_BLOCK = 64                  # instructions per block
+FOREVER = 1 << 62               # the limit given to a block when there's no budget
+
+
+class Block:
+
+    def __init__(self, start, function, lines, length, end, low, high, epoch):
+        self.start = start
+        self.function = function
+        self.lines = lines          # source line -> instruction address, to place a fault
+        self.length = length        # instructions in one pass
+        self.end = end              # one past its last word
+        self.low = low              # smallest and largest operand words, for the bounds check
+        self.high = high
+        self.epoch = epoch
+
+
+    def address_at(self, traceback):
+        #   the instruction that raised, found from the block's frame in the traceback
+        address = self.start
+        while traceback is not None:
+            if traceback.tb_frame.f_code is self.function.__code__:
+                address = self.lines.get(traceback.tb_lineno, address)
+            traceback = traceback.tb_next
+        return(address)
+
+
+class BlockEngine:
+
+    def __init__(self):
+        self.vm = None
+        self.memory = None
+        self.blocks = {}            # start address -> Block
+        self.covered = {}           # word -> start addresses of the blocks decoded from it
+        self.dirty = set()          # words written while compiled;  interpreted from now on
+        self.epoch = 0              # bumped whenever the bounds move
+        self.top = 0                # end of the highest block
+        self.translated = 0
+
+
+    def reset(self, vm):
+        self.vm = vm
+        self.memory = vm.memory
+        self.neg0 = vm.neg0
+        self.neg_max = vm.neg_max
+        self.blocks = {}
+        self.covered = {}
+        self.dirty = set()
+        self.top = 0
+
+
+    def moved(self, vm):            #   the bounds changed under an alloc or free
+        if vm.neg0 < self.top:      # freed words are zeroed, so blocks reaching them are gone
+            for block in [block for block in self.blocks.values() if block.end > vm.neg0]:
+                self.drop(block)
+            self.top = max([block.end for block in self.blocks.values()], default=0)
+        self.neg0 = vm.neg0
+        self.neg_max = vm.neg_max
+        self.epoch += 1
+
+
+    def drop(self, block):
+        del self.blocks[block.start]
+        for w in range(block.start, block.end):
+            starts = self.covered.get(w)
+            if starts is not None:
+                starts.discard(block.start)
+                if not starts:
+                    del self.covered[w]
+
+
+    def modified(self, word):       #   called by a block, or after the interpreter wrote into a block
+        self.dirty.add(word)
+        for start in list(self.covered.get(word, ())):
+            self.drop(self.blocks[start])
+
+
+    def run(self, vm, budget=-1):   #   same contract as Oisc3VM.execute:  -> instructions run
+        if vm is not self.vm or vm.memory is not self.memory:
+            self.reset(vm)
+        elif vm.neg0 != self.neg0 or vm.neg_max != self.neg_max:
+            self.moved(vm)
+        start = budget
+        blocks = self.blocks
+        vm.waiting = False
+        vm.on_write = self.wrote
+        try:
+            while vm.running and budget != 0 and not vm.waiting:
+                pointer = vm.pointer
+                block = blocks.get(pointer)
+                if block is not None and block.epoch != self.epoch:
+                    if block.low < vm.neg_max or block.high > vm.neg0:
+                        self.drop(block)
+                        block = None
+                    else:
+                        block.epoch = self.epoch
+                if block is None:
+                    block = self.translate(vm, pointer)
+                if block is None or 0 <= budget < block.length:
+                    budget -= self.interpret(vm, pointer)
+                else:
+                    try:
+                        vm.pointer, count = block.function(vm, budget - block.length if budget > 0 else FOREVER)
+                    except BaseException as error:
+                        vm.pointer = block.address_at(error.__traceback__)
+                        vm.running = False
+                        raise
+                    budget -= count
+                if vm.neg0 != self.neg0 or vm.neg_max != self.neg_max:
+                    self.moved(vm)
+        finally:
+            vm.on_write = None
+            vm.decoded.clear()      # the interpreter's cache doesn't see writes made by blocks
+        return(start - budget)
+
+
+    def wrote(self, word):          #   vm.on_write, while running
+        if word in self.covered:
+            self.modified(word)
+
+
+    def interpret(self, vm, pointer):
+        #   one instruction through the VM;  anything it writes into a block is caught here
+        written = None
+        try:
+            instr_type, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = vm.decode(pointer)
+            if instr_type == 0:
+                written = vm.indirect(c_ref) if c_ind else c_ref
+            elif instr_type in (1, 5):
+                written = vm.indirect(b_ref) if b_ind else b_ref
+        except:
+            vm.running = False
+            raise
+        vm.decoded.pop(pointer, None)
+        count = vm.execute(1)
+        if written in self.covered:
+            self.modified(written)
+        return(count)
+
+
+    def fits(self, vm, p):          #   can the instruction at p be translated?
+        if p < 0 or p + 2 >= vm.neg0:
+            return(False)
+        memory = vm.memory
+        for i in range(p, p + 3):
+            if i in self.dirty:
+                return(False)
+            word = memory[i]
+            if word != 0 and (word > vm.neg0 or word < vm.neg_max):
+                return(False)       # left for the interpreter to report
+        return(True)
+
+
+    def translate(self, vm, start):
+        if not self.fits(vm, start):
+            return(None)
+        memory = vm.memory
+        paged = type(memory) is PagedMemory
+        literals = []
+        code = []
+        lines = {}
+
+        def read(ref):              #   expression for the value at ref
+            if type(ref) is int and paged:
+                if ref >= 0:
+                    return("pos[{}][{}]".format(ref >> PAGE_BITS, ref & PAGE_MASK))
+                return("neg[{}][{}]".format(~ref >> PAGE_BITS, ~ref & PAGE_MASK))
+            return("memory[{}]".format(ref))
+
+        def store(ref, value):
+            if type(ref) is int and paged:  # straight into the page, unless it's still the shared zero page
+                code.append("        value = {}".format(value))
+                code.append("        try:")
+                code.append("            {} = value".format(read(ref)))
+                code.append("        except TypeError:")
+                code.append("            memory[{}] = value".format(ref))
+            else:
+                code.append("        memory[{}] = {}".format(ref, value))
+            if type(ref) is not int or ref >= 0:    # only a write that could land on code needs watching
+                code.append("        if {} in covered:".format(ref))
+                code.append("            modified({})".format(ref))
+                code.append("            return({}, count + {})".format(p + 3, count))
+
+        def operand(name, ref, ind):
+            if not ind:
+                return(ref)
+            code.append("        {} = {}".format(name, read(ref)))
+            code.append("        if {0} > neg0 or {0} < neg_max: indirect({1})".format(name, ref))
+            return(name)
+
+        def leave(target):          #   take a call or jump
+            if type(target) is not int:
+                code.append("            if {} < 0:".format(target))
+                code.append("                vm.running = False")
+                code.append("                return({}, count + {})".format(p, count))
+            elif target < 0:
+                code.append("            vm.running = False")
+                code.append("            return({}, count + {})".format(p, count))
+                return
+            code.append("            return({}, count + {})".format(target, count))
+
+        p = start
+        count = 0
+        low = high = 0
+        while True:
+            instr_type, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = vm.decode(p)
+            count += 1
+            for word in (memory[p], memory[p + 1], memory[p + 2]):
+                if word != 0:
+                    low = min(low, word)
+                    high = max(high, word)
+            first = len(code)
+            a_ref = operand("ra", a_ref, a_ind)
+            b_ref = operand("rb", b_ref, b_ind)
+            c_ref = operand("rc", c_ref, c_ind)
+            if instr_type == 0:                 #   sub
+                store(c_ref, "{} - {}".format(read(b_ref), read(a_ref)))
+            elif instr_type == 1:               #   lit-
+                if type(a) is int:
+                    literal = repr(a)
+                else:
+                    literal = "literals[{}]".format(len(literals))
+                    literals.append(a)
+                store(b_ref, "{} - {}".format(read(b_ref), literal))
+            elif instr_type == 2:               #   call
+                code.append("        if {} <= 0:".format(read(a_ref)))
+                code.append("            returnstack.append({})".format(p + 3))
+                leave(c_ref)
+            elif instr_type == 3:               #   push
+                code.append("        stack.append({})".format(read(a_ref)))
+            elif instr_type == 4:               #   jump
+                code.append("        if {} <= 0:".format(read(b_ref)))
+                if c_ref == start:              # back to the top, while the budget lasts
+                    code.append("            count += {}".format(count))
+                    code.append("            if count > limit:")
+                    code.append("                return({}, count)".format(start))
+                    code.append("            continue")
+                else:
+                    leave(c_ref)
+            elif instr_type == 5:               #   pop
+                store(b_ref, "stack.pop()")
+            elif instr_type == 6:               #   exec
+                code.append("        op = ops.get({})".format(read(c_ref)))
+                code.append("        if op is not None:")
+                code.append("            try:")
+                code.append("                op(vm)")
+                code.append("            except WaitingForInput:")
+                code.append("                vm.waiting = True")
+                code.append("                return({}, count + {})".format(p, count - 1))
+                code.append("            if vm.neg0 != neg0 or vm.neg_max != neg_max or getattr(op, 'writes', False):")
+                code.append("                return({}, count + {})".format(p + 3, count))
+            else:                               #   ret
+                code.append("        if returnstack:")
+                code.append("            return(returnstack.pop(), count + {})".format(count))
+                code.append("        vm.running = False")
+                code.append("        return({}, count + {})".format(p + 3, count))
+            for line in range(first, len(code)):
+                lines[line] = p
+            if instr_type == 7:
+                break
+            if count == MAX_BLOCK or not self.fits(vm, p + 3):
+                code.append("        return({}, count + {})".format(p + 3, count))
+                lines[len(code) - 1] = p
+                break
+            p += 3
+
+        head = ["def block(vm, limit, memory=memory, pos=pos, neg=neg, ops=ops, covered=covered, modified=modified, indirect=indirect, literals=literals):",
+                "    stack = vm.stack",
+                "    returnstack = vm.returnstack",
+                "    neg0 = vm.neg0",
+                "    neg_max = vm.neg_max",
+                "    count = 0",
+                "    while True:"]
+        lines = {line + len(head) + 1: address for line, address in lines.items()}
+        namespace = {"memory": memory, "pos": getattr(memory, "pos", None), "neg": getattr(memory, "neg", None),
+                     "ops": vm.ops, "covered": self.covered, "modified": self.modified,
+                     "indirect": vm.indirect, "literals": tuple(literals), "WaitingForInput": WaitingForInput}
+        exec(compile("\n".join(head + code) + "\n", "<block {}>".format(start), "exec"), namespace)
+        block = Block(start, namespace["block"], lines, count, p + 3, low, high, self.epoch)
+        self.blocks[start] = block
+        for w in range(start, block.end):
+            self.covered.setdefault(w, set()).add(start)
+        self.top = max(self.top, block.end)
+        self.translated += 1
+        return(block)
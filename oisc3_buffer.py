@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# OISC:3 memory windows
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   A MemoryWindow is a run of words in a VM's memory, seen through the buffer protocol
+#   without copying:  a memoryview of 64 bit ints, or a NumPy int64 array when NumPy is
+#   installed.  A host can fill a program's input in one go before run() and read its
+#   results straight back afterwards.
+#
+#   The words have to sit side by side, so the VM's memory becomes a CompactMemory the first
+#   time a window is opened on it (one copy, then never again).  A window starts at an
+#   address or a label and runs away from 0:  upward in positive memory, downward in
+#   negative memory, the way strings are laid out, and it stays on one side of 0.
+#
+#   A window holds plain ints.  Opening one on a word that holds a float (a pointer) is an
+#   error, and a float the program stores into an open window reads as its rounded address.
+#   Writing positive memory tells the VM when the window is closed, so code it had decoded
+#   from there is decoded again, and so does an engine that keeps its own translated code
+#   (a BlockEngine, through its wrote() hook).  Alloc and free can't resize a side of memory while a window
+#   is open on it (that's a fault), so close windows (with, or release()) before running
+#   code that allocs or frees there.
+
+
+from oisc3_memory import CompactMemory, PagedMemory
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class MemoryWindow:
+
+    def __init__(self, vm, start, n=None, labels=None, writable=True):
+        #   start:  an address, or a label in labels (vm.labels if not given)
+        #   n:      words, or None for everything from start to the end of its side of memory
+        labels = vm.labels if labels is None else labels
+        if type(start) is str:
+            if start not in labels:
+                print("No label", start, "to open a window at", flush=True)
+                raise ValueError
+            start = labels[start]
+        if type(start) is not int:
+            print("A window has to start at a label or a whole address, not", start, flush=True)
+            raise ValueError
+        if isinstance(vm.memory, PagedMemory):
+            vm.memory = CompactMemory(vm.memory.tolist(), vm.neg0)
+        if start >= 0:
+            region = vm.memory.pos
+            first = start
+        else:
+            region = vm.memory.neg
+            first = ~start
+        size = len(region.flags)
+        if n is None:
+            n = size - first
+        if n < 0 or first + n > size:
+            print("Window of", n, "words at", start, "runs out of", "positive" if start >= 0 else "negative",
+                  "memory", flush=True)
+            raise IndexError
+        if region.flags.count(0, first, first + n) != n:
+            print("Window at", start, "holds a float or a value too big for 64 bits", flush=True)
+            raise ValueError
+        if writable:
+            region.own()            # a mapped image is copy-on-write, but an owned array can grow later
+        self.vm = vm
+        self.start = start
+        self.size = n
+        self.writable = writable
+        view = memoryview(region.values)
+        self.view = view[first:first + n] if writable else view[first:first + n].toreadonly()
+        self.parent = view
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __getitem__(self, i):
+        return self.view[i]
+
+
+    def __setitem__(self, i, value):
+        self.view[i] = value
+
+
+    def array(self):                #   -> a NumPy int64 array on the same words, or the memoryview without NumPy
+        if numpy is None:
+            return self.view
+        return numpy.frombuffer(self.view, dtype=numpy.int64)
+
+
+    def address(self, i):           #   the VM address of the window's word i
+        return self.start + i if self.start >= 0 else self.start - i
+
+
+    def release(self):
+        if self.view is None:
+            return
+        if self.writable and self.start >= 0:
+            vm = self.vm
+            #   between runs the VM has no on_write to pass writes on to the engine, so tell it here
+            wrote = getattr(vm.engine, "wrote", None) if vm.on_write is None else None
+            for w in range(self.start, self.start + self.size):
+                vm.forget(w)
+                if wrote is not None:
+                    wrote(w)
+        try:
+            self.view.release()
+            self.parent.release()
+        except BufferError:
+            print("Window at", self.start, "is still in use, by an array made from it", flush=True)
+            raise ValueError
+        self.view = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# OISC:3 assembly cache
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Assembled programs are kept as .o3i images, named by a hash of the source text plus
+#   the assembler and image versions, so an unchanged source is never assembled twice.
+#   Every hit touches the file;  when the cache grows past its limit the least recently
+#   used images go first.
+
+
+import hashlib
+import os
+import tempfile
+from oisc3_parser import Parser, ASSEMBLER_VERSION
+from oisc3_image import write_image, load_image, VERSION as IMAGE_VERSION
+
+
+DEFAULT_LIMIT = 64 * 1024 * 1024
+
+
+class AssemblyCache:
+
+    def __init__(self, directory=None, limit=DEFAULT_LIMIT):
+        if directory is None:
+            directory = os.environ.get("OISC3_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "oisc3")
+        self.directory = directory
+        self.limit = limit
+
+
+    def path(self, source):
+        digest = hashlib.sha256()
+        digest.update("oisc3 assembler {} image {}\n".format(ASSEMBLER_VERSION, IMAGE_VERSION).encode())
+        digest.update(source.encode())
+        return os.path.join(self.directory, digest.hexdigest() + ".o3i")
+
+
+    def load(self, source):             #   -> (CompactMemory, neg0, labels), or None on a miss
+        path = self.path(source)
+        try:
+            image = load_image(path)
+            os.utime(path)
+            return image
+        except (OSError, ValueError):
+            return None
+
+
+    def store(self, source, mem, neg0, labels):
+        temp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(handle, "wb") as o3i_file:
+                write_image(o3i_file, mem, neg0, labels)
+            os.replace(temp, self.path(source))
+            temp = None
+            self.evict()
+        except OSError:
+            pass                        # a cache that can't be written just means assembling next time
+        finally:
+            if temp is not None:        # evict() only sees .o3i files, so a half written one has to go now
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+
+
+    def entries(self):                  #   -> [(last used, size, path)], oldest first
+        found = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return found
+        for name in names:
+            if name.endswith(".o3i"):
+                path = os.path.join(self.directory, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                found.append((info.st_mtime, info.st_size, path))
+        found.sort()
+        return found
+
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for used, size, path in entries)
+        for used, size, path in entries:
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+    def clear(self):
+        for used, size, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def assemble(source, cache=None, compact=False):
+    #   -> (mem, neg0, labels) from the cache when possible, otherwise from the Parser
+    if cache is not None:
+        image = cache.load(source)
+        if image is not None:
+            mem, neg0, labels = image
+            if not compact:
+                mem = mem.tolist()
+            return(mem, neg0, labels)
+    parser = Parser()
+    mem, neg0 = parser.parse(source, compact)
+    if cache is not None:
+        cache.store(source, mem, neg0, parser.label_table)
+    return(mem, neg0, parser.label_table)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# OISC:3 multi-VM cluster
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Runs N copies of one program, each in its own process, so a data-parallel job can use
+#   every core.  The copies talk through channels in shared memory:  each VM has an inbox,
+#   a ring of words any VM may send to and only its owner receives from.  Semaphores count
+#   the words waiting and the room left, so a blocked send or receive sleeps, not spins.
+#   A word keeps its type:  an int arrives as an int (it has to fit in 64 bits), a float as a float.
+#
+#   Coprocessor ops, registered on every VM in the cluster:
+#
+#   27  SEND        A N -       send A to VM N, waiting while its inbox is full
+#   -27 RECV        - A         take the next word from this VM's inbox, waiting for one
+#   28  TRYRECV     - A F       F is 1 and A the next word, or both 0 if the inbox is empty
+#   -28 VMINDEX     - I         this VM's number, 0 to N-1
+#   29  VMCOUNT     - N         how many VMs there are
+#
+#   Each VM runs exactly as oisc3_batch runs a program, with its own input, budget and
+#   timeout, and its output captured.  A VM still waiting on a channel when the timeout
+#   (plus a second's grace) runs out is stopped and counted as a timeout.  Without a
+#   timeout, VMs that all wait on each other wait forever.
+#
+#   usage:  python oisc3_cluster.py [--vms=N] [--capacity=N] [--budget=N] [--timeout=seconds]
+#                                   [--input=file] [--no-cache] [--summary=out.json] prog.o3a
+#   --vms defaults to the number of cores, --capacity (words per inbox) to 1024.
+
+
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from multiprocessing.shared_memory import SharedMemory
+from oisc3_batch import run_job, EXIT_CODES
+from oisc3_image import load_image, is_image
+from oisc3_cache import AssemblyCache, assemble
+
+
+INT, FLOAT = 0, 1
+GRACE = 1.0                     # seconds past the timeout before a stuck VM is stopped
+
+
+class Channel:
+
+    #   Words 0 to capacity-1 of the shared block are the ring, word capacity is the count of
+    #   words ever sent, and a byte per slot after that says whether the slot holds an int or a float.
+    #   Senders take the lock to claim a slot;  the one receiver keeps its own count.
+
+    def __init__(self, capacity=1024, context=multiprocessing):
+        self.capacity = capacity
+        self.shm = SharedMemory(create=True, size=9 * capacity + 8)
+        self.lock = context.Lock()
+        self.items = context.Semaphore(0)
+        self.space = context.Semaphore(capacity)
+        self.received = 0
+        self.views = None
+
+
+    def __getstate__(self):         #   memoryviews don't travel;  they're made again on arrival
+        state = dict(self.__dict__)
+        state["views"] = None
+        return state
+
+
+    def map(self):
+        if self.views is None:
+            words = self.shm.buf[:8 * (self.capacity + 1)]
+            self.views = (words.cast("q"), words[:8 * self.capacity].cast("d"),
+                          self.shm.buf[8 * (self.capacity + 1):])
+        return self.views
+
+
+    def send(self, value):
+        ints, floats, kinds = self.map()
+        if type(value) is float:
+            kind = FLOAT
+        elif -2 ** 63 <= value < 2 ** 63:
+            kind = INT
+        else:
+            print("\nCan't send", value, "- it doesn't fit in 64 bits", flush=True)
+            raise ValueError
+        self.space.acquire()
+        with self.lock:
+            sent = ints[self.capacity]
+            slot = sent % self.capacity
+            if kind == FLOAT:
+                floats[slot] = value
+            else:
+                ints[slot] = value
+            kinds[slot] = kind
+            ints[self.capacity] = sent + 1
+        self.items.release()
+
+
+    def receive(self, block=True):  #   -> the next word, or None if block is False and there isn't one
+        if not self.items.acquire(block):
+            return None
+        ints, floats, kinds = self.map()
+        slot = self.received % self.capacity
+        value = floats[slot] if kinds[slot] == FLOAT else ints[slot]
+        self.received += 1
+        self.space.release()
+        return value
+
+
+    def close(self, unlink=False):
+        if self.views is not None:
+            for view in self.views:
+                view.release()
+            self.views = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class Node:
+
+    #   One VM's place in the cluster:  its number and every inbox.
+
+    def __init__(self, index, channels):
+        self.index = index
+        self.channels = channels
+
+
+    def attach(self, vm):
+        vm.register_op(27, self.op_send)
+        vm.register_op(-27, self.op_recv)
+        vm.register_op(28, self.op_try_recv)
+        vm.register_op(-28, self.op_index)
+        vm.register_op(29, self.op_count)
+
+
+    def op_send(self, vm):          #   send                A N -
+        n = vm.stack.pop()
+        a = vm.stack.pop()
+        if n != int(n) or not 0 <= n < len(self.channels):
+            vm.output.flush()
+            print("\nNo VM", n, "to send to", flush=True)
+            raise IndexError
+        self.channels[int(n)].send(a)
+
+
+    def op_recv(self, vm):          #   receive             - A
+        vm.output.flush()           # whatever was printed shows up before a long wait
+        vm.stack.append(self.channels[self.index].receive())
+
+
+    def op_try_recv(self, vm):      #   receive if there's a word   - A F
+        a = self.channels[self.index].receive(False)
+        if a is None:
+            vm.stack.append(0)
+            vm.stack.append(0)
+        else:
+            vm.stack.append(a)
+            vm.stack.append(1)
+
+
+    def op_index(self, vm):         #   this VM's number    - I
+        vm.stack.append(self.index)
+
+
+    def op_count(self, vm):         #   number of VMs       - N
+        vm.stack.append(len(self.channels))
+
+
+def run_node(job, node, results):   #   in each VM's process
+    try:
+        result = run_job(job, node.attach)
+    finally:
+        for channel in node.channels:
+            channel.close()
+    result["vm"] = node.index
+    results.put(result)
+
+
+def run_cluster(mem, neg0, count, capacity=1024, inputs=None, budget=None, timeout=None, program="program"):
+    #   -> a result for each VM, in order, as oisc3_batch gives them, with "vm" its number
+    #   mem:     an image list, or a memory object such as load_image gives, copied to a list here
+    #            since a mapped image's memoryviews can't be pickled for a spawned process
+    #   inputs:  None, or a list of input text for each VM
+    if not isinstance(mem, list):
+        mem = mem.tolist()
+    context = multiprocessing.get_context()
+    channels = []
+    processes = []
+    results = context.Queue()
+    gathered = {}
+    started = time.monotonic()
+    try:
+        for i in range(count):
+            channels.append(Channel(capacity, context))
+        for i in range(count):
+            job = {"program": program, "image": (mem, neg0), "input": inputs[i] if inputs else None,
+                   "budget": budget, "timeout": timeout}
+            process = context.Process(target=run_node, args=(job, Node(i, channels), results), daemon=True)
+            process.start()
+            processes.append(process)
+        deadline = started + timeout + GRACE if timeout else None
+        while len(gathered) < count:
+            wait = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            try:
+                result = results.get(timeout=max(wait, 0))
+                gathered[result["vm"]] = result
+                continue
+            except queue.Empty:
+                pass
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            if not any(processes[i].is_alive() for i in range(count) if i not in gathered):
+                try:                # a last look, in case one finished just now
+                    while True:
+                        result = results.get(timeout=0.1)
+                        gathered[result["vm"]] = result
+                except queue.Empty:
+                    break
+        for i, process in enumerate(processes):
+            if i not in gathered and process.is_alive():
+                process.terminate()
+            process.join()
+    finally:
+        for channel in channels:
+            channel.close(unlink=True)
+    out = []
+    for i in range(count):
+        if i in gathered:
+            out.append(gathered[i])
+        else:
+            status = "timeout" if processes[i].exitcode is not None and processes[i].exitcode < 0 else "error"
+            out.append({"program": program, "vm": i, "status": status, "exit": EXIT_CODES[status],
+                        "instructions": 0, "seconds": time.monotonic() - started, "output": ""})
+    return out
+
+
+def main(args):
+    options = dict(arg[2:].split("=", 1) if "=" in arg else (arg[2:], True) for arg in args if arg.startswith("--"))
+    paths = [arg for arg in args if not arg.startswith("--")]
+    if len(paths) != 1:
+        print("\nusage: python oisc3_cluster.py [--vms=N] [--capacity=N] [--budget=N] [--timeout=seconds] [--input=file] [--no-cache] [--summary=out.json] prog.o3a\n")
+        return 2
+    program = paths[0]
+    if is_image(program):
+        mem, neg0, labels = load_image(program)
+    else:
+        with open(program, "r") as o3a_file:
+            raw = o3a_file.read()
+        mem, neg0, labels = assemble(raw, None if "no-cache" in options else AssemblyCache())
+    count = int(options.get("vms", os.cpu_count() or 1))
+    inputs = None
+    if "input" in options:
+        with open(options["input"], "r") as input_file:
+            inputs = [input_file.read()] * count
+    started = time.monotonic()
+    results = run_cluster(mem, neg0, count, int(options.get("capacity", 1024)), inputs,
+                          int(options["budget"]) if "budget" in options else None,
+                          float(options["timeout"]) if "timeout" in options else None, program)
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        print("--- VM {}:  {}, {} instructions in {:.3f} s".format(result["vm"], result["status"],
+                                                                   result["instructions"], result["seconds"]))
+        if result["output"]:
+            print(result["output"].strip("\n"))
+    summary = {"program": program, "vms": count, "seconds": time.monotonic() - started, "statuses": counts, "results": results}
+    if "summary" in options:
+        with open(options["summary"], "w") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+    print(", ".join("{} {}".format(n, status) for status, n in sorted(counts.items())))
+    return 0 if counts.get("halted", 0) == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
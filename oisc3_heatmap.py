@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# OISC:3 memory heatmap
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Heatmap drives the VM one instruction at a time, like the Profiler, and counts the reads
+#   and writes of every word, split by how the word was named:
+#
+#   direct      the operand is the word's address
+#   indirect    the operand is a *pointer;  reading the pointer cell is a direct read of it
+#
+#   sub reads A and B and writes C, lit- reads and writes B, call and push read A, jump reads
+#   B, pop writes B and exec reads C.  What a coprocessor op does to memory itself (copy,
+#   fill, ...) isn't counted.
+#
+#   It also keeps the bounds as alloc and free move them (highest neg0, lowest neg_max and
+#   every move), and the working set:  how many different words were touched in each window
+#   of instructions.  The report and to_json() name words by the program's labels, a word
+#   past a label counting as label+offset (downward in negative memory, where data runs
+#   down), and list the labels nothing ever touched or ran.
+
+
+import json
+from bisect import bisect_right
+
+
+DIRECT, INDIRECT = 0, 1
+READ, WRITE, BOTH = 1, 2, 3
+
+#   what each kind of instruction does with A, B and C
+USES = [(READ, READ, WRITE), (0, BOTH, 0), (READ, 0, 0), (READ, 0, 0),
+        (0, READ, 0), (0, WRITE, 0), (0, 0, READ), (0, 0, 0)]
+
+
+def data_locator(labels, neg_max=None):
+    #   -> (where(address), regions) for data anywhere in memory.  regions:  [(label, first, last)]
+    #   with first the label's own address and last the furthest word before the next label.
+    named = sorted((address, label) for label, address in (labels or {}).items()
+                   if type(address) is int and label != "--NEGATIVE--")
+    positive = [(address, label) for address, label in named if address >= 0]
+    negative = [(address, label) for address, label in named if address < 0]
+    negative.reverse()              # -1 first, downward
+    pos_starts = [address for address, label in positive]
+    neg_starts = [-address for address, label in negative]
+    top = (labels or {}).get("--NEGATIVE--")
+
+    def where(address):
+        if address >= 0:
+            i = bisect_right(pos_starts, address) - 1
+            if i < 0:
+                return "@{}".format(address)
+            start, label = positive[i]
+        else:
+            i = bisect_right(neg_starts, -address) - 1
+            if i < 0:
+                return "@{}".format(address)
+            start, label = negative[i]
+        if start == address:
+            return label
+        return "{}+{}".format(label, abs(address - start))
+
+    regions = []
+    for i, (address, label) in enumerate(positive):
+        end = positive[i + 1][0] - 1 if i + 1 < len(positive) else (top - 1 if top is not None else address)
+        regions.append((label, address, max(address, end)))
+    for i, (address, label) in enumerate(negative):
+        end = negative[i + 1][0] + 1 if i + 1 < len(negative) else (neg_max + 1 if neg_max is not None else address)
+        regions.append((label, address, min(address, end)))
+    return where, regions
+
+
+class Heatmap:
+
+    def __init__(self, window=10000):
+        self.reads = ({}, {})       # direct, indirect:  address -> count
+        self.writes = ({}, {})
+        self.ran = set()            # instruction addresses run
+        self.window = window        # instructions per working-set window
+        self.windows = []           # (first instruction, words touched, of them positive, negative)
+        self.touched = set()        # words touched in the window so far
+        self.moves = []             # (instruction, neg0, neg_max) each time alloc or free moved the bounds
+        self.image = None           # (neg0, neg_max) when the run started
+        self.highest = None         # highest neg0 seen
+        self.lowest = None          # lowest neg_max seen
+        self.total = 0
+
+
+    def run(self, vm, budget=-1):
+        reads = self.reads
+        writes = self.writes
+        touched = self.touched
+        ran = self.ran
+        first = self.total
+        if self.image is None:
+            self.image = (vm.neg0, vm.neg_max)
+            self.highest = vm.neg0
+            self.lowest = vm.neg_max
+        while vm.running and budget != 0:
+            budget -= 1
+            pointer = vm.pointer
+            memory = vm.memory
+            instr = vm.decoded.get(pointer)
+            if instr is None or instr[0] == 8:      # not a recognised idiom, the plain instruction
+                instr = vm.decode(pointer)
+            kind, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = instr
+            seen = []                               # (address, direct or indirect, read, write or both)
+            for ref, ind, use in zip((a_ref, b_ref, c_ref), (a_ind, b_ind, c_ind), USES[kind]):
+                if use:
+                    if ind:
+                        seen.append((ref, DIRECT, READ))
+                        ref = memory[ref]
+                    seen.append((ref, INDIRECT if ind else DIRECT, use))
+            neg0 = vm.neg0
+            neg_max = vm.neg_max
+            if not vm.execute(1):                   # waiting for input
+                break
+            self.total += 1
+            ran.add(pointer)
+            for address, how, use in seen:
+                if use & READ:
+                    counts = reads[how]
+                    counts[address] = counts.get(address, 0) + 1
+                if use & WRITE:
+                    counts = writes[how]
+                    counts[address] = counts.get(address, 0) + 1
+                touched.add(address)
+            if vm.neg0 != neg0 or vm.neg_max != neg_max:
+                self.moves.append((self.total, vm.neg0, vm.neg_max))
+                self.highest = max(self.highest, vm.neg0)
+                self.lowest = min(self.lowest, vm.neg_max)
+            if self.total % self.window == 0:
+                self.close_window()
+        return(self.total - first)
+
+
+    def close_window(self):
+        if self.touched:
+            positive = sum(1 for address in self.touched if address >= 0)
+            first = (self.total - 1) // self.window * self.window
+            self.windows.append((first, len(self.touched), positive, len(self.touched) - positive))
+            self.touched.clear()
+
+
+    def words(self):                #   -> {address: (direct reads, indirect reads, direct writes, indirect writes)}
+        out = {}
+        for i, counts in enumerate(self.reads + self.writes):
+            for address, count in counts.items():
+                out.setdefault(address, [0, 0, 0, 0])[i] = count
+        return {address: tuple(counts) for address, counts in out.items()}
+
+
+    def by_label(self, labels):     #   -> (regions [(label, first, words, reads, writes)], dead labels)
+        where, regions = data_locator(labels, self.image[1] if self.image else None)
+        words = self.words()
+        out = []
+        dead = []
+        for label, first, last in regions:
+            low, high = min(first, last), max(first, last)
+            reads = writes = 0
+            ran = False
+            for address in range(low, high + 1):
+                counts = words.get(address)
+                if counts:
+                    reads += counts[0] + counts[1]
+                    writes += counts[2] + counts[3]
+                if address in self.ran:
+                    ran = True
+            out.append((label, first, high - low + 1, reads, writes))
+            if not reads and not writes and not ran:
+                dead.append(label)
+        return out, dead
+
+
+    def report(self, labels=None, top=20):
+        self.close_window()
+        where = data_locator(labels, self.image[1] if self.image else None)[0]
+        words = self.words()
+        out = ["Memory:  {} instructions, {} different words read or written".format(self.total, len(words)), ""]
+        if self.image:
+            out.append("  bounds    neg0 {} to {} (highest {}),  neg_max {} to {} (lowest {}),  {} moves".format(
+                self.image[0], self.moves[-1][1] if self.moves else self.image[0], self.highest,
+                self.image[1], self.moves[-1][2] if self.moves else self.image[1], self.lowest, len(self.moves)))
+            out.append("")
+        out.append("  address  where                 reads  (indirect)   writes  (indirect)")
+        hot = sorted(words.items(), key=lambda item: (-sum(item[1]), item[0]))[:top]
+        for address, (rd, ri, wd, wi) in hot:
+            out.append("  {:>7}  {:<20}{:>7}{:>12}{:>9}{:>12}".format(address, where(address), rd + ri, ri, wd + wi, wi))
+        if labels:
+            regions, dead = self.by_label(labels)
+            out.append("")
+            out.append("  label                 words    reads   writes")
+            for label, first, size, reads, writes in sorted(regions, key=lambda r: -(r[3] + r[4]))[:top]:
+                if reads or writes:
+                    out.append("  {:<20}{:>7}{:>9}{:>9}".format(label, size, reads, writes))
+            if dead:
+                out.append("")
+                out.append("  never touched:  " + " ".join(dead))
+        if self.windows:
+            sizes = [w[1] for w in self.windows]
+            out.append("")
+            out.append("  working set per {} instructions:  least {}, most {}, mean {:.1f} over {} windows".format(
+                self.window, min(sizes), max(sizes), sum(sizes) / len(sizes), len(sizes)))
+            step = max(1, len(self.windows) // top)
+            out.append("    from     words  positive  negative")
+            for first, size, positive, negative in self.windows[::step]:
+                out.append("  {:>7}{:>9}{:>10}{:>10}".format(first, size, positive, negative))
+        return "\n".join(out)
+
+
+    def to_json(self, labels=None):
+        self.close_window()
+        where = data_locator(labels, self.image[1] if self.image else None)[0]
+        regions, dead = self.by_label(labels) if labels else ([], [])
+        return {"instructions": self.total, "window": self.window,
+                "bounds": {"neg0": self.image[0] if self.image else None,
+                           "neg_max": self.image[1] if self.image else None,
+                           "highest_neg0": self.highest, "lowest_neg_max": self.lowest},
+                "moves": [list(move) for move in self.moves],
+                "windows": [list(window) for window in self.windows],
+                "words": [{"address": address, "where": where(address),
+                           "reads": rd, "indirect_reads": ri, "writes": wd, "indirect_writes": wi}
+                          for address, (rd, ri, wd, wi) in sorted(self.words().items())],
+                "labels": [{"label": label, "address": first, "words": size, "reads": reads, "writes": writes}
+                           for label, first, size, reads, writes in regions],
+                "never_touched": dead}
+
+
+    def save(self, name, labels=None):
+        with open(name, "w") as json_file:
+            json.dump(self.to_json(labels), json_file, indent=1)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# OISC:3 idiom recognizer
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   When the VM decodes an instruction for its cache, recognise() looks for a known sequence
+#   starting there and hands back a native routine that does the same work in one step:
+#
+#   print loop      Ploop:  /push *ptr  /exec Writechar  /lit- 1 ptr  /jump *ptr End  /jump Ploop
+#                   the whole string goes out in one write
+#   arithmetic      /push A  /push B  /exec Op  /pop C      or      /push A  /exec Op  /pop C
+#                   for the coprocessor ops made by unary() and binary()
+#   zeroing         A A A  B B B ...    two or more in a row;  one alone gains nothing
+#
+#   A routine is run(vm, allowed) -> (next pointer, instructions run), never more than allowed
+#   (negative means no limit).  It reads memory exactly as the instructions would, in the same
+#   order, and returns None rather than doing anything the instructions would fault on or that
+#   it can't finish within allowed, so the VM can run the plain instructions instead and get
+#   the same result, the same output and the same error.  That includes a limited data stack:
+#   a routine that would take the stack past vm.stack.limit leaves it to the instructions.
+#   The VM watches every word of a recognised sequence and forgets it once any of them is written.
+
+
+def decode(vm, p):                  #   vm.decode without the error report;  None where it would fail
+    if p < 0 or p + 2 >= vm.neg0:
+        return(None)
+    for i in range(p, p + 3):
+        word = vm.memory[i]
+        if word != 0 and (word > vm.neg0 or word < vm.neg_max):
+            return(None)
+    return(vm.decode(p))
+
+
+def recognise(vm, p, instr):        #   -> (run, end of the sequence) or None
+    if instr[0] == 3:
+        return(print_loop(vm, p, instr) or arithmetic(vm, p, instr))
+    if instr[0] == 0:
+        return(zero_run(vm, p, instr))
+    return(None)
+
+
+def print_loop(vm, p, instr):
+    ptr = instr[2]
+    if not instr[3]:
+        return(None)
+    ex, lit, test, back = [decode(vm, p + i) for i in (3, 6, 9, 12)]
+    if ex is None or ex[0] != 6 or ex[7]:
+        return(None)
+    if lit is None or lit[0] != 1 or lit[5] or lit[4] != ptr:
+        return(None)
+    if test is None or test[0] != 4 or not test[5] or test[4] != ptr or test[7] or test[6] < 0:
+        return(None)
+    if back is None or back[0] != 4 or back[5] or back[7] or back[6] != p:
+        return(None)
+    if p <= ptr < p + 15 or ptr in (ex[6], back[4]):
+        return(None)
+    if not getattr(vm.ops.get(vm.memory[ex[6]]), "prints", False):
+        return(None)
+    op_word = ex[6]
+    step = lit[1]
+    end = test[6]
+    zero = back[4]
+
+    def run(vm, allowed):
+        #   Only ptr is written, and it isn't Writechar or the jump's zero word, so those two
+        #   are read once;  ptr itself is kept in q and stored at the end.
+        memory = vm.memory
+        neg0 = vm.neg0
+        neg_max = vm.neg_max
+        if not getattr(vm.ops.get(memory[op_word]), "prints", False):
+            return(None)
+        if vm.stack.limit is not None and len(vm.stack) >= vm.stack.limit:
+            return(None)                                # push *ptr would overflow
+        again = memory[zero] <= 0
+        q = memory[ptr]
+        chars = []
+        count = 0
+        nextpoint = p
+        while allowed < 0 or count + 5 <= allowed:
+            if type(q) is not int or q > neg0 or q < neg_max or q == ptr:
+                break                                   # push *ptr
+            c = memory[q]
+            if not c >= 0:                              # exec Writechar
+                break
+            try:
+                char = chr(int(c))
+            except (ValueError, OverflowError):
+                break
+            n = q - step                                # lit- step ptr
+            if type(n) is not int or n > neg0 or n < neg_max or n == ptr:
+                break
+            chars.append(char)
+            q = n
+            count += 4
+            if memory[q] <= 0:                          # jump *ptr End
+                nextpoint = end
+                break
+            count += 1
+            if not again:                               # jump Ploop
+                nextpoint = p + 15
+                break
+        if count == 0:
+            return(None)
+        memory[ptr] = q
+        vm.output.write("".join(chars))
+        if 0 <= ptr < neg0:
+            vm.forget(ptr)
+        return(nextpoint, count)
+
+    return(run, p + 15)
+
+
+def arithmetic(vm, p, instr):
+    second = decode(vm, p + 3)
+    if second is None:
+        return(None)
+    if second[0] == 3:
+        operands = [instr, second]
+        ex = decode(vm, p + 6)
+        pop = decode(vm, p + 9)
+    else:
+        operands = [instr]
+        ex = second
+        pop = decode(vm, p + 6)
+    if ex is None or ex[0] != 6 or ex[7] or pop is None or pop[0] != 5:
+        return(None)
+    end = p + 3 * (len(operands) + 2)
+    z_ref, z_ind = pop[4], pop[5]
+    if not z_ind and p <= z_ref < end:
+        return(None)
+    if getattr(vm.ops.get(vm.memory[ex[6]]), "arity", None) != len(operands):
+        return(None)
+    sources = [(operand[2], operand[3]) for operand in operands]
+    op_word = ex[6]
+    length = len(operands) + 2
+
+    def run(vm, allowed):
+        if 0 <= allowed < length:
+            return(None)
+        if vm.stack.limit is not None and len(vm.stack) + len(sources) > vm.stack.limit:
+            return(None)                                # one of the pushes would overflow
+        memory = vm.memory
+        try:
+            values = []
+            for ref, ind in sources:                    # push A, push B
+                if ind:
+                    ref = memory[ref]
+                    if ref > vm.neg0 or ref < vm.neg_max:
+                        return(None)
+                values.append(memory[ref])
+            op = vm.ops.get(memory[op_word])            # exec Op
+            if getattr(op, "arity", None) != len(values):
+                return(None)
+            result = op.function(*values)
+            ref = z_ref                                 # pop C
+            if z_ind:
+                ref = memory[ref]
+                if ref > vm.neg0 or ref < vm.neg_max or p <= ref < end:
+                    return(None)
+            memory[ref] = result
+        except Exception:                               # the plain instructions will raise it properly
+            return(None)
+        if 0 <= ref < vm.neg0:
+            vm.forget(ref)
+        return(end, length)
+
+    return(run, end)
+
+
+def zero_run(vm, p, instr):
+    targets = []
+    q = p
+    while instr is not None and instr[0] == 0 and not (instr[3] or instr[5] or instr[7]) \
+            and instr[2] == instr[4] == instr[6] and len(targets) < 64:
+        targets.append(instr[6])
+        q += 3
+        instr = decode(vm, q)
+    if len(targets) < 2 or any(p <= target < q for target in targets):
+        return(None)
+    end = q
+
+    def run(vm, allowed):
+        if 0 <= allowed < len(targets):
+            return(None)
+        memory = vm.memory
+        count = 0
+        for target in targets:
+            try:
+                memory[target] = memory[target] - memory[target]
+            except Exception:                           # left for the plain instruction to report
+                break
+            if 0 <= target < vm.neg0:
+                vm.forget(target)
+            count += 1
+        if count == 0:
+            return(None)
+        return(p + 3 * count, count)
+
+    return(run, end)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# OISC:3 binary image
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   .o3i layout, all little endian:
+#
+#   header      magic "O3I\0", version (H), reserved (H),
+#               positive words, negative words, boxed bytes, label bytes (q each)
+#   values      positive words 0, 1, 2 ...  then negative words -1, -2, -3 ...  (q each)
+#   flags       one byte per word, same order  (INDIRECT, BOXED from oisc3_memory)
+#   boxed       text lines "address value" for words that don't fit 64 bits or aren't whole
+#   labels      text lines "name address"
+#
+#   The header is 40 bytes (HEADER.size), a multiple of 8, so the value array stays 8 byte
+#   aligned and can be used straight out of a copy-on-write mmap.
+
+
+import mmap
+import struct
+import sys
+from array import array
+from oisc3_memory import CompactMemory, TypedRegion, encode, BOXED
+
+
+MAGIC = b"O3I\0"
+VERSION = 1
+HEADER = struct.Struct("<4sHHqqqq")
+CHUNK = 4096
+
+
+def write_image(o3i_file, mem, neg0, labels=None):
+    #   mem is a flat image list or any memory object;  words are read one at a time in
+    #   region order, so nothing the size of the image is copied on the way out.
+    pos_count = neg0
+    neg_count = len(mem) - neg0
+    base = o3i_file.tell()                  # an image can sit inside a bigger file, see oisc3_snapshot
+    o3i_file.write(bytes(HEADER.size))      # filled in once the side tables are known
+    flags = bytearray()
+    boxed = []
+    addresses = [range(pos_count), range(-1, -neg_count - 1, -1)]
+    for region in addresses:
+        for start in range(0, len(region), CHUNK):
+            values = array('q')
+            for i in region[start:start + CHUNK]:
+                value = mem[i]
+                a, f = encode(value)
+                values.append(a)
+                flags.append(f)
+                if f & BOXED:
+                    boxed.append("{} {!r}\n".format(i, value))
+            if sys.byteorder != "little":
+                values.byteswap()
+            o3i_file.write(values.tobytes())
+    o3i_file.write(flags)
+    boxed = "".join(boxed).encode()
+    o3i_file.write(boxed)
+    if labels is None:
+        labels = {}
+    label_text = "".join("{} {}\n".format(label, labels[label]) for label in labels).encode()
+    o3i_file.write(label_text)
+    o3i_file.seek(base)
+    o3i_file.write(HEADER.pack(MAGIC, VERSION, 0, pos_count, neg_count, len(boxed), len(label_text)))
+    o3i_file.seek(0, 2)
+
+
+def load_image(o3i_name, offset=0):
+    #   -> (CompactMemory, neg0, labels) without tokenizing anything.  The value and flag
+    #   arrays are views into a private mapping of the file, so pages are only read as
+    #   they're touched, and writes never reach the file.  offset:  where the image starts.
+    with open(o3i_name, "rb") as o3i_file:
+        mapped = mmap.mmap(o3i_file.fileno(), 0, access=mmap.ACCESS_COPY)
+    if len(mapped) < offset + HEADER.size:
+        print(o3i_name, "is too short to be an OISC:3 image", flush=True)
+        raise ValueError
+    magic, version, reserved, pos_count, neg_count, boxed_len, label_len = HEADER.unpack_from(mapped, offset)
+    if magic != MAGIC:
+        print(o3i_name, "is not an OISC:3 image", flush=True)
+        raise ValueError
+    if version != VERSION:
+        print(o3i_name, "is image version", version, "but I only know version", VERSION, flush=True)
+        raise ValueError
+    view = memoryview(mapped)
+    offset += HEADER.size
+    pos_values = words(view[offset:offset + 8 * pos_count])
+    offset += 8 * pos_count
+    neg_values = words(view[offset:offset + 8 * neg_count])
+    offset += 8 * neg_count
+    pos_flags = view[offset:offset + pos_count]
+    offset += pos_count
+    neg_flags = view[offset:offset + neg_count]
+    offset += neg_count
+    pos_boxed = {}
+    neg_boxed = {}
+    for line in bytes(view[offset:offset + boxed_len]).decode().splitlines():
+        i, value = line.split(" ", 1)
+        i = int(i)
+        value = float(value) if '.' in value or 'e' in value or 'n' in value else int(value)
+        if i >= 0:
+            pos_boxed[i] = value
+        else:
+            neg_boxed[~i] = value
+    offset += boxed_len
+    labels = {}
+    for line in bytes(view[offset:offset + label_len]).decode().splitlines():
+        label, address = line.rsplit(" ", 1)
+        labels[label] = int(address)
+    memory = CompactMemory()
+    memory.pos = TypedRegion(pos_values, pos_flags, pos_boxed)
+    memory.neg = TypedRegion(neg_values, neg_flags, neg_boxed)
+    return(memory, pos_count, labels)
+
+
+def words(view):
+    if sys.byteorder == "little":
+        return view.cast('q')
+    values = array('q')
+    values.frombytes(view)
+    values.byteswap()
+    return values
+
+
+def is_image(name):
+    try:
+        with open(name, "rb") as o3i_file:
+            return o3i_file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# OISC:3 input and output channels
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Coprocessor ops 1 and 2 read from vm.input, ops -1 and -2 write to vm.output.
+#
+#   BufferedOutput collects text and hands it to the real stream according to its flush policy:
+#       "line"      at every newline (the default on a terminal)
+#       "halt"      only when the VM stops or waits for input
+#       N           whenever N characters are waiting (the default when redirected)
+#       "char"      after every write, the old behaviour
+#   Whatever is waiting is always flushed before the VM reads input, so prompts show up.
+#
+#   TerminalInput reads keys with getch, StreamInput reads from a str, bytes, file or pipe,
+#   QueueInput is fed by the embedding program while the VM runs.
+#   read_char() returns "" once the input is used up, and None if nothing has arrived yet,
+#   which pauses the VM (status WAITING) until it's fed and run again.
+#   pending() is the text read in but not yet used, for snapshots and forks.
+
+
+import asyncio
+import sys
+from collections import deque
+try:
+    from getch import getche                # Linux
+except ImportError:
+    try:
+        from msvcrt import getche           # Windows
+    except ImportError:
+        getche = None
+
+
+DEFAULT_BUFFER = 65536
+
+
+class BufferedOutput:
+
+    def __init__(self, stream=None, flush=None):
+        self.stream = stream                # None means whatever sys.stdout is at flush time
+        if flush is None:
+            target = stream if stream is not None else sys.stdout
+            isatty = getattr(target, "isatty", None)
+            flush = "line" if isatty is not None and isatty() else DEFAULT_BUFFER
+        if flush not in ("line", "halt", "char") and not (type(flush) is int and flush > 0):
+            print("Unknown flush policy", flush, "- use line, halt, char or a size", flush=True)
+            raise ValueError
+        self.policy = flush
+        self.parts = []
+        self.size = 0
+
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.policy == "char":
+            self.flush()
+        elif self.policy == "line":
+            if "\n" in text:
+                self.flush()
+        elif self.policy != "halt" and self.size >= self.policy:
+            self.flush()
+
+
+    def flush(self):
+        if self.size:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write("".join(self.parts))
+            stream.flush()
+            self.parts = []
+            self.size = 0
+
+
+class TerminalInput:
+
+    echo = False                            # getche echoes by itself
+
+    def read_char(self):
+        if getche is None:
+            print("\nNo getch available for keyboard input;  give the program an input file instead", flush=True)
+            raise ValueError
+        a = getche()
+        if type(a) is bytes:
+            a = a.decode("latin-1")
+        return a
+
+
+    def pending(self):                  #   the keyboard keeps nothing back
+        return ""
+
+
+class StreamInput:
+
+    def __init__(self, source, echo=False):
+        #   source:  str or bytes to read from directly, or any object with read()
+        if type(source) is bytes:
+            source = source.decode("latin-1")
+        self.source = source
+        self.position = 0
+        self.echo = echo
+
+
+    def read_char(self):
+        if type(self.source) is str:
+            if self.position >= len(self.source):
+                return ""
+            a = self.source[self.position]
+            self.position += 1
+            return a
+        a = self.source.read(1)
+        if type(a) is bytes:
+            a = a.decode("latin-1")
+        return a
+
+
+    def pending(self):                  #   a file or pipe is read to the end and kept as text from here on
+        if type(self.source) is not str:
+            text = self.source.read()
+            if type(text) is bytes:
+                text = text.decode("latin-1")
+            self.source = text
+            self.position = 0
+        return self.source[self.position:]
+
+
+class QueueInput:
+
+    echo = False
+
+    def __init__(self, text=""):
+        self.queue = deque(text)
+        self.closed = False             # once closed and empty, reads see end of input
+        self.event = None
+
+
+    def feed(self, text):               #   from the event loop's thread if anything awaits wait()
+        self.queue.extend(text)
+        if self.event is not None:
+            self.event.set()
+
+
+    def close(self):
+        self.closed = True
+        if self.event is not None:
+            self.event.set()
+
+
+    def read_char(self):
+        if self.queue:
+            return self.queue.popleft()
+        if self.closed:
+            return ""
+        return None
+
+
+    def pending(self):
+        return "".join(self.queue)
+
+
+    async def wait(self):               #   until there's something to read, or the input is closed
+        while not self.queue and not self.closed:
+            self.event = asyncio.Event()
+            await self.event.wait()
+        self.event = None
+
+
+def copy_input(channel):            #   a new channel of the same kind, holding what channel hasn't used yet
+    if isinstance(channel, QueueInput):
+        other = QueueInput(channel.pending())
+        other.closed = channel.closed
+        return other
+    if isinstance(channel, StreamInput):
+        return StreamInput(channel.pending(), channel.echo)
+    return channel                  # the keyboard, or anything else, can only be shared
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# OISC:3 modules and linker
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   A module is an ordinary .o3a file, positive code and data, then % --NEGATIVE--, then
+#   negative data, with two extra kinds of line:
+#
+#       .export Print Malloc        labels other modules may use
+#       .import Print               labels this module uses but another one defines
+#
+#   Every other label stays private to its module, so two modules can both have a Loop.
+#   Each module assembles on its own into a relocatable object (.o3o, JSON):  its positive
+#   and negative words, its exports, the words holding its own addresses (relocations),
+#   and the words naming an import, direct or *pointer.
+#
+#   The linker lays the positive sections end to end from 0, the first module first, so
+#   that is where the program starts.  The negative sections go end to end down from -1 in
+#   the same order.  Every relocated word moves with the section its address points into,
+#   and every import becomes the address (or *pointer) of the export it names.
+#   In the linked labels, exports keep their names and private labels become module.label.
+#
+#   Objects are kept next to their sources (or in --build=dir) and only reassembled when
+#   the source or the assembler has changed, so a program's shared runtime library is
+#   assembled once, not on every edit of the program.
+#
+#   usage:  python oisc3_link.py [--build=dir] [--out=prog.o3i] main.o3a lib.o3a ...
+
+
+import hashlib
+import json
+import os
+import sys
+from oisc3_parser import Parser, ASSEMBLER_VERSION
+from oisc3_image import write_image
+
+
+OBJECT_VERSION = 1
+
+
+class Module:
+
+    def __init__(self, name, pos, neg, labels, exports, relocations, references, digest=None):
+        self.name = name
+        self.pos = pos                  # words 0, 1, 2 ...
+        self.neg = neg                  # words -1, -2, -3 ...
+        self.labels = labels            # every label -> its address in the module
+        self.exports = exports
+        self.relocations = relocations  # (word address, address it holds)
+        self.references = references   # (word address, imported name, indirect)
+        self.digest = digest            # of the source it came from
+
+
+    def to_json(self):
+        return {"version": OBJECT_VERSION, "name": self.name, "digest": self.digest,
+                "pos": self.pos, "neg": self.neg, "labels": self.labels, "exports": self.exports,
+                "relocations": self.relocations, "references": self.references}
+
+
+def source_digest(source):
+    digest = hashlib.sha256()
+    digest.update("oisc3 assembler {} object {}\n".format(ASSEMBLER_VERSION, OBJECT_VERSION).encode())
+    digest.update(source.encode())
+    return digest.hexdigest()
+
+
+def assemble_module(source, name, digest=None):     #   -> Module
+    parser = Parser()
+    mem, neg0 = parser.parse(source, relocatable=True)
+    labels = {label: address for label, address in parser.label_table.items() if label != "--NEGATIVE--"}
+    for export in parser.exports:
+        if export not in labels:
+            print("Module", name, "exports", export, "but never defines it", flush=True)
+            raise ValueError
+    neg = mem[neg0:]
+    neg.reverse()                   # the image keeps negative memory bottom up
+    return(Module(name, mem[:neg0], neg, labels, list(parser.exports),
+                  parser.relocations, parser.references, digest))
+
+
+def object_path(source_path, build=None):
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    folder = build if build is not None else os.path.dirname(source_path)
+    return os.path.join(folder, stem + ".o3o")
+
+
+def load_module(o3o_path):          #   -> Module, or None if there's no usable object
+    try:
+        with open(o3o_path, "r") as o3o_file:
+            saved = json.load(o3o_file)
+    except (OSError, ValueError):
+        return None
+    if saved.get("version") != OBJECT_VERSION:
+        return None
+    return(Module(saved["name"], saved["pos"], saved["neg"], saved["labels"], saved["exports"],
+                  [tuple(r) for r in saved["relocations"]], [tuple(r) for r in saved["references"]],
+                  saved["digest"]))
+
+
+def save_module(o3o_path, module):
+    try:
+        folder = os.path.dirname(o3o_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(o3o_path + ".tmp", "w") as o3o_file:
+            json.dump(module.to_json(), o3o_file)
+        os.replace(o3o_path + ".tmp", o3o_path)
+    except OSError:
+        pass                        # no object just means assembling next time
+
+
+def build(source_paths, build=None):
+    #   -> (modules, names of the ones reassembled).  A module is reassembled only when its
+    #   object is missing or was made from different source, or by another assembler.
+    modules = []
+    rebuilt = []
+    for path in source_paths:
+        with open(path, "r") as o3a_file:
+            source = o3a_file.read()
+        name = os.path.splitext(os.path.basename(path))[0]
+        digest = source_digest(source)
+        o3o_path = object_path(path, build)
+        module = load_module(o3o_path)
+        if module is None or module.digest != digest:
+            module = assemble_module(source, name, digest)
+            save_module(o3o_path, module)
+            rebuilt.append(name)
+        modules.append(module)
+    return(modules, rebuilt)
+
+
+def link(modules):
+    #   -> (mem, neg0, labels), the same as Parser.parse and oisc3_cache.assemble give
+    pos_base = []
+    neg_base = []
+    pos_size = neg_size = 0
+    for module in modules:
+        pos_base.append(pos_size)
+        neg_base.append(neg_size)
+        pos_size += len(module.pos)
+        neg_size += len(module.neg)
+
+    def place(k, address):          #   module k's address -> the linked one
+        if address >= 0:
+            return address + pos_base[k]
+        return address - neg_base[k]
+
+    symbols = {}
+    owners = {}
+    labels = {}
+    for k, module in enumerate(modules):
+        for label, address in module.labels.items():
+            labels["{}.{}".format(module.name, label)] = place(k, address)
+        for export in module.exports:
+            if export in symbols:
+                print(export, "is exported by both", owners[export], "and", module.name, flush=True)
+                raise ValueError
+            symbols[export] = place(k, module.labels[export])
+            owners[export] = module.name
+            labels[export] = symbols[export]
+    labels["--NEGATIVE--"] = pos_size
+
+    pos = []
+    neg = []
+    for k, module in enumerate(modules):
+        words = {}                  # word address in the module -> new value
+        for address, value in module.relocations:
+            words[address] = place(k, value)
+        for address, name, indirect in module.references:
+            if name not in symbols:
+                print("Module", module.name, "imports", name, "but no module exports it", flush=True)
+                raise ValueError
+            words[address] = symbols[name]
+        for region, base, step in ((module.pos, pos, 1), (module.neg, neg, -1)):
+            for i, value in enumerate(region):
+                address = i if step > 0 else -1 - i
+                if address in words:
+                    new = words[address]
+                    value = float(new) if type(value) is float else new
+                base.append(value)
+    neg.reverse()
+    return(pos + neg, pos_size, labels)
+
+
+def main(args):
+    options = dict(arg[2:].split("=", 1) if "=" in arg else (arg[2:], True) for arg in args if arg.startswith("--"))
+    paths = [arg for arg in args if not arg.startswith("--")]
+    if not paths:
+        print("\nusage: python oisc3_link.py [--build=dir] [--out=prog.o3i] main.o3a lib.o3a ...\n")
+        return 2
+    modules, rebuilt = build(paths, options.get("build"))
+    mem, neg0, labels = link(modules)
+    out = options.get("out", os.path.splitext(paths[0])[0] + ".o3i")
+    with open(out, "wb") as o3i_file:
+        write_image(o3i_file, mem, neg0, labels)
+    print("assembled", ", ".join(rebuilt) or "nothing", "-", len(modules), "modules linked into", out,
+          "({} words)".format(len(mem)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# OISC:3 paged memory
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Positive and negative memory are kept as two separate regions of fixed size pages.
+#   Address  0,  1,  2 ...  live in the positive pages,
+#   address -1, -2, -3 ...  live in the negative pages,
+#   so alloc and free only touch the end of one region and never move an existing word.
+#   New pages all share ZERO_PAGE, a read only tuple, and are copied on their first write.
+#   fork() works the same way:  every page becomes a tuple shared by both copies, and
+#   whichever side writes to a page first gets its own list.
+#
+#   CompactMemory is the optional typed layout for big images:  each region is an array of
+#   64 bit ints plus one flag byte per word.  Floats keep their rounded address in the int
+#   array with the INDIRECT flag set, so decoding an operand is a flag test.  Anything that
+#   doesn't fit (fractional floats, huge ints) is BOXED in a small side table.
+
+from array import array
+
+
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+ZERO_PAGE = (0,) * PAGE_SIZE
+
+
+class PagedMemory:
+
+    def __init__(self, mem=(), neg0=0):
+        self.pos = []               # pages for 0, 1, 2 ...
+        self.neg = []               # pages for -1, -2, -3 ...
+        self.pos_size = 0
+        self.neg_size = 0
+        mem = list(mem)
+        self.load(self.pos, mem[:neg0])
+        self.pos_size = neg0
+        negmem = mem[neg0:]
+        negmem.reverse()            # the image stores negative memory from the bottom up
+        self.load(self.neg, negmem)
+        self.neg_size = len(negmem)
+
+
+    def load(self, pages, words):
+        for start in range(0, len(words), PAGE_SIZE):
+            page = words[start:start + PAGE_SIZE]
+            page.extend(ZERO_PAGE[len(page):])
+            pages.append(page)
+
+
+    def __getitem__(self, i):
+        if i >= 0:
+            return self.pos[i >> PAGE_BITS][i & PAGE_MASK]
+        i = ~i
+        return self.neg[i >> PAGE_BITS][i & PAGE_MASK]
+
+
+    def __setitem__(self, i, value):
+        if i >= 0:
+            pages = self.pos
+        else:
+            pages = self.neg
+            i = ~i
+        try:
+            pages[i >> PAGE_BITS][i & PAGE_MASK] = value
+        except TypeError:           # first write to a shared page
+            page = list(pages[i >> PAGE_BITS])
+            page[i & PAGE_MASK] = value
+            pages[i >> PAGE_BITS] = page
+
+
+    def __len__(self):
+        return self.pos_size + self.neg_size
+
+
+    def is_indirect(self, i):       #   indirection is marked by a float
+        return type(self[i]) is float
+
+
+    def address(self, i):           #   the word at i as an address, adjusted for float rounding errors
+        a = self[i]
+        if type(a) is float:
+            if a > 0:
+                return int(a + 0.0000001)
+            return int(a - 0.0000001)
+        return a
+
+
+    def alloc(self, n):             #   n > 0 grows positive memory, n < 0 grows negative memory
+        if n > 0:
+            self.pos_size = self.grow(self.pos, self.pos_size, n)
+        elif n < 0:
+            self.neg_size = self.grow(self.neg, self.neg_size, -n)
+
+
+    def free(self, n):              #   n > 0 shrinks positive memory, n < 0 shrinks negative memory
+        if n > 0:
+            self.pos_size = self.shrink(self.pos, self.pos_size, n)
+        elif n < 0:
+            self.neg_size = self.shrink(self.neg, self.neg_size, -n)
+
+
+    def grow(self, pages, size, n):
+        #   the VM's bounds let a program write the word just past the end (neg0, or neg_max),
+        #   which lands in the last page's padding, so that's cleared before it's handed out
+        if size & PAGE_MASK:
+            self.clear(pages, size, n)
+        size += n
+        while len(pages) << PAGE_BITS < size:
+            pages.append(ZERO_PAGE)
+        return size
+
+
+    def shrink(self, pages, size, n):
+        if n > size:
+            print("Can't free", n, "words, only", size, "allocated", flush=True)
+            raise IndexError
+        size -= n
+        del pages[(size + PAGE_MASK) >> PAGE_BITS:]
+        if size & PAGE_MASK:        # clear the freed tail of the last page, so a later alloc reads zeros
+            self.clear(pages, size, n)
+        return size
+
+
+    def clear(self, pages, size, n):    #   zero up to n words of the last page, from size on
+        page = pages[-1]
+        if page is not ZERO_PAGE:
+            if type(page) is tuple:
+                page = pages[-1] = list(page)
+            start = size & PAGE_MASK
+            end = min(PAGE_SIZE, start + n)
+            page[start:end] = ZERO_PAGE[start:end]
+
+
+    def fork(self):                 #   -> a copy that shares every page until one side writes to it
+        for pages in (self.pos, self.neg):
+            for i, page in enumerate(pages):
+                if type(page) is list:
+                    pages[i] = tuple(page)
+        other = PagedMemory()
+        other.pos = list(self.pos)
+        other.neg = list(self.neg)
+        other.pos_size = self.pos_size
+        other.neg_size = self.neg_size
+        return other
+
+
+    def tolist(self):               #   back to the flat image:  positive, then negative from the bottom up
+        mem = [self[i] for i in range(self.pos_size)]
+        mem.extend(self[~i] for i in range(self.neg_size - 1, -1, -1))
+        return mem
+
+
+INDIRECT = 1
+BOXED = 2
+WORD_MIN = -(1 << 63)
+WORD_MAX = (1 << 63) - 1
+
+
+def encode(value):                  #   value -> (int word, flags);  a BOXED value has to be kept aside as well
+    if type(value) is float:
+        try:
+            if value > 0:
+                a = int(value + 0.0000001)
+            else:
+                a = int(value - 0.0000001)
+        except (OverflowError, ValueError):
+            return(0, INDIRECT | BOXED)
+        if a < WORD_MIN or a > WORD_MAX:
+            return(0, INDIRECT | BOXED)
+        if a == value:
+            return(a, INDIRECT)
+        return(a, INDIRECT | BOXED)
+    if type(value) is int and WORD_MIN <= value <= WORD_MAX:
+        return(value, 0)
+    return(0, BOXED)
+
+
+def held():                         #   alloc or free while a MemoryWindow (oisc3_buffer) is open
+    print("Can't alloc or free while a memory window is open", flush=True)
+    raise ValueError
+
+
+class TypedRegion:
+
+    def __init__(self, values=None, flags=None, boxed=None):
+        self.values = array('q') if values is None else values
+        self.flags = bytearray() if flags is None else flags
+        self.boxed = {} if boxed is None else boxed
+
+
+    def append(self, value):
+        self.values.append(0)
+        self.flags.append(0)
+        self.put(len(self.flags) - 1, value)
+
+
+    def get(self, i):
+        f = self.flags[i]
+        if not f:
+            return self.values[i]
+        if f & BOXED:
+            return self.boxed[i]
+        return float(self.values[i])
+
+
+    def put(self, i, value):
+        if self.flags[i] & BOXED:
+            del self.boxed[i]
+        a, f = encode(value)
+        self.values[i] = a
+        self.flags[i] = f
+        if f & BOXED:
+            self.boxed[i] = value
+
+
+    def own(self):                  #   swap mapped buffers (see oisc3_image) for resizable ones
+        if type(self.values) is not array:
+            values = array('q')
+            values.frombytes(self.values.tobytes())
+            self.values = values
+        if type(self.flags) is not bytearray:
+            self.flags = bytearray(self.flags)
+
+
+    def grow(self, n):
+        self.own()
+        try:
+            self.values.frombytes(bytes(n * self.values.itemsize))
+        except BufferError:
+            held()
+        self.flags.extend(bytes(n))
+
+
+    def shrink(self, n):
+        self.own()
+        size = len(self.flags)
+        if n > size:
+            print("Can't free", n, "words, only", size, "allocated", flush=True)
+            raise IndexError
+        size -= n
+        try:
+            del self.values[size:]
+        except BufferError:
+            held()
+        del self.flags[size:]
+        for i in [i for i in self.boxed if i >= size]:
+            del self.boxed[i]
+
+
+    def copy(self):
+        values = array('q')
+        values.frombytes(self.values.tobytes())
+        return TypedRegion(values, bytearray(self.flags), dict(self.boxed))
+
+
+    def reverse(self):
+        self.own()
+        last = len(self.flags) - 1
+        self.values.reverse()
+        self.flags.reverse()
+        self.boxed = {last - i: value for i, value in self.boxed.items()}
+
+
+class CompactMemory:
+
+    def __init__(self, mem=(), neg0=0):
+        self.pos = TypedRegion()        # 0, 1, 2 ...
+        self.neg = TypedRegion()        # -1, -2, -3 ...
+        for i, value in enumerate(mem):
+            if i < neg0:
+                self.pos.append(value)
+            else:
+                self.neg.append(value)
+        self.neg.reverse()              # the image stores negative memory from the bottom up
+
+
+    def __getitem__(self, i):
+        if i >= 0:
+            return self.pos.get(i)
+        return self.neg.get(~i)
+
+
+    def __setitem__(self, i, value):
+        if i >= 0:
+            self.pos.put(i, value)
+        else:
+            self.neg.put(~i, value)
+
+
+    def __len__(self):
+        return len(self.pos.flags) + len(self.neg.flags)
+
+
+    def is_indirect(self, i):
+        if i >= 0:
+            return self.pos.flags[i] & INDIRECT != 0
+        return self.neg.flags[~i] & INDIRECT != 0
+
+
+    def address(self, i):           #   already rounded when the word was stored
+        if i >= 0:
+            return self.pos.values[i]
+        return self.neg.values[~i]
+
+
+    def fork(self):                 #   the typed arrays are flat, so a fork is a straight copy of them
+        other = CompactMemory()
+        other.pos = self.pos.copy()
+        other.neg = self.neg.copy()
+        return other
+
+
+    def alloc(self, n):
+        if n > 0:
+            self.pos.grow(n)
+        elif n < 0:
+            self.neg.grow(-n)
+
+
+    def free(self, n):
+        if n > 0:
+            self.pos.shrink(n)
+        elif n < 0:
+            self.neg.shrink(-n)
+
+
+    def tolist(self):
+        mem = [self.pos.get(i) for i in range(len(self.pos.flags))]
+        mem.extend(self.neg.get(i) for i in range(len(self.neg.flags) - 1, -1, -1))
+        return mem
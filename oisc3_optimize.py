@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# OISC:3 peephole optimizer
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   optimize() rewrites an assembled image so it runs fewer instructions:
+#
+#   threading       a call or jump to an unconditional jump goes straight to where that one goes
+#   no-op jumps     a jump to the next instruction, or a call to a routine that only does /ret,
+#                   is dropped
+#   lit- folding    /lit- a X  /lit- b X  becomes  /lit- a+b X,  or nothing when a+b is 0
+#   zeroing         X X X  twice in a row becomes once
+#
+#   and then closes the gaps, moving the rest of positive memory down and every address
+#   that points into it (labels, ?, @ and *pointers, as Parser records them when relocatable).
+#   Negative memory doesn't move.
+#
+#   It only touches a program oisc3_verify can verify:  all calls and jumps direct, no code
+#   ever written.  An instruction whose words are pointed at by anything but a call or jump
+#   target is left exactly where and as it is, and so is a jump whose test goes through a
+#   pointer.  An address written as a plain number rather than a label isn't moved, so
+#   nothing at or below the highest such number in the code is taken out, and a number like
+#   that in data can't be seen at all.  A /lit- literal still has to be inside the bounds,
+#   so positive memory is padded with zeros rather than shrink below the largest one.
+
+
+from oisc3_vm import Oisc3VM
+from oisc3_verify import verify
+
+
+class Optimizer:
+
+    def __init__(self, mem, neg0, relocations):
+        self.mem = list(mem)
+        self.neg0 = neg0
+        self.targets = dict(relocations)    # word address -> the address it holds
+        vm = Oisc3VM()
+        vm.load(list(mem), neg0)
+        self.vm = vm
+        self.check = verify(vm)
+        self.code = {}                      # reachable instruction start -> decoded instruction
+        self.owner = {}                     # word -> start of the reachable instruction holding it
+        self.removed = set()
+        self.pinned = set()
+        self.entered = set()                # instruction starts some call or jump lands on
+        self.floor = 0                      # highest plain positive address in the code
+        self.literal = 0                    # highest /lit- literal
+        self.counts = {"threaded": 0, "jumps": 0, "folded": 0, "zeroing": 0}
+
+
+    def word(self, address):
+        return self.mem[address] if address >= 0 else self.mem[len(self.mem) + address]
+
+
+    def set_word(self, address, value):
+        if address >= 0:
+            self.mem[address] = value
+        else:
+            self.mem[len(self.mem) + address] = value
+
+
+    def analyse(self):              #   -> False if the program has to be left alone
+        if not self.check.verified():
+            return(False)
+        for p in self.check.reachable:
+            self.code[p] = self.vm.decode(p)
+            for w in range(p, p + 3):
+                self.owner[w] = p
+                if w in self.targets:
+                    continue
+                if w == p and self.code[p][0] == 1:
+                    self.literal = max(self.literal, self.mem[w])
+                elif self.mem[w] > self.floor:
+                    self.floor = self.mem[w]
+        for w, t in self.targets.items():
+            if 0 <= t < self.neg0:
+                p = self.owner.get(w - 2)
+                if p == w - 2 and self.code[p][0] in (2, 4) and t in self.code:
+                    self.entered.add(t)     # a call or jump target can move with its label
+                elif t in self.owner:
+                    self.pinned.add(self.owner[t])
+        return(True)
+
+
+    def always(self, p):            #   is p a jump that is always taken, to a direct address?
+        instr = self.code.get(p)
+        if instr is None or instr[0] != 4 or instr[5] or instr[7]:
+            return(False)
+        written = self.check.written
+        return(instr[4] not in written and self.word(instr[4]) <= 0)
+
+
+    def next_kept(self, p):         #   the first instruction at or after p that stays
+        while p in self.removed:
+            p += 3
+        return(p)
+
+
+    def removable(self, p):
+        return(p > self.floor and p not in self.pinned and p not in self.removed)
+
+
+    def remove(self, p):
+        self.removed.add(p)
+        return(True)
+
+
+    def thread(self):
+        changed = False
+        for p, instr in self.code.items():
+            if p in self.removed or p in self.pinned or instr[0] not in (2, 4) or instr[7]:
+                continue
+            t = instr[6]
+            seen = set()
+            while t >= 0 and self.always(t) and t not in seen and p + 2 in self.targets:
+                seen.add(t)
+                if self.code[t][6] < 0:
+                    break
+                t = self.code[t][6]
+            if t != instr[6]:
+                self.set_word(p + 2, t)
+                self.targets[p + 2] = t
+                self.entered.add(t)
+                self.code[p] = instr[:6] + (t, False)
+                self.counts["threaded"] += 1
+                changed = True
+        return(changed)
+
+
+    def drop_noops(self):
+        changed = False
+        for p in sorted(self.code):
+            instr = self.code[p]
+            if not self.removable(p):
+                continue
+            kind = instr[0]
+            if kind == 4 and not instr[5] and not instr[7] and instr[6] >= 0 \
+                    and self.next_kept(instr[6]) == self.next_kept(p + 3):
+                changed = self.remove(p)
+                self.counts["jumps"] += 1
+            elif kind == 2 and not instr[3] and not instr[7] and instr[6] >= 0:
+                t = self.next_kept(instr[6])
+                if t in self.code and self.code[t][0] == 7:
+                    changed = self.remove(p)
+                    self.counts["jumps"] += 1
+        return(changed)
+
+
+    def fold(self):
+        changed = False
+        for p in sorted(self.code):
+            q = self.next_kept(p + 3)
+            if q not in self.code or not self.removable(q) or q in self.entered:
+                continue
+            if p in self.removed or p in self.pinned:
+                continue
+            first = self.code[p]
+            second = self.code[q]
+            if first[0] == 1 and second[0] == 1 and not first[5] and not second[5] and first[4] == second[4] \
+                    and type(first[1]) is int and type(second[1]) is int \
+                    and p not in self.targets and q not in self.targets:
+                total = first[1] + second[1]
+                if total > self.neg0 or total < self.vm.neg_max or (total == 0 and p <= self.floor):
+                    continue                # the literal has to stay inside the bounds
+                self.literal = max(self.literal, total)
+                self.remove(q)
+                if total == 0:              # 0 X 0 would be a pop
+                    self.remove(p)
+                else:
+                    self.set_word(p, total)
+                    self.code[p] = (1, total, total) + first[3:]
+                self.counts["folded"] += 1
+                changed = True
+            elif first[0] == 0 and first == second and not first[3] and not first[5] and not first[7] \
+                    and first[2] == first[4] == first[6]:
+                self.remove(q)
+                self.counts["zeroing"] += 1
+                changed = True
+        return(changed)
+
+
+    def compact(self, labels, source_map):
+        #   -> (mem, neg0, labels, source_map) with the removed instructions gone
+        removed = sorted(self.removed)
+
+        def moved(address):
+            if address < 0:
+                return address
+            lo, hi = 0, len(removed)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if removed[mid] < address:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return address - 3 * lo
+
+        for w, t in self.targets.items():
+            if 0 <= t < self.neg0:
+                value = self.word(w)
+                self.set_word(w, float(moved(t)) if type(value) is float else moved(t))
+        gone = set(w for p in removed for w in range(p, p + 3))
+        keep = [i for i in range(len(self.mem)) if i not in gone]
+        neg0 = self.neg0 - len(gone)
+        padding = max(0, self.literal - neg0)
+        mem = [self.mem[i] for i in keep[:neg0]] + [0] * padding + [self.mem[i] for i in keep[neg0:]]
+        neg0 += padding
+        labels = {label: (moved(address) if label != "--NEGATIVE--" else neg0)
+                  for label, address in (labels or {}).items()}
+        if source_map:
+            source_map = [source_map[i] if i < len(source_map) else 0 for i in keep]
+            source_map[neg0 - padding:neg0 - padding] = [0] * padding
+        return(mem, neg0, labels, source_map)
+
+
+def optimize(mem, neg0, relocations, labels=None, source_map=None):
+    #   relocations:  Parser.relocations from parse(..., relocatable=True)
+    #   -> (mem, neg0, labels, source_map, counts);  counts is None if the program was left alone
+    optimizer = Optimizer(mem, neg0, relocations)
+    if not optimizer.analyse():
+        return(list(mem), neg0, labels, source_map, None)
+    changed = True
+    while changed:
+        changed = optimizer.thread()
+        changed = optimizer.drop_noops() or changed
+        changed = optimizer.fold() or changed
+    mem, neg0, labels, source_map = optimizer.compact(labels, source_map)
+    optimizer.counts["words"] = len(optimizer.mem) - len(mem)
+    return(mem, neg0, labels, source_map, optimizer.counts)
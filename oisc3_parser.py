@@ -31,52 +31,105 @@
  #  " or '   string delimeters, must be data
  #  %        data indicator (not needed in negative memory)
  #  % --NEGATIVE--: --NEGATIVE--    begin negative memory
+ #  COPY FILL COMPARE SUM FIND      bulk memory op words, supplied if used but not defined
+ #  .export name ...                labels other modules may use       (see oisc3_link)
+ #  .import name ...                labels defined by other modules
+
+import re
+from oisc3_memory import CompactMemory
+
+
+ASSEMBLER_VERSION = 4           # bump whenever the same source would assemble differently
+
+#   Named coprocessor ops.  Like ZERO, a name the program uses without defining it gets a
+#   word holding its op number at the end of negative memory, so /exec COPY just works.
+OP_NAMES = {"COPY": 24, "FILL": -24, "COMPARE": 25, "SUM": -25, "FIND": 26,
+            "SEND": 27, "RECV": -27, "TRYRECV": 28, "VMINDEX": -28, "VMCOUNT": 29}
 
 
 class Parser:
 
-    tokens = []
-    label_table = {}
-    neg0 = 0
+    #   Every pass below is a single walk over the source or the token list, so assembly
+    #   time grows linearly with the program, however many labels it has.
+
+    spacing = str.maketrans({'#': ';#', ':': ': ', '%': '% ', '!': '0 ',
+                             '@': '@ ', '?': '? ', ',': ' '})
+    specials = re.compile(r"""(["'#\n\r])""")
+
 
+    def __init__(self):
+        self.tokens = []
+        self.label_table = {}
+        self.neg0 = 0
+        self.lines = []             # source line of each line of expanded text
+        self.token_lines = []       # source line of each token group
+        self.source_map = []        # source line of each word of the image, 0 if none
+        self.exports = []           # names from .export lines
+        self.imports = set()        # names from .import lines
+        self.relocations = None     # relocatable:  (word address, address it was given) for every label, ? and @
+        self.references = []        # relocatable:  (word address, imported name, indirect)
 
-    def parse(self,string):
+
+    def parse(self, string, compact=False, relocatable=False):
+        #   compact=True returns a CompactMemory instead of a list.  relocatable=True also
+        #   records which words hold addresses and leaves imported names as 0 for oisc3_link.
+        self.tokens = []
+        self.label_table = {}
+        self.lines = []
+        self.exports = []
+        self.imports = set()
+        self.relocations = [] if relocatable else None
+        self.references = []
         string = self.expand_literals(string)
-        string = string.replace('\n',';')
-        string = string.replace('#',';#')
-        string = string.replace(':',': ')
-        string = string.replace('%','% ')
-        string = string.replace('!', "0 ")
-        string = string.replace('@', '@ ')
-        string = string.replace('?', '? ')
-        string = string.replace(',', ' ')
+        string = string.translate(self.spacing)
         self.strip_tokens(string)
         self.parse_labels()
         self.handle_macros()
         self.expand_instructions()
         self.update_labels()
-        self.tokens = [token for token in sum(self.tokens, []) if token != '%']
+        self.source_map = [line for group, line in zip(self.tokens, self.token_lines) for token in group if token != '%']
+        self.tokens = [token for group in self.tokens for token in group if token != '%']
         self.neg0 = self.label_table["--NEGATIVE--"]
         self.resolve_negatives()
-        self.resolve_labels();
+        self.resolve_labels()
+
+        if compact:
+            return(CompactMemory(map(self.word, self.tokens), self.neg0), self.neg0)
+        return([self.word(token) for token in self.tokens], self.neg0)
+
 
+    def word(self, token):
         try:
-            response = []
-            for token in self.tokens:
-                if '.' in str(token):
-                    response.append(float(token))
-                else:
-                    response.append(int(token))
-            return(response, self.neg0)
+            if '.' in str(token):
+                return(float(token))
+            return(int(token))
         except ValueError:
             print("Unmatched label:", token, flush=True)
             raise
 
 
     def strip_tokens(self, string):
-        self.tokens = [token.split() for token in string.split(';') if not '#' in token and token.strip()]
-        if 'ZERO:' not in sum(self.tokens, start=[]):
+        self.tokens = []
+        self.token_lines = []
+        for line, text in zip(self.lines, string.split('\n')):
+            for token in text.split(';'):
+                if not '#' in token and token.strip():
+                    token = token.split()
+                    if token[0] == '.export':
+                        self.exports.extend(token[1:])
+                    elif token[0] == '.import':
+                        self.imports.update(token[1:])
+                    else:
+                        self.tokens.append(token)
+                        self.token_lines.append(line)
+        if not any('ZERO:' in token for token in self.tokens):
             self.tokens.append(['ZERO:', '0'])
+            self.token_lines.append(0)
+        words = set(word.lstrip('*') for token in self.tokens for word in token)
+        for name, op in OP_NAMES.items():
+            if name in words and name + ':' not in words:
+                self.tokens.append([name + ':', str(op)])
+                self.token_lines.append(0)
 
 
     def macro_fail(self, instr, token):
@@ -143,28 +196,32 @@ class Parser:
 
     def resolve_negatives(self):
         negmem = False
-        maxtoken = len(self.tokens)
-        how_many = maxtoken - self.neg0
-        reversed_tokens = []
-        for i, label in enumerate(self.label_table):
-            value = self.label_table[label]
+        for label, value in self.label_table.items():
             if label == "--NEGATIVE--":
                 negmem = True
             elif negmem == True:
                 self.label_table[label] = self.neg0 - value
-        for i in range(how_many):
-            item = self.tokens.pop(-1)
-            reversed_tokens.append(item)
-        reversed_tokens.pop(-1)
-        self.tokens.extend(reversed_tokens)
+        for words in (self.tokens, self.source_map):
+            negative = words[self.neg0 + 1:]            # drop the --NEGATIVE-- marker itself
+            negative.reverse()
+            del words[self.neg0:]
+            words.extend(negative)
 
 
     def resolve_labels(self):
+        size = len(self.tokens)
+        relocations = self.relocations
         for i, token in enumerate(self.tokens):
             if token[0] == "*":                 # pointer
                 token = token[1:]
                 if token in self.label_table:
                     self.tokens[i] = float(self.label_table[token])
+                elif relocations is not None and token in self.imports:
+                    self.references.append((i if i < self.neg0 else i - size, token, True))
+                    self.tokens[i] = 0.0
+                    continue
+                else:
+                    continue
             else:
                 if token in self.label_table:
                     self.tokens[i] = self.label_table[token]
@@ -172,29 +229,37 @@ class Parser:
                     if i < self.neg0:
                         self.tokens[i] = i+1
                     else:
-                        self.tokens[i] = i - len(self.tokens) - 1
+                        self.tokens[i] = i - size - 1
                 elif token == '@':
                     if i < self.neg0:
                         self.tokens[i] = i
                     else:
-                        self.tokens[i] = i - len(self.tokens)
+                        self.tokens[i] = i - size
+                elif relocations is not None and token in self.imports:
+                    self.references.append((i if i < self.neg0 else i - size, token, False))
+                    self.tokens[i] = 0
+                    continue
+                else:
+                    continue
+            if relocations is not None:
+                relocations.append((i if i < self.neg0 else i - size, int(self.tokens[i])))
 
 
     def update_labels(self):
-        for i, label in enumerate(self.label_table):
-            self.label_table[label] = self.get_label_index(label)
-
-
-    def get_label_index(self,label):
+        #   Labels are held as (token group, operand) until now.  One running count gives the
+        #   address each group starts at;  the '%' of a data group takes up no memory.
+        starts = []
         index = 0
-        address, x = self.label_table[label]
-        for i in range(address):
-            index += len(self.tokens[i])
-            if '%' in self.tokens[i][0]:
-                index -= 1 
-        if '%' in self.tokens[address][0]:
-            return index + x - 1
-        return index
+        for token in self.tokens:
+            starts.append(index)
+            index += len(token)
+            if '%' in token[0]:
+                index -= 1
+        for label, (address, x) in self.label_table.items():
+            if '%' in self.tokens[address][0]:
+                self.label_table[label] = starts[address] + x - 1
+            else:
+                self.label_table[label] = starts[address]
 
 
     def expand_instructions(self):
@@ -216,38 +281,67 @@ class Parser:
 
 
     def parse_labels(self):
-        #print(self.tokens)
-        for token_index, token in enumerate(self.tokens):
-            if len(token) == 1 and token[0][-1] == ':':                         # correcting for lone label
-                token.extend(self.tokens[token_index+1])
-                self.tokens.pop(token_index+1)
-            for operand_index, operand in enumerate(token):
-                if operand[-1] == ':':                                         # ':' in operand:
+        groups = []
+        lines = []
+        pending = None
+        for token, line in zip(self.tokens, self.token_lines):
+            if pending is not None:                                             # correcting for lone label
+                pending.extend(token)
+                token = pending
+                pending = None
+            elif len(token) == 1 and token[0][-1] == ':':
+                pending = token
+                continue
+            token_index = len(groups)
+            operand_index = 0
+            while operand_index < len(token):
+                operand = token[operand_index]
+                if operand[-1] == ':':                                          # ':' in operand
                     token.remove(operand)
-                    operand = operand[:-1]
-                    self.label_table[operand] = (token_index, operand_index)
-
+                    self.label_table[operand[:-1]] = (token_index, operand_index)
+                operand_index += 1
+            groups.append(token)
+            lines.append(line)
+        if pending is not None:
+            print("Label", pending[0], "has nothing after it", flush=True)
+            raise ValueError
+        self.tokens = groups
+        self.token_lines = lines
 
 
-    def expand_literals(self,string):
+    def expand_literals(self, string):
+        #   Strings become space separated character codes and comments are dropped.
+        #   Only the quote, comment and end of line characters need looking at one by one;
+        #   the text between them is copied (or encoded) a run at a time.
         in_dq_literal = False       # "
         in_sq_literal = False       # '
         in_comment  = False
-        expanded_string = ""
-        for char in string:
-            if char == "#" and not in_sq_literal and not in_dq_literal:
-                in_comment = True
-            if in_comment:
-                if ord(char) == 10 or ord(char) == 13:
-                    in_comment = False
-                else:
-                    char = ""
-            if char == '"' and not in_sq_literal:
+        expanded = []
+        line = 1
+        self.lines = [line]
+        for piece in self.specials.split(string):
+            if piece == "":
+                continue
+            if piece == "\n" or piece == "\r":
+                if piece == "\n":
+                    line += 1
+                if in_dq_literal or in_sq_literal:
+                    expanded.append(str(ord(piece)) + ' ')
+                    continue
+                in_comment = False
+                expanded.append(piece)
+                if piece == "\n":
+                    self.lines.append(line)
+            elif in_comment:
+                continue
+            elif piece == '"' and not in_sq_literal:
                 in_dq_literal ^= True
-            elif char == "'" and not in_dq_literal:
+            elif piece == "'" and not in_dq_literal:
                 in_sq_literal ^= True
             elif in_dq_literal or in_sq_literal:
-                expanded_string += str(ord(char)) + ' '
+                expanded.append(''.join([str(ord(char)) + ' ' for char in piece]))
+            elif piece == "#":
+                in_comment = True
             else:
-                expanded_string += char
-        return expanded_string
+                expanded.append(piece)
+        return ''.join(expanded)
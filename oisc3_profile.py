@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# OISC:3 profiler
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   The profiler drives the VM one instruction at a time and counts executions per address,
+#   per instruction kind and per coprocessor op.  A taken call opens a frame for the routine
+#   it lands on and the matching return closes it, giving calls, inclusive instructions and
+#   inclusive time per subroutine.  The VM's own loop never looks at the profiler, so a run
+#   without one costs exactly what it did before.  Run in slices (vm.run(n), vm.step()), a
+#   routine still open when a slice ends stays open for the next, and the time between
+#   slices isn't counted;  frames are only closed early when the program halts or faults.
+
+
+import time
+from bisect import bisect_right
+
+
+KINDS = ["sub", "lit-", "call", "push", "jump", "pop", "exec", "ret"]
+
+
+def locator(labels):
+    #   -> where(address), naming a code address as label or label+offset from Parser.label_table
+    code = sorted((address, label) for label, address in (labels or {}).items()
+                  if type(address) is int and address >= 0 and label != "--NEGATIVE--")
+    starts = [address for address, label in code]
+
+    def where(address):
+        i = bisect_right(starts, address) - 1
+        if i < 0:
+            return "@{}".format(address)
+        start, label = code[i]
+        if start == address:
+            return label
+        return "{}+{}".format(label, address - start)
+
+    return where
+
+
+def line_finder(source_map):
+    #   -> line_of(address), the source line a word came from, 0 if unknown
+    def line_of(address):
+        if source_map and 0 <= address < len(source_map) and source_map[address]:
+            return source_map[address]
+        return 0
+
+    return line_of
+
+
+class Profiler:
+
+    def __init__(self):
+        self.counts = {}            # address -> executions
+        self.kinds = [0] * 8
+        self.ops = {}               # coprocessor op -> executions
+        self.routines = {}          # entry address -> [calls, instructions, seconds]
+        self.frames = []            # (entry address, start instruction, start time)
+        self.active = {}            # entry address -> frames open, so recursion isn't counted twice
+        self.total = 0
+        self.seconds = 0.0
+        self.paused = None          # when the last slice ended, with frames still open
+
+
+    def run(self, vm, budget=-1):
+        clock = time.perf_counter
+        started = clock()
+        first = self.total
+        if self.paused is not None:     # frames carried over from the last slice
+            gap = started - self.paused
+            self.frames = [(entry, start, since + gap) for entry, start, since in self.frames]
+            self.paused = None
+        ended = True
+        try:
+            while vm.running and budget != 0:
+                budget -= 1
+                pointer = vm.pointer
+                instr = vm.decoded.get(pointer)
+                if instr is None or instr[0] == 8:      # not a recognised idiom, the plain instruction
+                    instr = vm.decode(pointer)
+                kind = instr[0]
+                if kind == 6:
+                    c_ref = instr[6]
+                    if instr[7]:
+                        c_ref = vm.indirect(c_ref)
+                    op = vm.memory[c_ref]
+                depth = len(vm.returnstack)
+                if not vm.execute(1):       # waiting for input
+                    break
+                self.counts[pointer] = self.counts.get(pointer, 0) + 1
+                self.kinds[kind] += 1
+                if kind == 6:
+                    self.ops[op] = self.ops.get(op, 0) + 1
+                self.total += 1
+                if kind == 2 and len(vm.returnstack) > depth:
+                    self.enter(vm.pointer, clock())
+                elif kind == 7 and len(vm.returnstack) < depth and self.frames:
+                    self.leave(clock())
+            ended = not vm.running
+        finally:
+            now = clock()
+            if ended:
+                while self.frames:      # halted or faulted inside a routine
+                    self.leave(now)
+            elif self.frames:
+                self.paused = now
+            self.seconds += now - started
+        return(self.total - first)
+
+
+    def enter(self, entry, now):
+        self.frames.append((entry, self.total, now))
+        self.active[entry] = self.active.get(entry, 0) + 1
+        routine = self.routines.setdefault(entry, [0, 0, 0.0])
+        routine[0] += 1
+
+
+    def leave(self, now):
+        entry, start, started = self.frames.pop(-1)
+        self.active[entry] -= 1
+        if self.active[entry] == 0:     # outermost frame of this routine
+            routine = self.routines[entry]
+            routine[1] += self.total - start
+            routine[2] += now - started
+
+
+    def report(self, labels=None, source_map=None, source=None, top=20):
+        #   labels:      Parser.label_table
+        #   source_map:  Parser.source_map, the source line of each word
+        #   source:      the source text, to quote the hot lines
+        where = locator(labels)
+        line_of = line_finder(source_map)
+        lines = source.split("\n") if source else []
+        out = []
+        total = max(self.total, 1)
+        out.append("Profile:  {} instructions in {:.3f} s".format(self.total, self.seconds))
+        out.append("")
+        out.append("  kind    count        %")
+        for kind, count in enumerate(self.kinds):
+            if count:
+                out.append("  {:<6}{:>9} {:>8.2f}".format(KINDS[kind], count, 100.0 * count / total))
+        if self.ops:
+            out.append("")
+            out.append("  op      count        %")
+            for op, count in sorted(self.ops.items(), key=lambda item: -item[1]):
+                out.append("  {:<6}{:>9} {:>8.2f}".format(op, count, 100.0 * count / total))
+        out.append("")
+        out.append("  address    count        %  where                 line  source")
+        hot = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:top]
+        for address, count in hot:
+            line = line_of(address)
+            text = lines[line - 1].strip() if 0 < line <= len(lines) else ""
+            out.append("  {:>7}{:>9} {:>8.2f}  {:<20}{:>6}  {}".format(address, count, 100.0 * count / total,
+                                                                       where(address), line or "", text))
+        if self.routines:
+            out.append("")
+            out.append("  subroutine            calls  instructions        %   seconds")
+            routines = sorted(self.routines.items(), key=lambda item: -item[1][1])
+            for entry, (calls, instructions, seconds) in routines:
+                out.append("  {:<20}{:>7}{:>14} {:>8.2f}{:>10.4f}".format(where(entry), calls, instructions,
+                                                                         100.0 * instructions / total, seconds))
+        return "\n".join(out)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# OISC:3 VM snapshots
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   A snapshot is the whole state of a paused VM, so a long setup can be run once and then
+#   picked up again as often as needed.  .o3s layout, little endian:
+#
+#   header      magic "O3S\0", version (H), reserved (H), state bytes (q)
+#   state       JSON:  pointer, running, status, executed, neg0, neg_max, data stack and its
+#               limit, return stack, and the input not yet read;  padded with spaces to 8 bytes
+#   image       memory and labels as a complete .o3i image (see oisc3_image)
+#
+#   Output isn't part of the state;  it's flushed before saving.
+
+
+import json
+import struct
+from oisc3_vm import Oisc3VM
+from oisc3_io import TerminalInput, StreamInput, QueueInput
+from oisc3_image import write_image, load_image
+from oisc3_memory import PagedMemory
+from oisc3_stack import DataStack
+
+
+MAGIC = b"O3S\0"
+VERSION = 1
+HEADER = struct.Struct("<4sHHq")
+
+
+def save_snapshot(o3s_file, vm):
+    vm.output.flush()
+    state = {
+        "pointer": vm.pointer,
+        "running": vm.running,
+        "status": vm.status,
+        "executed": vm.executed,
+        "neg0": vm.neg0,
+        "neg_max": vm.neg_max,
+        "stack": list(vm.stack),
+        "max_depth": vm.max_depth,
+        "returnstack": list(vm.returnstack),
+        "input": {"kind": type(vm.input).__name__,
+                  "pending": vm.input.pending() if hasattr(vm.input, "pending") else "",
+                  "closed": getattr(vm.input, "closed", False),
+                  "echo": vm.input.echo},
+    }
+    text = json.dumps(state).encode()
+    text += b" " * (-len(text) % 8)         # keeps the image's value array aligned
+    o3s_file.write(HEADER.pack(MAGIC, VERSION, 0, len(text)))
+    o3s_file.write(text)
+    write_image(o3s_file, vm.memory, vm.neg0, vm.labels)
+
+
+def load_snapshot(o3s_name, input=None, output=None, compact=False):
+    #   -> an Oisc3VM ready to run() from where the snapshot was taken.  Memory comes back
+    #   paged, so forks of it share pages;  compact=True keeps the mapped typed image instead.
+    #   input:  None restores the saved input, with whatever it hadn't read yet.
+    with open(o3s_name, "rb") as o3s_file:
+        header = o3s_file.read(HEADER.size)
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            print(o3s_name, "is not an OISC:3 snapshot", flush=True)
+            raise ValueError
+        magic, version, reserved, state_len = HEADER.unpack(header)
+        if version != VERSION:
+            print(o3s_name, "is snapshot version", version, "but I only know version", VERSION, flush=True)
+            raise ValueError
+        state = json.loads(o3s_file.read(state_len).decode())
+    mem, neg0, labels = load_image(o3s_name, HEADER.size + state_len)
+    if not compact:
+        mem = PagedMemory(mem.tolist(), neg0)
+    if input is None:
+        saved = state["input"]
+        if saved["kind"] == "QueueInput":
+            input = QueueInput(saved["pending"])
+            input.closed = saved["closed"]
+        elif saved["kind"] == "StreamInput":
+            input = StreamInput(saved["pending"], saved["echo"])
+        else:
+            input = TerminalInput()
+    vm = Oisc3VM(input, output, state.get("max_depth"))
+    vm.load(mem, neg0)
+    vm.labels = labels
+    vm.neg_max = state["neg_max"]
+    vm.stack = DataStack(state["stack"], vm.max_depth)
+    vm.returnstack = state["returnstack"]
+    vm.pointer = state["pointer"]
+    vm.running = state["running"]
+    vm.status = state["status"]
+    vm.executed = state["executed"]
+    return(vm)
+
+
+def is_snapshot(name):
+    try:
+        with open(name, "rb") as o3s_file:
+            return o3s_file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
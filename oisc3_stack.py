@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# OISC:3 data stack
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   The data stack is a deque with a direction flag.  Normally the top is the right end;
+#   reverse() only flips the flag, after which the top is the left end.  append and pop are
+#   the deque's own methods for whichever end is the top, bound on the instance, so a push
+#   or pop costs what it does on a list.  Roll left and right are a one place rotate, and
+#   depth and pick near either end don't depend on how deep the stack is.
+#
+#   Indexing, iteration and list() go from the bottom up, as they would on a list.  pop()
+#   only takes from the top.
+#
+#   limit:  None, or the most items the stack may hold;  one more push is a fault.
+
+
+from collections import deque
+
+
+class DataStack:
+
+    def __init__(self, items=(), limit=None):
+        self.items = deque(items)
+        self.flipped = False        # True when the top is the left end
+        self.limit = limit
+        if limit is not None and len(self.items) > limit:
+            self.overflow()
+        self.bind()
+
+
+    def bind(self):
+        if self.flipped:
+            self.push = self.items.appendleft
+            self.pop = self.items.popleft
+        else:
+            self.push = self.items.append
+            self.pop = self.items.pop
+        if self.limit is None:
+            self.append = self.push
+        else:
+            self.append = self.checked
+
+
+    def checked(self, a):           #   append, when there's a limit
+        if len(self.items) >= self.limit:
+            self.overflow()
+        self.push(a)
+
+
+    def overflow(self):
+        print("\nData stack overflow:  more than", self.limit, "items", flush=True)
+        raise ValueError
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    def __getitem__(self, i):
+        if self.flipped:
+            return self.items[-1 - i]
+        return self.items[i]
+
+
+    def __iter__(self):
+        if self.flipped:
+            return reversed(self.items)
+        return iter(self.items)
+
+
+    def __eq__(self, other):        #   against another stack or a list, bottom up
+        if isinstance(other, (DataStack, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+
+    def __repr__(self):
+        return "DataStack({})".format(list(self))
+
+
+    def copy(self):
+        return DataStack(self, self.limit)
+
+
+    def clear(self):
+        self.items.clear()
+
+
+    def reverse(self):              #   A B C D - D C B A
+        self.flipped = not self.flipped
+        self.bind()
+
+
+    def roll_left(self):            #   A B C D - D A B C
+        if not self.items:
+            raise IndexError("pop from empty stack")
+        self.items.rotate(-1 if self.flipped else 1)
+
+
+    def roll_right(self):           #   A B C D - B C D A
+        if not self.items:
+            raise IndexError("pop from empty stack")
+        self.items.rotate(1 if self.flipped else -1)
+
+
+    def swap(self):                 #   A B - B A
+        if len(self.items) < 2:
+            raise IndexError("pop index out of range")
+        b = self.pop()
+        a = self.pop()
+        self.push(b)
+        self.push(a)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# OISC:3 execution trace
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Tracer drives the VM one instruction at a time, like the Profiler, and keeps the last
+#   size instructions in a ring of preallocated arrays, so a long run costs no more memory
+#   at the end than at the start.  Each record is
+#
+#   ints        address, kind, A, B, C (the addresses used, after any indirection), stack depth
+#   values      first value read, second value read, value written    (None where there is none)
+#
+#   The values read are [A] and [B] for sub, the literal and [B] for lit-, [A] for call and
+#   push, [B] for jump, and the op number [C] for exec;  the value written is read back from
+#   memory after sub, lit- and pop.  A faulting instruction is the newest record, with nothing
+#   written.  Values are kept as TypedRegion keeps memory (oisc3_memory):  an int64 and a flag
+#   byte each, with anything that isn't a 64 bit int or a whole float boxed aside, so a value
+#   comes back exactly as it was, int or float.
+#
+#   The ring can be saved on a fault, on halt, or whenever asked, as an .o3t file:
+#
+#   header      magic "O3T\0", version (H), reserved (H), size (q), recorded (q), next (q), boxed bytes (q)
+#   ints        size * 6 int64
+#   values      size * 3 int64
+#   flags       size * 3 bytes      INDIRECT and BOXED as in oisc3_memory, EMPTY for no value
+#   boxed       text lines "index value" for the boxed values
+#
+#   usage:  python oisc3_trace.py trace.o3t [program.o3a | program.o3i] [--last=N]
+#   prints the records oldest first, named by the program's labels and source lines.
+
+
+import struct
+import sys
+from array import array
+from oisc3_memory import encode, INDIRECT, BOXED
+from oisc3_profile import KINDS, locator, line_finder
+from oisc3_parser import Parser
+from oisc3_image import load_image, is_image
+
+
+MAGIC = b"O3T\0"
+VERSION = 2
+HEADER = struct.Struct("<4sHHqqqq")
+INTS = 6
+VALUES = 3
+EMPTY = 4                       # flag:  no value
+
+
+class Tracer:
+
+    def __init__(self, size=4096, dump=None, on=("fault",)):
+        #   dump:  file name the ring is saved to when one of the events in on happens
+        #   on:    any of "fault" and "halt"
+        self.size = size
+        self.ints = array("q", bytes(8 * INTS * size))
+        self.values = array("q", bytes(8 * VALUES * size))
+        self.flags = bytearray([EMPTY]) * (VALUES * size)
+        self.boxed = {}             # value index -> a value that doesn't fit values
+        self.next = 0               # slot the next record goes in
+        self.recorded = 0           # records ever made;  the ring holds the last size of them
+        self.dump = dump
+        self.on = on
+
+
+    def put(self, k, value):        #   value k of the ring, None for none
+        if self.flags[k] & BOXED:
+            del self.boxed[k]
+        if value is None:
+            self.values[k] = 0
+            self.flags[k] = EMPTY
+            return
+        a, f = encode(value)
+        self.values[k] = a
+        self.flags[k] = f
+        if f & BOXED:
+            self.boxed[k] = value
+
+
+    def run(self, vm, budget=-1):
+        ints = self.ints
+        put = self.put
+        size = self.size
+        decoded = vm.decoded
+        execute = vm.execute
+        start = budget
+        try:
+            while vm.running and budget != 0:
+                pointer = vm.pointer
+                memory = vm.memory
+                instr = decoded.get(pointer)
+                if instr is None:
+                    instr = vm.decode(pointer)
+                elif instr[0] == 8:         # a recognised idiom;  execute(1) runs its first instruction plainly
+                    instr = instr[2]
+                kind, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = instr
+                neg0 = vm.neg0
+                neg_max = vm.neg_max
+                if a_ind:
+                    a_ref = memory[a_ref]
+                if b_ind:
+                    b_ref = memory[b_ref]
+                if c_ind:
+                    c_ref = memory[c_ref]
+                slot = self.next
+                i = slot * INTS
+                v = slot * VALUES
+                first = second = None
+                try:                        # anything odd is left for execute to report
+                    if not (a_ref > neg0 or a_ref < neg_max or b_ref > neg0 or b_ref < neg_max
+                            or c_ref > neg0 or c_ref < neg_max):
+                        if kind == 0:
+                            first = memory[a_ref]
+                            second = memory[b_ref]
+                        elif kind == 1:
+                            first = a
+                            second = memory[b_ref]
+                        elif kind == 2 or kind == 3:
+                            first = memory[a_ref]
+                        elif kind == 4:
+                            first = memory[b_ref]
+                        elif kind == 6:
+                            first = memory[c_ref]
+                    ints[i] = pointer
+                    ints[i + 1] = kind
+                    ints[i + 2] = int(a_ref)
+                    ints[i + 3] = int(b_ref)
+                    ints[i + 4] = int(c_ref)
+                    ints[i + 5] = len(vm.stack.items)
+                except Exception:           # an address that isn't a word;  keep what's sure
+                    ints[i:i + INTS] = array("q", (pointer, kind, 0, 0, 0, len(vm.stack.items)))
+                    first = second = None
+                put(v, first)
+                put(v + 1, second)
+                put(v + 2, None)
+                self.next = slot + 1 if slot + 1 < size else 0
+                self.recorded += 1
+                if not execute(1):       # waiting for input;  it runs again next time
+                    self.next = slot
+                    self.recorded -= 1
+                    break
+                budget -= 1
+                if kind == 0 or kind == 1 or kind == 5:     # read back what sub, lit- and pop wrote
+                    put(v + 2, vm.memory[c_ref if kind == 0 else b_ref])
+        except Exception:
+            if self.dump is not None and "fault" in self.on:
+                self.save_to(self.dump)
+            raise
+        if not vm.running and self.dump is not None and "halt" in self.on:
+            self.save_to(self.dump)
+        return(start - budget)
+
+
+    def save(self, o3t_file):
+        boxed = "".join("{} {!r}\n".format(k, value) for k, value in sorted(self.boxed.items())).encode()
+        o3t_file.write(HEADER.pack(MAGIC, VERSION, 0, self.size, self.recorded, self.next, len(boxed)))
+        ints = self.ints
+        values = self.values
+        if sys.byteorder != "little":
+            ints = array("q", ints)
+            ints.byteswap()
+            values = array("q", values)
+            values.byteswap()
+        o3t_file.write(ints.tobytes())
+        o3t_file.write(values.tobytes())
+        o3t_file.write(self.flags)
+        o3t_file.write(boxed)
+
+
+    def save_to(self, name):
+        with open(name, "wb") as o3t_file:
+            self.save(o3t_file)
+
+
+    def records(self):              #   -> [(address, kind, a, b, c, depth, first, second, written)] oldest first
+        return(ordered(self.ints, self.values, self.flags, self.boxed, self.size, self.recorded, self.next))
+
+
+def value(values, flags, boxed, k):
+    f = flags[k]
+    if not f:
+        return values[k]
+    if f & EMPTY:
+        return None
+    if f & BOXED:
+        return boxed[k]
+    return float(values[k])
+
+
+def ordered(ints, values, flags, boxed, size, recorded, next):
+    if recorded < size:
+        slots = range(recorded)
+    else:
+        slots = list(range(next, size)) + list(range(next))
+    return([tuple(ints[s * INTS:(s + 1) * INTS])
+            + tuple(value(values, flags, boxed, k) for k in range(s * VALUES, (s + 1) * VALUES)) for s in slots])
+
+
+def load_trace(o3t_name):          #   -> (records oldest first, records ever made)
+    with open(o3t_name, "rb") as o3t_file:
+        header = o3t_file.read(HEADER.size)
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            print(o3t_name, "is not an OISC:3 trace", flush=True)
+            raise ValueError
+        magic, version, reserved, size, recorded, next, boxed_len = HEADER.unpack(header)
+        if version != VERSION:
+            print(o3t_name, "is trace version", version, "but I only know version", VERSION, flush=True)
+            raise ValueError
+        ints = array("q")
+        ints.frombytes(o3t_file.read(8 * INTS * size))
+        values = array("q")
+        values.frombytes(o3t_file.read(8 * VALUES * size))
+        flags = o3t_file.read(VALUES * size)
+        boxed = {}
+        for line in o3t_file.read(boxed_len).decode().splitlines():
+            k, text = line.split(" ", 1)
+            boxed[int(k)] = float(text) if '.' in text or 'e' in text or 'n' in text else int(text)
+    if sys.byteorder != "little":
+        ints.byteswap()
+        values.byteswap()
+    return(ordered(ints, values, flags, boxed, size, recorded, next), recorded)
+
+
+def format_trace(records, recorded=None, labels=None, source_map=None, source=None):
+    where = locator(labels)
+    line_of = line_finder(source_map)
+    lines = source.split("\n") if source else []
+
+    def show(x):
+        if x is None:
+            return ""
+        return repr(x)
+
+    recorded = len(records) if recorded is None else recorded
+    out = ["Trace:  the last {} of {} instructions".format(len(records), recorded), "",
+           "        #  address  where               kind       A       B       C  depth  read                written   line  source"]
+    number = recorded - len(records)
+    for address, kind, a, b, c, depth, first, second, written in records:
+        number += 1
+        line = line_of(address)
+        text = lines[line - 1].strip() if 0 < line <= len(lines) else ""
+        read = " ".join(show(x) for x in (first, second) if x is not None)
+        out.append("  {:>7}{:>9}  {:<20}{:<5}{:>8}{:>8}{:>8}{:>7}  {:<20}{:<10}{:>5}  {}".format(
+            number, address, where(address), KINDS[kind] if 0 <= kind < len(KINDS) else kind,
+            a, b, c, depth, read, show(written), line or "", text))
+    return("\n".join(out))
+
+
+def main(args):
+    options = dict(arg[2:].split("=", 1) if "=" in arg else (arg[2:], True) for arg in args if arg.startswith("--"))
+    paths = [arg for arg in args if not arg.startswith("--")]
+    if not paths:
+        print("\nusage: python oisc3_trace.py trace.o3t [program.o3a | program.o3i] [--last=N]\n")
+        return 2
+    records, recorded = load_trace(paths[0])
+    if "last" in options:
+        records = records[-int(options["last"]):]
+    labels = source_map = source = None
+    if len(paths) > 1:
+        if is_image(paths[1]):
+            mem, neg0, labels = load_image(paths[1])
+        else:
+            with open(paths[1], "r") as o3a_file:
+                source = o3a_file.read()
+            parser = Parser()
+            parser.parse(source)
+            labels = parser.label_table
+            source_map = parser.source_map
+    print(format_trace(records, recorded, labels, source_map, source))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
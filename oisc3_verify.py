@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# OISC:3 load-time verifier
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   verify() walks the control-flow graph of a loaded VM from address 0, following jump and
+#   call targets, and checks every instruction control can reach before anything runs:
+#
+#   - each direct operand is inside the bounds, so it can never fault while the bounds don't shrink
+#   - the instruction lies wholly inside positive memory
+#   - which words any reachable instruction can write, so code that is never written is known
+#
+#   A jump whose test word is never written always goes the same way, so /jump -1 and
+#   /jump Loop (which test ZERO) have no fall through.  That needs the written words, which
+#   depend on what is reachable, so the two are worked out together until they settle.
+#   Free zeroes what it gives back, so where code may free memory a test word above zero
+#   could still be taken one day, and only tests that are always taken are followed alone.
+#   An indirect write through a pointer cell that is never written has a known target;  any
+#   other indirect write, or an exec that may run an op marked writes (copy, fill), could
+#   land anywhere.  An indirect call or jump leaves the graph incomplete.
+#
+#   A program that passes with a complete graph and no instruction ever written is verified.
+#   Its decoded instructions are then kept across alloc and free for as long as the bounds
+#   still cover everything it addresses directly (Oisc3VM.span), instead of being decoded
+#   and checked again after every move.  Indirect references are checked on every use as
+#   always, and anything else falls back on the usual checks.
+
+
+from oisc3_profile import locator, line_finder
+from oisc3_vm import coprocessor
+
+
+class Verification:
+
+    def __init__(self):
+        self.reachable = set()      # instruction addresses control can reach
+        self.written = set()        # words a reachable instruction may write;  None for any word at all
+        self.complete = True        # False once a call or jump goes through a pointer
+        self.failures = []          # (address, message) for instructions that would fault
+        self.span = None            # (lowest, highest) word addressed directly, code included
+
+
+    def verified(self):
+        if not self.complete or self.failures or self.written is None:
+            return(False)
+        return(not any(p + i in self.written for p in self.reachable for i in range(3)))
+
+
+    def apply(self, vm):            #   let the VM keep its decoded code;  -> verified()
+        if not self.verified():
+            vm.span = None
+            return(False)
+        vm.span = self.span
+        for p in sorted(self.reachable):
+            if p not in vm.decoded:
+                vm.decoded[p] = vm.fetch(p)
+        return(True)
+
+
+    def report(self, labels=None, source_map=None, source=None):
+        where = locator(labels)
+        line_of = line_finder(source_map)
+        lines = source.split("\n") if source else []
+        out = []
+        for address, message in self.failures:
+            line = line_of(address)
+            text = lines[line - 1].strip() if 0 < line <= len(lines) else ""
+            out.append("  {:<20}{:>6}  {}".format(where(address), "line {}".format(line) if line else "", message))
+            if text:
+                out.append("{:>30}{}".format("", text))
+        if self.failures:
+            out.insert(0, "Verification failed at {} instruction{}:".format(len(self.failures),
+                                                                          "" if len(self.failures) == 1 else "s"))
+        elif self.verified():
+            out.append("Verified {} instructions".format(len(self.reachable)))
+        elif not self.complete:
+            out.append("No faults found in {} instructions;  an indirect call or jump leaves the rest unchecked".format(len(self.reachable)))
+        else:
+            out.append("No faults found in {} instructions;  some code may be written while it runs".format(len(self.reachable)))
+        return("\n".join(out))
+
+
+def explore(vm, written, frees):
+    #   -> (reachable, complete, failures), reading the jump tests against written
+    memory = vm.memory
+    neg0 = vm.neg0
+    neg_max = vm.neg_max
+    reachable = set()
+    failures = []
+    complete = True
+    todo = [0]
+    while todo:
+        p = todo.pop()
+        if p < 0 or p in reachable:         # a negative target halts
+            continue
+        if p + 2 >= neg0:
+            failures.append((p, "Instruction runs past the end of positive memory at {}".format(neg0)))
+            continue
+        bad = [memory[i] for i in range(p, p + 3) if memory[i] != 0 and (memory[i] > neg0 or memory[i] < neg_max)]
+        if bad:
+            failures.append((p, "Direct memory location {} out of bounds".format(bad[0])))
+            continue
+        reachable.add(p)
+        instr_type, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = vm.decode(p)
+        if instr_type == 2 or instr_type == 4:
+            if c_ind:
+                complete = False
+            test_ref, test_ind = (a_ref, a_ind) if instr_type == 2 else (b_ref, b_ind)
+            taken = None                    # always, never, or None for either
+            if not test_ind and written is not None and test_ref not in written:
+                taken = memory[test_ref] <= 0
+                if frees and not taken:
+                    taken = None
+            if taken is not False and not c_ind:
+                todo.append(c_ref)
+            if instr_type == 2 or taken is not True:
+                todo.append(p + 3)          # a call comes back here
+        elif instr_type != 7:
+            todo.append(p + 3)
+    failures.sort()
+    return(reachable, complete, failures)
+
+
+def writes(vm, reachable, written):
+    #   -> the words the reachable instructions may write, or None if that could be any word
+    memory = vm.memory
+    targets = set()
+    for p in reachable:
+        instr_type, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = vm.decode(p)
+        if instr_type == 0:
+            ref, ind = c_ref, c_ind
+        elif instr_type == 1 or instr_type == 5:
+            ref, ind = b_ref, b_ind
+        elif instr_type == 6:
+            if c_ind or c_ref in written or getattr(vm.ops.get(memory[c_ref]), "writes", False):
+                return(None)
+            continue
+        else:
+            continue
+        if ind:
+            if written is None or ref in written:
+                return(None)
+            ref = memory[ref]               # a pointer cell that is never written always holds this
+        targets.add(ref)
+    return(targets)
+
+
+def may_free(vm, reachable, written):
+    #   could a reachable exec run free, or an op of the embedder's that might do anything?
+    memory = vm.memory
+    for p in reachable:
+        instr_type, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = vm.decode(p)
+        if instr_type == 6:
+            if c_ind or c_ref in written:
+                return(True)
+            op = vm.ops.get(memory[c_ref])
+            if op is coprocessor[-16] or (op is not None and op is not coprocessor.get(memory[c_ref])):
+                return(True)
+    return(False)
+
+
+def verify(vm):                     #   vm:  loaded and not yet run  -> Verification
+    result = Verification()
+    written = set()
+    frees = False
+    while True:
+        reachable, complete, failures = explore(vm, written, frees)
+        found = writes(vm, reachable, written)
+        if found is None:
+            written = None
+            reachable, complete, failures = explore(vm, written, True)
+            break
+        if found <= written:
+            if frees or not may_free(vm, reachable, written):
+                break
+            frees = True
+        written |= found
+    result.reachable = reachable
+    result.complete = complete
+    result.failures = failures
+    result.written = written
+    memory = vm.memory
+    low = 0
+    high = max(reachable) + 3 if reachable else 0
+    for p in reachable:
+        for i in range(p, p + 3):
+            if memory[i] != 0:
+                low = min(low, memory[i])
+                high = max(high, memory[i])
+    result.span = (low, high)
+    return(result)
@@ -5,286 +5,600 @@
 # See LICENSE for more details.
 
 
-try:
-    from getch import getch, getche         # Linux
-except ImportError:
-    from msvcrt import getch, getche        # Windows
-
+import asyncio
 import math
+import operator
+from oisc3_memory import PagedMemory, CompactMemory
+from oisc3_parser import Parser
+from oisc3_image import load_image, is_image
+from oisc3_io import BufferedOutput, TerminalInput, copy_input
+from oisc3_idioms import recognise
+from oisc3_stack import DataStack
+from oisc3_buffer import MemoryWindow
+
+
+#   Coprocessor instructions on stack elements.
+#   Each handler takes the VM and works on vm.stack, a DataStack;  the table maps op number -> handler.
+#   Handlers made by unary() and binary() carry their function, so oisc3_idioms can skip the stack.
+
+def unary(f):                   #   A - f(A)
+    def op(vm):
+        vm.stack.append(f(vm.stack.pop()))
+    op.function = f
+    op.arity = 1
+    return op
+
+def binary(f):                  #   A B - f(A, B)
+    def op(vm):
+        b = vm.stack.pop()
+        a = vm.stack.pop()
+        vm.stack.append(f(a, b))
+    op.function = f
+    op.arity = 2
+    return op
+
+class WaitingForInput(Exception):
+    #   raised by an input op before it touches anything, when the input has nothing yet;
+    #   the VM stops on the exec and runs it again once it's resumed
+    pass
+
+def op_nop(vm):                 #   NOP
+    pass
+
+def read_char(vm):              #   flush any prompt, then read one character ("" at end of input)
+    vm.output.flush()
+    a = vm.input.read_char()
+    if a is None:
+        raise WaitingForInput
+    if a and vm.input.echo:
+        vm.output.write(a)
+    return a
+
+def op_input_char(vm):          #   input char              - A     -1 at end of input
+    a = read_char(vm)
+    if a:
+        vm.stack.append(ord(a))
+    else:
+        vm.stack.append(-1)
+
+def op_print_char(vm):          #   print char              A -
+    a = vm.stack.pop()
+    if a >= 0:
+        vm.output.write(chr(int(a)))
+    else:
+        vm.output.flush()
+        print("\n\nCan't print a negative character!\n", flush=True)
+        raise ValueError
+
+op_print_char.prints = True     #   oisc3_idioms may send a whole string in one write
+
+def op_input_digit(vm):         #   input digit             - A     -1 at end of input
+    a = read_char(vm)
+    if a.isdigit():             # for longer numbers, use a.isnumeric()
+        vm.stack.append(int(a))
+    elif a:
+        vm.output.flush()
+        print("\nExpected a digit\n", flush=True)
+        vm.stack.append(-1)
+    else:
+        vm.stack.append(-1)
+
+def op_print_num(vm):           #   output number           A -
+    a = vm.stack.pop()
+    vm.output.write(str(a))
+
+def op_dup(vm):                 #   DUP     A - A A
+    vm.stack.append(vm.stack[-1])
+
+def op_drop(vm):                #   DROP    A -
+    vm.stack.pop()
+
+def op_over(vm):                #   OVER    A B - A B A
+    vm.stack.append(vm.stack[-2])
+
+def op_swap(vm):                #   SWAP    A B - B A
+    vm.stack.swap()
+
+def op_roll_left(vm):           #   Roll Left   A B C D - D A B C
+    vm.stack.roll_left()
+
+def op_roll_right(vm):          #   Roll Right  A B C D - B C D A
+    vm.stack.roll_right()
+
+def op_reverse(vm):             #   REVERSE     A B C D - D C B A
+    vm.stack.reverse()
+
+def op_clear(vm):               #   CLEAR       A B C -
+    vm.stack.clear()
+
+def op_depth(vm):               #   Depth             - A
+    vm.stack.append(len(vm.stack))
+
+def op_pick(vm):                #   PICK A          A - A
+    a = vm.stack.pop()
+    vm.stack.append(vm.stack[-a])
+
+def op_true(vm):                #   bitwise True    - A
+    vm.stack.append(-1)
+
+def op_false(vm):               #   bitwise False   - A
+    vm.stack.append(0)
+
+def op_int(vm):                 #   convert to int  A - A       adjusts a tiny bit to cover float rounding errors
+    a = vm.stack.pop()
+    if a > 0:
+        vm.stack.append(int(a + 0.0000001))
+    else:
+        vm.stack.append(int(a - 0.0000001))
+
+def op_alloc(vm):               #   alloc memory (positive or negative) A -
+    a = vm.stack.pop()
+    vm.memory.alloc(a)
+    if a > 0:
+        vm.neg0 += a
+    else:
+        vm.neg_max += a
+
+def op_free(vm):                #   free memory (positive or negative)   A -
+    a = vm.stack.pop()
+    vm.memory.free(a)
+    if a > 0:
+        vm.neg0 -= a
+    else:
+        vm.neg_max -= a
+
+
+#   Bulk memory ops work on N words starting at an address.  A positive N runs upward, a
+#   negative N runs downward, the way strings and tables are laid out in negative memory,
+#   and either may cross from one side of memory to the other.  The whole range is bounds
+#   checked before anything is touched, by the same rule as every operand.  Ops that write
+#   memory are marked so the block translator and the verifier know code may change under them.
+
+def block_range(vm, a, n):      #   -> range of abs(n) addresses from a, all in bounds
+    if type(a) is float:
+        a = int(a + 0.0000001) if a > 0 else int(a - 0.0000001)
+    if type(n) is float:
+        n = int(n + 0.0000001) if n > 0 else int(n - 0.0000001)
+    step = 1 if n >= 0 else -1
+    words = range(a, a + n, step)
+    if words and (min(a, a + n - step) < vm.neg_max or max(a, a + n - step) > vm.neg0):
+        vm.output.flush()
+        print("Memory block", a, "to", a + n - step, "out of bounds", flush=True)
+        raise IndexError
+    return words
+
+def wrote(vm, words):           #   tell the VM which positive words an op wrote
+    if words:
+        for w in range(max(min(words[0], words[-1]), 0), min(max(words[0], words[-1]) + 1, vm.neg0)):
+            vm.forget(w)
+
+def op_copy(vm):                #   copy N words        src dst N -     overlapping ranges are fine
+    n = vm.stack.pop()
+    dst = vm.stack.pop()
+    src = vm.stack.pop()
+    source = block_range(vm, src, n)
+    target = block_range(vm, dst, n)
+    memory = vm.memory
+    values = [memory[i] for i in source]
+    for i, value in zip(target, values):
+        memory[i] = value
+    wrote(vm, target)
+
+def op_fill(vm):                #   fill N words        addr N value -
+    value = vm.stack.pop()
+    n = vm.stack.pop()
+    target = block_range(vm, vm.stack.pop(), n)
+    memory = vm.memory
+    for i in target:
+        memory[i] = value
+    wrote(vm, target)
+
+def op_compare(vm):             #   compare N words     a b N - C       C is 0 if equal, else -1 or 1 at the first difference
+    n = vm.stack.pop()
+    b = vm.stack.pop()
+    a = vm.stack.pop()
+    memory = vm.memory
+    result = 0
+    for i, j in zip(block_range(vm, a, n), block_range(vm, b, n)):
+        x = memory[i]
+        y = memory[j]
+        if x != y:
+            result = -1 if x < y else 1
+            break
+    vm.stack.append(result)
+
+def op_sum(vm):                 #   sum N words         addr N - S
+    n = vm.stack.pop()
+    memory = vm.memory
+    vm.stack.append(sum(memory[i] for i in block_range(vm, vm.stack.pop(), n)))
+
+def op_find(vm):                #   find a value        addr N value - I    I is its offset from addr, or -1
+    value = vm.stack.pop()
+    n = vm.stack.pop()
+    memory = vm.memory
+    result = -1
+    for offset, i in enumerate(block_range(vm, vm.stack.pop(), n)):
+        if memory[i] == value:
+            result = offset
+            break
+    vm.stack.append(result)
+
+op_copy.writes = True
+op_fill.writes = True
+
+
+coprocessor = {
+    0:   op_nop,
+    1:   op_input_char,         -1:  op_print_char,
+    2:   op_input_digit,        -2:  op_print_num,
+    3:   op_dup,                -3:  op_drop,
+    4:   op_over,               -4:  op_swap,
+    5:   op_roll_left,          -5:  op_roll_right,
+    6:   op_reverse,            -6:  op_clear,
+    7:   op_depth,              -7:  op_pick,
+    8:   op_true,               -8:  op_false,
+    9:   binary(operator.and_), -9:  unary(operator.invert),
+    10:  binary(operator.or_),  -10: binary(operator.xor),
+    11:  binary(operator.lshift),   -11: binary(operator.rshift),
+    12:  binary(operator.mul),  -12: binary(operator.truediv),
+    13:  binary(operator.floordiv), -13: binary(operator.mod),
+    14:  unary(math.exp),       -14: unary(math.log),
+    15:  op_int,                -15: unary(float),
+    16:  op_alloc,              -16: op_free,
+    17:  binary(operator.add),  -17: binary(operator.sub),
+    18:  unary(math.sin),       -18: unary(math.asin),
+    19:  unary(math.cos),       -19: unary(math.acos),
+    20:  unary(math.tan),       -20: unary(math.atan),
+    21:  unary(math.sinh),      -21: unary(math.asinh),
+    22:  unary(math.cosh),      -22: unary(math.acosh),
+    23:  unary(math.tanh),      -23: unary(math.atanh),
+    24:  op_copy,               -24: op_fill,
+    25:  op_compare,            -25: op_sum,
+    26:  op_find,
+}
+
+
+#   What step() and run() return
+RUNNING = "running"             #   budget used up, more to do
+HALTED = "halted"
+WAITING = "waiting"             #   an input op found nothing to read;  feed the input and run again
+FAULT = "fault"                 #   the error is in vm.error
+
+SLICE = 10000                   #   instructions between yields in run_async
+
 
 class Oisc3VM:
-    stack = []
-    returnstack = []
-    memory = []
-    neg0 = 0
-    neg_max = 0
+    #   Everything a running program owns lives on the instance, so any number of VMs can
+    #   run side by side, in one thread or several.
 
-    def do_vm(self, passmem, passneg0):
-        try:
-            pointer = 0
-            running = True
-            input_buffer = []
+    def __init__(self, input=None, output=None, max_depth=None):
+        self.ops = dict(coprocessor)
+        self.input = input if input is not None else TerminalInput()
+        self.output = output if output is not None else BufferedOutput()
+        self.max_depth = max_depth  # most items on the data stack;  None for no limit
+        self.stack = DataStack(limit=max_depth)
+        self.returnstack = []
+        self.memory = PagedMemory()
+        self.neg0 = 0
+        self.neg_max = 0
+        self.labels = {}
+        self.pointer = 0
+        self.running = False
+        self.waiting = False
+        self.status = HALTED
+        self.error = None
+        self.executed = 0           # instructions run since load, up to a fault
+        self.ran = 0                # instructions run by the last execute(), even one that raised
+        self.engine = None          # anything with run(vm, budget), such as a BlockEngine;  None is execute()
+        #   Decoded instructions are cached by address.  Any write into positive memory
+        #   drops the (up to three) cached instructions that overlap the written word,
+        #   and alloc/free drops everything since the bounds have moved, unless the program
+        #   was verified (oisc3_verify) and the bounds still cover span.
+        self.decoded = {}
+        self.span = None            # (lowest, highest) word a verified program addresses directly
+        self.idioms = True          # recognise common sequences and run them natively, see oisc3_idioms
+        self.watch = {}             # word -> starts of the recognised sequences reading it
+        self.plain = set()          # addresses already found not to start one;  a miss is only slower
+        self.on_write = None        # called with each positive word forget() is told of, by a BlockEngine
+
+    def register_op(self, op, handler):     #   add or replace a coprocessor op;  handler(vm) works on vm.stack
+        if type(op) is not int:
+            print("Coprocessor op must be an integer, not", op, flush=True)
+            raise ValueError
+        self.ops[op] = handler
+
+    def window(self, start, n=None, labels=None, writable=True):
+        #   -> a MemoryWindow on n words from an address or label, see oisc3_buffer
+        return MemoryWindow(self, start, n, labels, writable)
+
+    def load(self, passmem, passneg0=None):
+        #   passmem:  an image list or memory object with its neg0, or the name of a
+        #   .o3i, .o3c or .o3a file, which brings its own
+        if type(passmem) is str:
+            if is_image(passmem):
+                passmem, passneg0, self.labels = load_image(passmem)
+            else:
+                with open(passmem, "r") as o3a_file:
+                    raw = o3a_file.read()
+                parser = Parser()
+                passmem, passneg0 = parser.parse(raw)
+                self.labels = parser.label_table
+        if isinstance(passmem, (PagedMemory, CompactMemory)):
             self.memory = passmem
-            self.neg0 = passneg0
-            if passneg0 > 0:
-                self.neg_max = passneg0 - (len(passmem) + 1)
-
-            def execute(i):         #   coprocessor instructions on stack elements
-                if i == 0:          #   NOP
-                    pass
-                elif i == 1:        #   input char
-                    a = getche()
-                    self.stack.append(ord(a))
-                elif i == -1:       #   print char
-                    a = self.stack.pop(-1)
-                    if a >= 0:
-                        print(chr(int(a)), end="", flush=True)
-                    else:
-                        print("\n\nCan't print a negative character!\n", flush=True)
-                        raise ValueError
-                elif i == 2:        #   input digit
-                    a = getche()
-                    if a.isdigit():             # for longer numbers, use a.isnumeric()
-                        self.stack.append(int(a))
-                    else:
-                        print("\nExpected a digit\n", flush=True)
-                        self.stack.append(-1)
-                elif i == -2:       #   output number
-                    a = self.stack.pop(-1)
-                    print(a, end="", flush=True)
-                elif i == 3:        #   DUP     A - A A
-                    self.stack.append(self.stack[-1])
-                elif i == -3:       #   DROP    A -
-                    a = self.stack.pop(-1)
-                elif i == 4:        #   OVER    A B - A B A
-                    a = self.stack[-2]
-                    self.stack.append(a)
-                elif i == -4:       #   SWAP    A B - B A
-                    a = self.stack.pop(-2)
-                    self.stack.append(a)
-                elif i == 5:        #   Roll Left   A B C D - D A B C
-                    a = self.stack.pop(-1)
-                    self.stack.insert(0, a)
-                elif i == -5:       #   Roll Right  A B C D - B C D A
-                    a = self.stack.pop(0)
-                    self.stack.append(a)
-                elif i == 6:        #   REVERSE     A B C D - D C B A
-                    self.stack.reverse()
-                elif i == -6:       #   CLEAR       A B C -
-                    self.stack = []
-                elif i == 7:        #   Depth             - A
-                    a = len(self.stack)
-                    self.stack.append(a)
-                elif i == -7:       #   PICK A          A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(self.stack[-a])
-                elif i == 8:        #   bitwise True    - A
-                    self.stack.append(-1)
-                elif i == -8:       #   bitwise False   - A
-                    self.stack.append(0)
-                elif i == 9:        #   bitwide AND     A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a & b)
-                elif i == -9:       #   bitwise NOT     A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(~a)
-                elif i == 10:       #   bitwise OR      A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a | b)
-                elif i == -10:      #   bitwise XOR     A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a ^ b)
-                elif i == 11:        #   Shift A left by B bits      A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a << b)
-                elif i == -11:      #   Shift A right by B bits     A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a >> b)
-                elif i == 12:      #   A * B           A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(b * a)
-                elif i == -12:      #   A / B           A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a / b)
-                elif i == 13:       #   A // B          A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a // b)
-                elif i == -13:      #   A % B           A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a % b)
-                elif i == 14:       #   e**A          A - A       natural anti-log
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.exp(a))
-                elif i == -14:      #   ln(A)           A - A      natural log
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.log(a))
-                elif i == 15:       #   convert to int  A - A       adjusts a tiny bit to cover float rounding errors
-                    a = self.stack.pop(-1)
-                    if a > 0:
-                        self.stack.append(int(a + 0.0000001))
-                    else:
-                        self.stack.append(int(a - 0.0000001))
-                elif i == -15:      #   convert to float    A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(float(a))
-                elif i == 16:       #   alloc memory (positive or negative) A -
-                    a = self.stack.pop(-1)
-                    blanks = [0] * abs(a)
-                    newmem = self.memory[:self.neg0] + blanks + self.memory[self.neg0:]
-                    if a > 0:
-                        self.neg0 += a
-                    else:
-                        self.neg_max += a
-                    self.memory = newmem
-                elif i == -16:       #   free memory (poitive or negative)   A -
-                    a = self.stack.pop(-1)
-                    if a > 0:
-                        self.neg0 -= a
-                        newmem = self.memory[:self.neg0] + self.memory[self.neg0:]
-                    else:
-                        newmem = self.memory[:self.neg0] + self.memory[(self.neg0 - a):]
-                        self.neg_max -= a
-                    self.memory = newmem
-                elif i == 17:       #   A + B           A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a + b)
-                elif i == -17:      #   A - B           A B - A
-                    b = self.stack.pop(-1)
-                    a = self.stack.pop(-1)
-                    self.stack.append(a - b)
-                elif i == 18:       #   sin(A)          A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.sin(a))
-                elif i == -18:      #   asin(A)         A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.asin(a))
-                elif i == 19:      #   cos(A)          A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.cos(a))
-                elif i == -19:      #   acos(A)         A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.acos(a))
-                elif i == 20:       #   tan(A)          A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.tan(a))
-                elif i == -20:      #   atan(A)         A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.atan(a))
-                elif i == 21:       #   sinh(A)         A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.sinh(a))
-                elif i == -21:      #   asinh(A)        A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.hsinh(a))
-                elif i == 22:       #   cosh(A)         A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.cosh(a))
-                elif i == -22:      #   acosh(A)        A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.acosh(a))
-                elif i == 23:       #   tanh(A)         A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.tanh(a))
-                elif i == -23:      #   atanh(A)        A - A
-                    a = self.stack.pop(-1)
-                    self.stack.append(math.atanh(a))
-
-
-                return
-
-
-            def isindirect(i):
-                return(type(i) is float)
-
-            def mem_eval(i):
-                if i > self.neg0 or i < self.neg_max:
-                    print("Direct memory location", i, "out of bounds", flush=True)
-                    raise IndexError
-                if isindirect(i):
-                    if i > 0:                   # adjust for float rounding errors
-                        a = int(i + 0.0000001)
-                    else:
-                        a = int(i - 0.0000001)
-                    mem_ref = self.memory[a]
-                    mem_val = self.memory[self.memory[a]]
-                    if mem_ref > self.neg0 or mem_ref < self.neg_max:
-                        print("Indirect memory location", mem_ref, "out of bounds", flush=True)
-                        raise IndexError
-                else:
-                    mem_ref = i
-                    mem_val = self.memory[i]
-                return(mem_ref, mem_val)
+        else:
+            self.memory = PagedMemory(passmem, passneg0)
+        self.neg0 = passneg0
+        if passneg0 > 0:
+            self.neg_max = passneg0 - (len(passmem) + 1)
+        else:
+            self.neg_max = 0
+        self.stack = DataStack(limit=self.max_depth)
+        self.returnstack = []
+        self.pointer = 0
+        self.running = True
+        self.waiting = False
+        self.status = RUNNING
+        self.error = None
+        self.executed = 0
+        self.decoded = {}
+        self.span = None
+        self.watch = {}
+        self.plain = set()
+
+    def fork(self, input=None, output=None):
+        #   -> a new VM in exactly this state.  Memory is shared copy-on-write (PagedMemory.fork),
+        #   the stacks and any input not yet read are copied, and output goes to the same
+        #   stream unless another is given.
+        self.output.flush()
+        if input is None:
+            input = copy_input(self.input)
+        if output is None and isinstance(self.output, BufferedOutput):
+            output = BufferedOutput(self.output.stream, self.output.policy)
+        child = Oisc3VM(input, output if output is not None else self.output, self.max_depth)
+        child.ops = dict(self.ops)
+        child.idioms = self.idioms
+        if self.engine is not None:
+            child.engine = type(self.engine)()
+        child.memory = self.memory.fork()
+        child.neg0 = self.neg0
+        child.neg_max = self.neg_max
+        child.labels = self.labels
+        child.stack = self.stack.copy()
+        child.returnstack = list(self.returnstack)
+        child.pointer = self.pointer
+        child.running = self.running
+        child.status = self.status
+        child.error = self.error
+        child.executed = self.executed
+        child.span = self.span
+        return(child)
+
+    def step(self, n=1):            #   run up to n instructions -> status
+        return(self.run(n))
+
+    def run(self, max_instructions=-1):
+        #   -> RUNNING, HALTED, WAITING or FAULT.  A fault is reported as usual, kept in
+        #   self.error and not raised;  a halted or faulted VM stays that way until load().
+        if self.status == FAULT or not self.running:
+            return(self.status)
+        self.waiting = False
+        try:
+            if self.engine is None:
+                self.executed += self.execute(max_instructions)
+            else:
+                self.executed += self.engine.run(self, max_instructions)
+        except Exception as error:
+            if self.engine is None:
+                self.executed += self.ran
+            self.output.flush()
+            self.error = error
+            self.running = False
+            self.status = FAULT
+            return(self.status)
+        if self.waiting:
+            self.status = WAITING
+        elif self.running:
+            self.status = RUNNING
+        else:
+            self.output.flush()
+            self.status = HALTED
+        return(self.status)
 
+    async def run_async(self, slice=SLICE):
+        #   run to the end, yielding to the event loop every slice instructions and while
+        #   waiting for input (which needs an input with an async wait(), like QueueInput)
+        while True:
+            status = self.run(slice)
+            if status == RUNNING:
+                await asyncio.sleep(0)
+            elif status == WAITING and hasattr(self.input, "wait"):
+                await self.input.wait()
+            else:
+                return(status)
 
-            while running:
+    def do_vm(self, passmem, passneg0, engine=None):  #   engine:  anything with run(vm), a Profiler or a BlockEngine
+        self.load(passmem, passneg0)
+        self.finish(engine)
+
+    def finish(self, engine=None):  #   run a loaded VM to the end, as do_vm does
+        try:
+            if engine is None:
+                self.execute()
+            else:
+                engine.run(self)
+        except IndexError:
+            self.output.flush()
+            print("\nMemory out of bounds error at instruction", self.pointer)
+            raise
+        finally:
+            self.output.flush()
+
+    def operand(self, p):           #   decode the operand word at p:  (ref, indirect)
+        i = self.memory[p]
+        if i > self.neg0 or i < self.neg_max:
+            self.output.flush()
+            print("Direct memory location", i, "out of bounds", flush=True)
+            raise IndexError
+        if self.memory.is_indirect(p):
+            return(self.memory.address(p), True)
+        return(i, False)
+
+    def fetch(self, p):             #   decode p for the cache, as a native idiom if one starts there
+        instr = self.decode(p)
+        if self.idioms and (instr[0] == 3 or instr[0] == 0) and p not in self.plain:
+            found = recognise(self, p, instr)
+            if found is None:
+                self.plain.add(p)
+            else:
+                run, end = found
+                for w in range(p, end):
+                    self.watch.setdefault(w, set()).add(p)
+                return((8, run, instr, False, 0, False, 0, False))
+        return(instr)
+
+    def forget(self, w):            #   w in positive memory was written;  drop what was decoded from it
+        self.decoded.pop(w, None)
+        self.decoded.pop(w - 1, None)
+        self.decoded.pop(w - 2, None)
+        for start in self.watch.pop(w, ()):
+            self.decoded.pop(start, None)
+        if self.on_write is not None:
+            self.on_write(w)
+
+    def decode(self, p):            #   instruction at p -> (instr_type, A, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind)
+        a = self.memory[p]
+        b = self.memory[p + 1]
+        c = self.memory[p + 2]
+        instr_type = 0
+        a_ref = 0; a_ind = False
+        b_ref = 0; b_ind = False
+        c_ref = 0; c_ind = False
+        if a == 0:
+            instr_type += 4
+        else:
+            a_ref, a_ind = self.operand(p)
+        if b == 0:
+            instr_type += 2
+        else:
+            b_ref, b_ind = self.operand(p + 1)
+        if c == 0:
+            instr_type += 1
+        else:
+            c_ref, c_ind = self.operand(p + 2)
+        return(instr_type, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind)
+
+    def indirect(self, ref):        #   follow a pointer cell, bounds checked every time
+        mem_ref = self.memory[ref]
+        if mem_ref > self.neg0 or mem_ref < self.neg_max:
+            self.output.flush()
+            print("Indirect memory location", mem_ref, "out of bounds", flush=True)
+            raise IndexError
+        return(mem_ref)
+
+    def execute(self, budget=-1):   #   run until halted, or for budget instructions;  -> instructions run
+        start = budget
+        self.waiting = False
+        pointer = self.pointer
+        decoded = self.decoded
+        memory = self.memory
+        running = self.running
+        try:
+            while running and budget != 0:
+                budget -= 1
                 nextpoint = pointer + 3
-                a = self.memory[pointer]
-                b = self.memory[pointer + 1]
-                c = self.memory[pointer + 2]
-                instr_type = 0
-                a_ref = 0; a_val = 0
-                b_ref = 0; b_val = 0
-                c_ref = 0; c_val = 0
-
-                if a == 0:
-                    instr_type += 4
-                else:
-                    a_ref, a_val = mem_eval(a)
-                if b == 0:
-                    instr_type += 2
-                else:
-                    b_ref, b_val = mem_eval(b)
-                if c == 0:
-                    instr_type += 1
-                else:
-                    c_ref, c_val = mem_eval(c)
+                instr = decoded.get(pointer)
+                if instr is None:
+                    instr = decoded[pointer] = self.fetch(pointer)
+                instr_type, a, a_ref, a_ind, b_ref, b_ind, c_ref, c_ind = instr
+                if a_ind:
+                    a_ref = self.indirect(a_ref)
+                if b_ind:
+                    b_ref = self.indirect(b_ref)
+                if c_ind:
+                    c_ref = self.indirect(c_ref)
+                written = -1
+
                 if instr_type == 0:                 #   A B C   C = B - A                   sub
-                    self.memory[c_ref] = self.memory[b_ref] - self.memory[a_ref]
+                    memory[c_ref] = memory[b_ref] - memory[a_ref]
+                    written = c_ref
                 elif instr_type == 1:               #   A B 0   B -= #A                     lit-
-                    self.memory[b_ref] -= a
+                    memory[b_ref] -= a
+                    written = b_ref
                 elif instr_type == 2:               #   A 0 C   if A<=0 call C              call
-                    if a_val <= 0:
+                    if memory[a_ref] <= 0:
                         self.returnstack.append(nextpoint)
                         nextpoint = c_ref
                 elif instr_type == 3:               #   A 0 0   Push A                      push
-                    self.stack.append(a_val)
+                    self.stack.append(memory[a_ref])
                 elif instr_type == 4:               #   0 B C   if B<=0 jump C              jump
-                    if b_val <= 0:
+                    if memory[b_ref] <= 0:
                         nextpoint = c_ref
                 elif instr_type == 5:               #   0 B 0   Pop -> B                    pop
-                    self.memory[b_ref] = self.stack.pop(-1)
+                    memory[b_ref] = self.stack.pop()
+                    written = b_ref
                 elif instr_type == 6:               #   0 0 C   Execute instruction C       exec
-                    execute(c_val)
+                    neg0 = self.neg0
+                    neg_max = self.neg_max
+                    op = self.ops.get(memory[c_ref])
+                    if op is not None:
+                        op(self)
+                    memory = self.memory
+                    if self.neg0 != neg0 or self.neg_max != neg_max:
+                        span = self.span
+                        if span is None or span[0] < self.neg_max or span[1] > self.neg0:
+                            decoded.clear()
+                            self.watch.clear()
                 elif instr_type == 7:               #   0 0 0   Return                      ret
                     if len(self.returnstack) > 0:
-                        nextpoint = self.returnstack.pop(-1)
+                        nextpoint = self.returnstack.pop()
                     else:
 #                        print("\n\nCan't return, halting instead.\n", flush=True)
                         running = False
+                elif instr_type == 8:               #   a recognised idiom, run natively
+                    ran = a(self, budget + 1 if budget >= 0 else -1)
+                    if ran is None:                 #   not this time;  run its first instruction plainly
+                        decoded[pointer] = a_ref
+                        self.pointer = pointer
+                        try:
+                            self.execute(1)
+                        finally:
+                            if decoded.get(pointer) is a_ref:
+                                decoded[pointer] = instr
+                        pointer = self.pointer
+                        running = self.running
+                        memory = self.memory
+                        continue
+                    nextpoint, count = ran
+                    budget -= count - 1
                 else:
+                    self.output.flush()
                     print("\n\nUnexpected error.  How did you do this?", flush=True)
-                    print(pointer, a, b, c, "\n", flush=True)
+                    print(pointer, memory[pointer], memory[pointer + 1], memory[pointer + 2], "\n", flush=True)
                     running = False
                     raise ValueError
 
+                if 0 <= written < self.neg0:        #   self-modifying code
+                    decoded.pop(written, None)
+                    decoded.pop(written - 1, None)
+                    decoded.pop(written - 2, None)
+                    if written in self.watch:
+                        for idiom in self.watch.pop(written):
+                            decoded.pop(idiom, None)
+
                 if nextpoint < 0:
                     running = False
 #                    print("\n\nHalted at:", pointer, "=>", nextpoint, flush=True)
                 else:
                     pointer = nextpoint
-
-
-        except IndexError:
-            print("\nMemory out of bounds error at instruction", pointer)
+        except WaitingForInput:             #   the exec didn't happen;  it's tried again on resume
+            budget += 1
+            self.waiting = True
+        except:
+            budget += 1                     #   the instruction that raised didn't run
             running = False
             raise
+        finally:
+            self.pointer = pointer
+            self.running = running
+            self.ran = start - budget       #   kept for run(), which gets no return value from a fault
+        return(start - budget)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# OISC:3 ahead-of-time compiler tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   A compiled module prints what the VM prints, and programs it can't compile are refused.
+#   python -m unittest test_oisc3_aot (or pytest)
+
+
+import io
+import os
+import unittest
+import unittest.mock
+from oisc3_aot import compile_program
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_parser import Parser
+from oisc3_vm import Oisc3VM
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+COUNT = """
+        /jump   Z Main
+Main:   /lit-   1 Count
+        /push   Count
+        /exec   WriteNum
+        /jump   Count Done
+        /jump   Z Main
+Done:   /push   Text
+        /exec   WriteChar
+        /jump   Z -1
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+Count: 6
+Text: 33
+WriteNum: -2
+WriteChar: -1
+"""
+
+CLUSTER = """
+        /jump   Z Main
+Main:   /exec   VMIndex
+        /exec   WriteNum
+        /jump   Z -1
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+VMIndex: -28
+WriteNum: -2
+"""
+
+
+def compiled(source):
+    #   -> (module's run(), None), or (None, why not)
+    parser = Parser()
+    mem, neg0 = parser.parse(source)
+    program, report = compile_program(mem, neg0, parser.label_table)
+    if program is None:
+        return None, report
+    module = {"__name__": "compiled"}
+    exec(compile(program, "compiled", "exec"), module)
+    return module["run"], None
+
+
+def interpreted(source, text=""):
+    mem, neg0 = Parser().parse(source)
+    stream = io.StringIO()
+    vm = Oisc3VM(StreamInput(text), BufferedOutput(stream, "halt"))
+    vm.load(mem, neg0)
+    return vm.run(), stream.getvalue()
+
+
+class CompileTest(unittest.TestCase):
+
+    def test_same_output_as_the_vm(self):
+        run, report = compiled(COUNT)
+        self.assertIsNone(report)
+        output = io.StringIO()
+        self.assertEqual((run(None, output), output.getvalue()), interpreted(COUNT))
+
+
+    def test_self_modifying_program_refused(self):
+        with open(os.path.join(HERE, "malloc1.o3a"), "r") as o3a_file:
+            source = o3a_file.read()
+        with unittest.mock.patch("sys.stdout", io.StringIO()):
+            run, report = compiled(source)
+        self.assertIsNone(run)
+        self.assertTrue(report)
+
+
+    def test_ops_from_python_refused(self):
+        run, report = compiled(CLUSTER)
+        self.assertIsNone(run)
+        self.assertIn("-28", report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# OISC:3 batch runner tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   python -m unittest test_oisc3_batch (or pytest)
+
+
+import unittest
+from oisc3_batch import run_job
+from oisc3_parser import Parser
+
+
+#   4 instructions, then printing the negative character -2 faults
+FAULTS = """
+        /jump   Z Start
+Start:  /lit-   1 A
+        /lit-   1 A
+        /push   A
+        /exec   WriteChar
+        /jump   Z -1
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+A: 0
+WriteChar: -1
+"""
+
+#   counts down from 100, 3 instructions a turn
+LOOP = """
+        /jump   Z Main
+Main:   /lit-   1 Count
+        /jump   Count Done
+        /jump   Z Main
+Done:   /jump   Z -1
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+Count: 100
+"""
+
+
+def job(source, **options):
+    mem, neg0 = Parser().parse(source)
+    return dict({"program": "test", "image": (mem, neg0)}, **options)
+
+
+class RunJobTest(unittest.TestCase):
+
+    def test_halted(self):
+        result = run_job(job(LOOP))
+        self.assertEqual((result["status"], result["exit"]), ("halted", 0))
+        self.assertEqual(result["instructions"], 1 + 3 * 99 + 2 + 1)
+
+
+    def test_fault_counts_what_ran(self):
+        result = run_job(job(FAULTS))
+        self.assertEqual((result["status"], result["exit"]), ("fault", 1))
+        self.assertEqual(result["instructions"], 4)
+        self.assertIn("at instruction 12", result["output"])
+
+
+    def test_fault_after_many_slices(self):
+        source = LOOP.replace("Count: 100", "Count: 5000").replace("Done:   /jump   Z -1",
+                              "Done:   /lit-   1 Count\n        /push   Count\n        /exec   WriteChar") + "WriteChar: -1\n"
+        result = run_job(job(source))
+        self.assertEqual(result["status"], "fault")
+        self.assertEqual(result["instructions"], 1 + 3 * 4999 + 2 + 2)
+
+
+    def test_budget(self):
+        result = run_job(job(LOOP, budget=50))
+        self.assertEqual((result["status"], result["instructions"]), ("budget", 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
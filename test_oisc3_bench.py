@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# OISC:3 benchmark harness tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   python -m unittest test_oisc3_bench (or pytest)
+
+
+import io
+import unittest
+import unittest.mock
+from oisc3_bench import compare
+
+
+def baseline(loop, engine=None):
+    report = {"results": {"loop": {"size": 1000, "instructions_per_second": loop}}}
+    if engine is not None:
+        report["engine"] = engine
+    return report
+
+
+class CompareTest(unittest.TestCase):
+
+    def test_regression(self):
+        results = baseline(80.0)["results"]
+        regressions = compare(results, baseline(100.0, "interpreter"), 10)
+        self.assertEqual([(name, metric) for name, metric, old, new, change in regressions],
+                         [("loop", "instructions_per_second")])
+        self.assertEqual(compare(results, baseline(85.0, "interpreter"), 10), [])
+
+
+    def test_other_size_skipped(self):
+        results = {"loop": {"size": 2000, "instructions_per_second": 10.0}}
+        self.assertEqual(compare(results, baseline(100.0), 10), [])
+
+
+    def test_engines_must_match(self):
+        results = baseline(500.0)["results"]
+        with unittest.mock.patch("sys.stdout", io.StringIO()):
+            with self.assertRaises(ValueError):
+                compare(results, baseline(100.0, "interpreter"), 10, "blocks")
+            with self.assertRaises(ValueError):
+                compare(baseline(10.0)["results"], baseline(100.0, "blocks"), 10)
+            with self.assertRaises(ValueError):        # an old baseline is the interpreter's
+                compare(results, baseline(100.0), 10, "blocks")
+        self.assertEqual(compare(results, baseline(100.0, "blocks"), 10, "blocks"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
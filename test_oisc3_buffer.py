@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# OISC:3 memory window tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   python -m unittest test_oisc3_buffer (or pytest)
+
+
+import io
+import unittest
+from oisc3_blocks import BlockEngine
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_parser import Parser
+from oisc3_vm import Oisc3VM, RUNNING
+
+
+LOOP = """
+        /jump   Z Loop
+Loop:   /push   A
+        /exec   Print
+        /jump   Z Loop
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+A: 1
+B: 2
+Print: -2
+"""
+
+
+def loaded(engine=None):
+    parser = Parser()
+    mem, neg0 = parser.parse(LOOP)
+    stream = io.StringIO()
+    vm = Oisc3VM(StreamInput(""), BufferedOutput(stream, "halt"))
+    vm.engine = engine
+    vm.load(mem, neg0)
+    vm.labels = parser.label_table
+    return vm, stream
+
+
+class WindowTest(unittest.TestCase):
+
+    def test_read_and_write(self):
+        vm, stream = loaded()
+        with vm.window("A", 2) as data:
+            self.assertEqual(list(data.view), [1, 2])
+            data[1] = 5
+            self.assertEqual(data.address(1), vm.labels["A"] - 1)
+        self.assertEqual(vm.memory[vm.labels["A"] - 1], 5)
+
+
+    def test_read_only(self):
+        vm, stream = loaded()
+        with vm.window("A", 1, writable=False) as data:
+            with self.assertRaises(TypeError):
+                data[0] = 3
+
+
+    def test_patched_code_runs(self):
+        #   rewrite the push operand between runs;  the next run must use the new code
+        for engine in (None, BlockEngine()):
+            with self.subTest(engine=type(engine).__name__):
+                vm, stream = loaded(engine)
+                vm.window(0, 1).release()       # the memory becomes compact before anything runs
+                self.assertEqual(vm.run(300), RUNNING)
+                vm.output.flush()
+                self.assertEqual(set(stream.getvalue()), {"1"})
+                operand = vm.labels["Loop"]
+                with vm.window(operand, 1) as code:
+                    self.assertEqual(code[0], vm.labels["A"])
+                    code[0] = vm.labels["B"]
+                stream.seek(0)
+                stream.truncate()
+                self.assertEqual(vm.run(300), RUNNING)
+                vm.output.flush()
+                self.assertEqual(set(stream.getvalue()), {"2"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# OISC:3 assembly cache tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   python -m unittest test_oisc3_cache (or pytest)
+
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+import oisc3_cache
+from oisc3_cache import AssemblyCache, assemble
+
+
+SOURCE = """
+        /jump   Z -1
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+"""
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = AssemblyCache(directory.name)
+
+
+    def test_hit_matches_miss(self):
+        self.assertIsNone(self.cache.load(SOURCE))
+        first = assemble(SOURCE, self.cache)
+        self.assertIsNotNone(self.cache.load(SOURCE))
+        self.assertEqual(assemble(SOURCE, self.cache), first)
+        self.assertEqual(len(self.cache.entries()), 1)
+
+
+    def test_failed_store_leaves_nothing(self):
+        with unittest.mock.patch.object(oisc3_cache.os, "replace", side_effect=OSError):
+            assemble(SOURCE, self.cache)
+        self.assertEqual(os.listdir(self.cache.directory), [])
+        with unittest.mock.patch.object(oisc3_cache, "write_image", side_effect=OSError):
+            assemble(SOURCE, self.cache)
+        self.assertEqual(os.listdir(self.cache.directory), [])
+        self.assertIsNone(self.cache.load(SOURCE))
+
+
+if __name__ == '__main__':
+    unittest.main()
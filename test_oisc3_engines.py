@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# OISC:3 engine tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   Anything set as vm.engine has run(vm, budget) return the instructions it ran, so a
+#   program halts the same way, with the same count and output, whatever runs it.
+#   python -m unittest test_oisc3_engines (or pytest)
+
+
+import io
+import os
+import unittest
+from oisc3_blocks import BlockEngine
+from oisc3_heatmap import Heatmap
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_profile import Profiler
+from oisc3_trace import Tracer
+from oisc3_vm import Oisc3VM, HALTED, RUNNING
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENGINES = [BlockEngine, Profiler, Heatmap, Tracer]
+
+
+def run(engine, budget=-1):
+    #   -> (status, vm.executed, output) for test4.o3a, in slices of budget instructions
+    stream = io.StringIO()
+    vm = Oisc3VM(StreamInput("q"), BufferedOutput(stream, "halt"))
+    vm.engine = engine
+    vm.load(os.path.join(HERE, "test4.o3a"))
+    status = vm.run(budget)
+    while status == RUNNING:
+        status = vm.run(budget)
+    return status, vm.executed, stream.getvalue()
+
+
+class EngineTest(unittest.TestCase):
+
+    def test_engines_match_the_interpreter(self):
+        status, executed, output = run(None)
+        self.assertEqual(status, HALTED)
+        self.assertGreater(executed, 0)
+        for engine in ENGINES:
+            with self.subTest(engine=engine.__name__):
+                self.assertEqual(run(engine()), (status, executed, output))
+
+
+    def test_engines_count_in_slices(self):
+        whole = run(None)
+        for engine in ENGINES:
+            with self.subTest(engine=engine.__name__):
+                self.assertEqual(run(engine(), 7), whole)
+
+
+if __name__ == '__main__':
+    unittest.main()
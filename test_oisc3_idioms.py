@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# OISC:3 idiom recognizer tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   A program must do the same thing with idioms on and off:  the same memory, output,
+#   status and error.  python -m unittest test_oisc3_idioms (or pytest)
+
+
+import io
+import unittest
+import unittest.mock
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_parser import Parser
+from oisc3_vm import Oisc3VM, HALTED, FAULT
+
+
+ARITHMETIC = """
+        /jump   Z Start
+Start:  /push   A
+        /push   B
+        /exec   Add
+        /pop    C
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+A: 5
+B: 7
+C: 0
+Add: 17
+"""
+
+PRINT_LOOP = """
+        /jump   Z Ploop
+Ploop:  /push   *Ptr
+        /exec   Writechar
+        /lit-   1 Ptr
+        /jump   *Ptr End
+        /jump   Ploop
+End:    /ret
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+Writechar: -1
+Ptr: ?
+"Hello"
+"""
+
+
+def run(source, idioms, max_depth=None):
+    #   -> (status, error type, memory, output)
+    parser = Parser()
+    mem, neg0 = parser.parse(source)
+    stream = io.StringIO()
+    vm = Oisc3VM(StreamInput(""), BufferedOutput(stream, "halt"), max_depth)
+    vm.idioms = idioms
+    vm.load(mem, neg0)
+    with unittest.mock.patch("sys.stdout", io.StringIO()):
+        status = vm.run()
+    return status, type(vm.error), vm.memory.tolist(), stream.getvalue()
+
+
+class IdiomTest(unittest.TestCase):
+
+    def same(self, source, max_depth=None):
+        on = run(source, True, max_depth)
+        off = run(source, False, max_depth)
+        self.assertEqual(on, off)
+        return on
+
+
+    def test_arithmetic(self):
+        status, error, memory, output = self.same(ARITHMETIC)
+        self.assertEqual(status, HALTED)
+        self.assertIn(12, memory)
+
+
+    def test_arithmetic_overflows_limited_stack(self):
+        status, error, memory, output = self.same(ARITHMETIC, max_depth=1)
+        self.assertEqual(status, FAULT)
+        self.assertIs(error, ValueError)
+        self.assertNotIn(12, memory)
+
+
+    def test_print_loop(self):
+        status, error, memory, output = self.same(PRINT_LOOP)
+        self.assertEqual(status, HALTED)
+        self.assertEqual(output, "Hello")
+
+
+    def test_print_loop_overflows_full_stack(self):
+        status, error, memory, output = self.same(PRINT_LOOP, max_depth=0)
+        self.assertEqual(status, FAULT)
+        self.assertEqual(output, "")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# OISC:3 binary image tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   An image written and loaded again is the same program:  the same words, pointers,
+#   labels and behaviour.  python -m unittest test_oisc3_image (or pytest)
+
+
+import io
+import os
+import tempfile
+import unittest
+import unittest.mock
+from oisc3_image import write_image, load_image, is_image, HEADER
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_parser import Parser
+from oisc3_vm import Oisc3VM
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(program, neg0=None):
+    stream = io.StringIO()
+    vm = Oisc3VM(StreamInput("q"), BufferedOutput(stream, "halt"))
+    vm.load(program, neg0)
+    return vm.run(), stream.getvalue(), vm.executed
+
+
+class ImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+
+    def written(self, mem, neg0, labels=None, name="prog.o3i"):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "wb") as o3i_file:
+            write_image(o3i_file, mem, neg0, labels)
+        return path
+
+
+    def test_round_trip(self):
+        parser = Parser()
+        with open(os.path.join(HERE, "test4.o3a"), "r") as o3a_file:
+            mem, neg0 = parser.parse(o3a_file.read())
+        path = self.written(mem, neg0, parser.label_table)
+        self.assertTrue(is_image(path))
+        memory, loaded_neg0, labels = load_image(path)
+        self.assertEqual(loaded_neg0, neg0)
+        self.assertEqual(labels, parser.label_table)
+        self.assertEqual(memory.tolist(), list(mem))
+        for i in range(-(len(mem) - neg0), neg0):   # pointers stay pointers
+            self.assertEqual(type(memory[i]), type(mem[i]), i)
+        self.assertEqual(run(path), run(list(mem), neg0))
+
+
+    def test_boxed_words(self):
+        #   words that don't fit 64 bits, and floats that aren't pointers, go in the side table
+        mem = [0, 2 ** 70, -(2 ** 65), 1.5, float("inf"), 3.0, -1, -2.0]
+        path = self.written(mem, 6)
+        memory, neg0, labels = load_image(path)
+        self.assertEqual(neg0, 6)
+        self.assertEqual(labels, {})
+        self.assertEqual(memory.tolist(), mem)
+        self.assertEqual([type(word) for word in memory.tolist()], [type(word) for word in mem])
+
+
+    def test_header_keeps_words_aligned(self):
+        self.assertEqual(HEADER.size % 8, 0)
+
+
+    def test_not_an_image(self):
+        path = os.path.join(self.directory.name, "prog.o3a")
+        with open(path, "w") as o3a_file:
+            o3a_file.write("/jump Z -1\n")
+        self.assertFalse(is_image(path))
+        with unittest.mock.patch("sys.stdout", io.StringIO()):
+            with self.assertRaises(ValueError):
+                load_image(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
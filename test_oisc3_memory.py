@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# OISC:3 memory tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   python -m unittest test_oisc3_memory (or pytest)
+
+
+import unittest
+from oisc3_memory import PagedMemory, PAGE_SIZE
+
+
+class PagedMemoryTest(unittest.TestCase):
+
+    def test_alloc_reads_zeros_after_a_write_at_the_bound(self):
+        #   address neg0 (and neg_max) is in bounds for the VM, and sits in the page padding
+        for size in (5, PAGE_SIZE - 1, PAGE_SIZE + 3):
+            with self.subTest(size=size):
+                memory = PagedMemory([1] * size + [2] * size, size)
+                memory[size] = 7
+                memory[~size] = 8
+                memory.alloc(4)
+                memory.alloc(-4)
+                self.assertEqual([memory[i] for i in range(size, size + 4)], [0] * 4)
+                self.assertEqual([memory[~i] for i in range(size, size + 4)], [0] * 4)
+                self.assertEqual(memory.tolist(), [1] * size + [0] * 8 + [2] * size)
+
+
+    def test_alloc_after_free_reads_zeros(self):
+        memory = PagedMemory(list(range(1, 11)), 10)
+        memory.free(4)
+        memory.alloc(4)
+        self.assertEqual(memory.tolist(), [1, 2, 3, 4, 5, 6, 0, 0, 0, 0])
+
+
+    def test_fork_shares_until_written(self):
+        memory = PagedMemory([1, 2, 3, 4], 2)
+        other = memory.fork()
+        other[0] = 9
+        other[2] = 9                # at the bound, so the alloc below has to clear it
+        other.alloc(1)
+        self.assertEqual(memory.tolist(), [1, 2, 3, 4])
+        self.assertEqual(other.tolist(), [9, 2, 0, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# OISC:3 peephole optimizer tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   An optimized program must do exactly what the original does, only in fewer words.
+#   python -m unittest test_oisc3_optimize (or pytest)
+
+
+import io
+import os
+import unittest
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_optimize import optimize
+from oisc3_parser import Parser
+from oisc3_vm import Oisc3VM, HALTED
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#   a jump chain, lit- rows that fold (one to nothing), a repeated zeroing, a jump to the
+#   next instruction, a call to a bare ret, and a plain number operand (Tab) left alone
+CHAINS = """
+/jump Z Start
+Hop1: /jump Z Hop2
+Hop2: /jump Z Main
+Start: /jump Z Hop1
+Main: /lit- -5 count
+/lit- 2 count
+/lit- 3 count
+/lit- -3 count
+/sub temp
+/sub temp
+/jump Z Next
+Next: /call Z Nothing
+Loop: /push *Msg*
+/exec WriteChar
+/lit- 1 Msg*
+/lit- 1 count
+/jump *Msg* Done
+/jump Z Loop
+Done: /push count
+/exec WriteNum
+/push CR
+/exec WriteChar
+/push Tab
+/exec WriteNum
+/push CR
+/exec WriteChar
+/jump Z -1
+Nothing: /ret
+Tab: 7 8 9
+
+% --NEGATIVE--: --NEGATIVE--
+msg: "hi there" -1
+Msg*: msg
+count: 0
+temp: 5
+CR: 10
+Z: 0
+WriteChar: -1
+WriteNum: -2
+"""
+
+
+def run(mem, neg0, text=""):
+    #   -> (status, output, instructions run)
+    stream = io.StringIO()
+    vm = Oisc3VM(StreamInput(text), BufferedOutput(stream, "halt"))
+    vm.load(list(mem), neg0)
+    status = vm.run()
+    return status, stream.getvalue(), vm.executed
+
+
+def both(source):
+    #   -> (plain parse, optimized parse), each (mem, neg0), and the optimizer's counts
+    mem, neg0 = Parser().parse(source)
+    parser = Parser()
+    relocatable, neg0_r = parser.parse(source, relocatable=True)
+    new_mem, new_neg0, labels, source_map, counts = optimize(relocatable, neg0_r, parser.relocations,
+                                                             parser.label_table, parser.source_map)
+    return (mem, neg0), (new_mem, new_neg0), counts
+
+
+class OptimizeTest(unittest.TestCase):
+
+    def test_same_output_in_fewer_words(self):
+        plain, optimized, counts = both(CHAINS)
+        self.assertIsNotNone(counts)
+        self.assertGreater(counts["words"], 0)
+        self.assertEqual(len(plain[0]) - len(optimized[0]), counts["words"])
+        before = run(*plain)
+        after = run(*optimized)
+        self.assertEqual(before[0], HALTED)
+        self.assertEqual(after[:2], before[:2])
+        self.assertLess(after[2], before[2])
+
+
+    def test_sample_programs(self):
+        #   test3 and test4 write their own pointers, so they may be left alone, but must still run the same
+        for name in ("test3.o3a", "test4.o3a"):
+            with self.subTest(program=name):
+                with open(os.path.join(HERE, name), "r") as o3a_file:
+                    source = o3a_file.read()
+                plain, optimized, counts = both(source)
+                self.assertEqual(run(*optimized, "q")[:2], run(*plain, "q")[:2])
+                if counts is None:
+                    self.assertEqual(optimized[0], plain[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
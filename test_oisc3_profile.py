@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# OISC:3 profiler tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   python -m unittest test_oisc3_profile (or pytest)
+
+
+import io
+import unittest
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_parser import Parser
+from oisc3_profile import Profiler
+from oisc3_vm import Oisc3VM, HALTED, RUNNING
+
+
+#   Main calls Twice five times;  each call runs 4 instructions in all
+CALLS = """
+        /jump   Z Main
+Main:   /call   Z Twice
+        /lit-   1 Count
+        /jump   Count Done
+        /jump   Z Main
+Done:   /jump   Z -1
+Twice:  /lit-   1 Temp
+        /lit-   1 Temp
+        /lit-   1 Temp
+        /ret
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+Count: 5
+Temp: 0
+"""
+
+
+def profiled(budget=-1):
+    parser = Parser()
+    mem, neg0 = parser.parse(CALLS)
+    profiler = Profiler()
+    vm = Oisc3VM(StreamInput(""), BufferedOutput(io.StringIO(), "halt"))
+    vm.engine = profiler
+    vm.load(mem, neg0)
+    status = vm.run(budget)
+    while status == RUNNING:
+        status = vm.run(budget)
+    return status, profiler, parser.label_table
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_routines(self):
+        status, profiler, labels = profiled()
+        self.assertEqual(status, HALTED)
+        calls, instructions, seconds = profiler.routines[labels["Twice"]]
+        self.assertEqual((calls, instructions), (5, 20))
+        self.assertEqual(profiler.frames, [])
+
+
+    def test_sliced_run_matches(self):
+        #   a routine still open when a slice ends is only closed by its ret
+        status, whole, labels = profiled()
+        for budget in (1, 3, 4, 7):
+            with self.subTest(budget=budget):
+                status, sliced, labels = profiled(budget)
+                self.assertEqual(status, HALTED)
+                self.assertEqual({entry: routine[:2] for entry, routine in sliced.routines.items()},
+                                 {entry: routine[:2] for entry, routine in whole.routines.items()})
+                self.assertEqual(sliced.counts, whole.counts)
+                self.assertEqual(sliced.total, whole.total)
+
+
+if __name__ == '__main__':
+    unittest.main()
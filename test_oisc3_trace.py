@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# OISC:3 execution trace tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   python -m unittest test_oisc3_trace (or pytest)
+
+
+import io
+import os
+import tempfile
+import unittest
+import unittest.mock
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_parser import Parser
+from oisc3_trace import Tracer, load_trace
+from oisc3_vm import Oisc3VM, FAULT
+
+
+#   values too big for a double to hold exactly, or for 64 bits, a fraction, and a pointer
+#   that isn't an address at all
+VALUES = """
+        /jump   Z Start
+Start:  /sub    Small Big Out
+        /lit-   1 Huge
+        /push   Frac
+        /pop    Out
+        /push   *Bad*
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+Small: 1
+Big: 9007199254740993
+Huge: 1180591620717411303424
+Frac: 1.5
+Out: 0
+Bad*: 1180591620717411303424
+"""
+
+
+def traced(source):
+    parser = Parser()
+    mem, neg0 = parser.parse(source)
+    tracer = Tracer(8)
+    vm = Oisc3VM(StreamInput(""), BufferedOutput(io.StringIO(), "halt"))
+    vm.engine = tracer
+    vm.load(mem, neg0)
+    with unittest.mock.patch("sys.stdout", io.StringIO()):
+        status = vm.run()
+    return status, tracer, parser.label_table
+
+
+class TraceTest(unittest.TestCase):
+
+    def test_values_are_exact(self):
+        status, tracer, labels = traced(VALUES)
+        self.assertEqual(status, FAULT)
+        records = tracer.records()
+        sub, lit, push, pop = records[1:5]
+        self.assertEqual(sub[6:], (1, 2 ** 53 + 1, 2 ** 53))
+        self.assertEqual(lit[6:], (1, 2 ** 70, 2 ** 70 - 1))
+        self.assertEqual(push[6:], (1.5, None, None))
+        self.assertIs(type(push[6]), float)
+        self.assertEqual(pop[8], 1.5)
+
+
+    def test_bad_address_resets_the_slot(self):
+        #   the first pass fills every slot, so the faulting record reuses one
+        source = VALUES.replace("Start:  /sub", "Start:  /jump   Z Next\nNext:   /jump   Z Next2\nNext2:  /jump   Z Next3\nNext3:  /sub")
+        status, tracer, labels = traced(source)
+        self.assertEqual(status, FAULT)
+        self.assertGreater(tracer.recorded, tracer.size)
+        fault = tracer.records()[-1]
+        self.assertEqual(fault[1], 3)                       # push
+        self.assertEqual(fault[2:5], (0, 0, 0))
+        self.assertEqual(fault[6:], (None, None, None))
+
+
+    def test_save_and_load(self):
+        status, tracer, labels = traced(VALUES)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.o3t")
+            tracer.save_to(path)
+            records, recorded = load_trace(path)
+        self.assertEqual(recorded, tracer.recorded)
+        self.assertEqual(records, tracer.records())
+        self.assertEqual([type(x) for record in records for x in record],
+                         [type(x) for record in tracer.records() for x in record])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# OISC:3 virtual machine tests
+# Copyright (C) 2022 McChuck
+# Released under GNU General Public License
+# See LICENSE for more details.
+
+#   The coprocessor table, register_op, and programs run end to end.
+#   python -m unittest test_oisc3_vm (or pytest)
+
+
+import io
+import math
+import unittest
+import unittest.mock
+from oisc3_io import BufferedOutput, StreamInput
+from oisc3_parser import Parser
+from oisc3_vm import Oisc3VM, coprocessor, HALTED, FAULT
+
+
+UNARY_OP = """
+        /jump   Z Start
+Start:  /push   A
+        /exec   Op
+        /exec   WriteNum
+% --NEGATIVE--: --NEGATIVE--
+Z: 0
+A: 2
+Op: {}
+WriteNum: -2
+"""
+
+
+def vm_with(stack=()):
+    vm = Oisc3VM(StreamInput(""), BufferedOutput(io.StringIO(), "halt"))
+    for item in stack:
+        vm.stack.append(item)
+    return vm
+
+
+def run(source, vm=None):
+    #   -> (status, output)
+    parser = Parser()
+    mem, neg0 = parser.parse(source)
+    stream = io.StringIO()
+    if vm is None:
+        vm = Oisc3VM(StreamInput(""))
+    vm.output = BufferedOutput(stream, "halt")
+    vm.load(mem, neg0)
+    with unittest.mock.patch("sys.stdout", io.StringIO()):
+        status = vm.run()
+    return status, stream.getvalue()
+
+
+class DispatchTest(unittest.TestCase):
+
+    def test_table_covers_every_op(self):
+        self.assertEqual(set(coprocessor), set(range(-25, 27)))
+        for op, handler in coprocessor.items():
+            self.assertTrue(callable(handler), op)
+
+
+    def test_stack_ops(self):
+        cases = [(3, [1, 2], [1, 2, 2]), (-3, [1, 2], [1]), (4, [1, 2], [1, 2, 1]), (-4, [1, 2], [2, 1]),
+                 (5, [1, 2, 3, 4], [4, 1, 2, 3]), (-5, [1, 2, 3, 4], [2, 3, 4, 1]),
+                 (6, [1, 2, 3], [3, 2, 1]), (-6, [1, 2], []), (7, [5, 6], [5, 6, 2]),
+                 (-7, [7, 8, 9, 2], [7, 8, 9, 8]), (8, [], [-1]), (-8, [], [0]),
+                 (17, [5, 7], [12]), (-17, [5, 7], [-2]), (12, [3, 4], [12]), (13, [7, 2], [3]),
+                 (-13, [7, 2], [1]), (9, [6, 3], [2]), (-9, [0], [-1]), (15, [2.5], [2]), (-15, [2], [2.0])]
+        for op, before, after in cases:
+            with self.subTest(op=op):
+                vm = vm_with(before)
+                vm.ops[op](vm)
+                self.assertEqual(list(vm.stack), after)
+
+
+    def test_asinh(self):           #   op -21 once called math.hsinh, which doesn't exist
+        vm = vm_with([1])
+        vm.ops[-21](vm)
+        self.assertAlmostEqual(vm.stack.pop(), math.asinh(1))
+        status, output = run(UNARY_OP.format(-21))
+        self.assertEqual(status, HALTED)
+        self.assertEqual(output, str(math.asinh(2)))
+
+
+    def test_unary_functions(self):
+        for op, function in [(14, math.exp), (18, math.sin), (19, math.cos), (20, math.tan), (21, math.sinh),
+                             (-20, math.atan), (22, math.cosh), (-22, math.acosh), (23, math.tanh)]:
+            with self.subTest(op=op):
+                status, output = run(UNARY_OP.format(op))
+                self.assertEqual((status, output), (HALTED, str(function(2))))
+
+
+    def test_unknown_op_does_nothing(self):
+        status, output = run(UNARY_OP.format(99))
+        self.assertEqual((status, output), (HALTED, "2"))
+
+
+class RegisterOpTest(unittest.TestCase):
+
+    def test_register_op(self):
+        vm = Oisc3VM(StreamInput(""))
+        vm.register_op(99, lambda vm: vm.stack.append(vm.stack.pop() * 10))
+        status, output = run(UNARY_OP.format(99), vm)
+        self.assertEqual((status, output), (HALTED, "20"))
+
+
+    def test_replace_a_stock_op(self):
+        vm = Oisc3VM(StreamInput(""))
+        vm.register_op(-21, lambda vm: vm.stack.append(-vm.stack.pop()))
+        self.assertEqual(run(UNARY_OP.format(-21), vm), (HALTED, "-2"))
+
+
+    def test_ops_belong_to_one_vm(self):
+        vm = Oisc3VM(StreamInput(""))
+        vm.register_op(99, lambda vm: None)
+        vm.register_op(3, lambda vm: None)
+        self.assertNotIn(99, coprocessor)
+        self.assertNotIn(99, Oisc3VM(StreamInput("")).ops)
+        self.assertIsNot(Oisc3VM(StreamInput("")).ops[3], vm.ops[3])
+
+
+    def test_op_must_be_an_int(self):
+        vm = Oisc3VM(StreamInput(""))
+        with unittest.mock.patch("sys.stdout", io.StringIO()):
+            with self.assertRaises(ValueError):
+                vm.register_op(1.5, lambda vm: None)
+            with self.assertRaises(ValueError):
+                vm.register_op("99", lambda vm: None)
+
+
+    def test_a_failing_op_faults(self):
+        vm = Oisc3VM(StreamInput(""))
+
+        def broken(vm):
+            raise ValueError
+        vm.register_op(99, broken)
+        status, output = run(UNARY_OP.format(99), vm)
+        self.assertEqual(status, FAULT)
+        self.assertIs(type(vm.error), ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()